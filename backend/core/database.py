@@ -1,40 +1,55 @@
+import asyncio
 import datetime
+import io
 import json
 import logging
 import os
+import queue
 import signal
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from xmlrpc.client import ServerProxy
 
 import psycopg2.extras
 import pytricia
 import redis
-import yaml
 from kombu import Connection
 from kombu import Consumer
 from kombu import Exchange
+from kombu import Producer
 from kombu import Queue
 from kombu import uuid
 from kombu.mixins import ConsumerProducerMixin
 from utils import BACKEND_SUPERVISOR_URI
+from utils import DBPool
+from utils import decode_hijack
+from utils import DETECTION_SHARDING
+from utils import encode_hijack
 from utils import flatten
-from utils import get_db_conn
 from utils import get_hash
 from utils import get_ip_version
 from utils import get_logger
+from utils import get_named_cursor
 from utils import get_ro_cursor
+from utils import get_savepoint_cursor
 from utils import get_wo_cursor
 from utils import hijack_log_field_formatter
 from utils import HISTORIC
+from utils import KEY_ENCODING
+from utils import legacy_redis_key
 from utils import ModulesState
 from utils import MON_SUPERVISOR_URI
 from utils import ping_redis
 from utils import purge_redis_eph_pers_keys
+from utils import purge_redis_eph_pers_keys_bulk
 from utils import RABBITMQ_URI
 from utils import REDIS_HOST
 from utils import redis_key
 from utils import REDIS_PORT
 from utils import search_worst_prefix
+from utils import SeenFilter
 from utils import SetEncoder
 from utils import translate_asn_range
 from utils import translate_rfc2622
@@ -42,6 +57,8 @@ from utils import translate_rfc2622
 # import os
 
 log = get_logger()
+# "kombu" (synchronous consumer) or "lanes" (handlers on lanes of threads)
+DB_RUNTIME = os.getenv("DB_RUNTIME", "kombu")
 TABLES = ["bgp_updates", "hijacks", "configs"]
 VIEWS = ["view_configs", "view_bgpupdates", "view_hijacks"]
 
@@ -68,6 +85,85 @@ class HijackLogFilter(logging.Filter):
 mail_log.addFilter(HijackLogFilter())
 hij_log.addFilter(HijackLogFilter())
 
+BGP_UPDATES_COLUMNS = (
+    "prefix",
+    "key",
+    "origin_as",
+    "peer_asn",
+    "as_path",
+    "service",
+    "type",
+    "communities",
+    "timestamp",
+    "handled",
+    "matched_prefix",
+    "orig_path",
+)
+
+# deletes the bgp updates of the given hijacks (array, twice), unless they
+# belong to other hijacks too
+DELETE_HIJACK_BGP_UPDATES_QUERY = (
+    "DELETE FROM bgp_updates USING hijack_bgp_updates AS hb "
+    "WHERE hb.hijack_key = ANY(%s) AND bgp_updates.key=hb.update_key AND bgp_updates.timestamp=hb.update_timestamp "
+    "AND NOT EXISTS (SELECT 1 FROM hijack_bgp_updates AS other WHERE other.update_key=hb.update_key "
+    "AND other.update_timestamp=hb.update_timestamp AND other.hijack_key <> ALL(%s));"
+)
+
+# links the bgp updates (update_keys) of hijacks (hijack_keys, parallel to
+# the former) to them, removes from the peers_withdrawn of each hijack the
+# peers whose latest announcement follows their latest withdrawal, and marks
+# the bgp updates (handled_keys) handled, all in a single statement
+UPDATE_BGP_UPDATES_QUERY = (
+    "WITH data AS (SELECT * FROM unnest(%(hijack_keys)s::text[], %(update_keys)s::text[]) "
+    "AS data (hijack_key, update_key)), "
+    "linked AS (INSERT INTO hijack_bgp_updates (hijack_key, update_key, update_timestamp) "
+    "SELECT data.hijack_key, bgp_updates.key, bgp_updates.timestamp FROM data "
+    "JOIN bgp_updates ON (bgp_updates.key=data.update_key AND bgp_updates.timestamp >= %(timestamp_thres)s) "
+    "ON CONFLICT DO NOTHING), "
+    "reannounced AS (SELECT data.hijack_key, ann.peer_asn FROM data "
+    "JOIN bgp_updates AS ann ON (ann.key=data.update_key AND ann.timestamp >= %(timestamp_thres)s AND ann.type='A') "
+    "JOIN hijack_bgp_updates AS hw ON (hw.hijack_key=data.hijack_key) "
+    "JOIN bgp_updates AS wit ON (wit.key=hw.update_key AND wit.timestamp=hw.update_timestamp "
+    "AND wit.timestamp >= %(timestamp_thres)s AND wit.type='W' AND wit.prefix=ann.prefix AND wit.peer_asn=ann.peer_asn) "
+    "GROUP BY data.hijack_key, ann.peer_asn HAVING max(wit.timestamp) < max(ann.timestamp)), "
+    "reconciled AS (UPDATE hijacks SET peers_withdrawn=ARRAY(SELECT peer_asn FROM unnest(hijacks.peers_withdrawn) "
+    "AS peer_asn WHERE peer_asn <> ALL(removed.peer_asns)) "
+    "FROM (SELECT hijack_key, array_agg(peer_asn) AS peer_asns FROM reannounced GROUP BY hijack_key) AS removed "
+    "WHERE hijacks.key=removed.hijack_key) "
+    "UPDATE bgp_updates SET handled=true WHERE key = ANY(%(handled_keys)s) AND handled=false"
+)
+
+# the stats counters row triggers of bgp updates are off for the bulk
+# statements in between, whose deltas are appended once instead
+STATS_COUNTERS_OFF_QUERY = (
+    "SELECT set_config('stats_counters.bgp_updates', 'off', true);"
+)
+STATS_COUNTERS_ON_QUERY = "SELECT set_config('stats_counters.bgp_updates', 'on', true);"
+ADD_BGP_UPDATES_STATS_QUERY = (
+    "INSERT INTO stats_counters_deltas (name, delta) SELECT * FROM (VALUES "
+    "('total_bgp_updates', %s::bigint), ('total_unhandled_updates', %s::bigint)) "
+    "AS deltas (name, delta) WHERE delta <> 0;"
+)
+
+
+def copy_text_value(value):
+    """
+    Formats a value as a column of postgres' COPY text format.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, list):
+        value = "{{{}}}".format(",".join(map(str, value)))
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
 
 class Database:
     def __init__(self):
@@ -77,33 +173,42 @@ class Database:
         signal.signal(signal.SIGCHLD, signal.SIG_IGN)
 
     def run(self):
-        # read-only connection
-        ro_conn = get_db_conn()
-        ro_conn.set_session(autocommit=True, readonly=True)
-        # write-only connection
-        wo_conn = get_db_conn()
+        # read-only connections (on the read replica, if any)
+        ro_pool = DBPool(readonly=True)
+        # write-only connections
+        wo_pool = DBPool()
         try:
             with Connection(RABBITMQ_URI) as connection:
-                self.worker = self.Worker(connection, ro_conn, wo_conn)
-                self.worker.run()
+                if DB_RUNTIME == "lanes":
+                    self.worker = self.LaneWorker(connection, ro_pool, wo_pool)
+                    self.worker.run_lanes()
+                else:
+                    self.worker = self.Worker(connection, ro_pool, wo_pool)
+                    # wake up often enough to flush the buffered entries on time
+                    self.worker.run(safety_interval=min(self.worker.flush_max_age, 1))
         except Exception:
             log.exception("exception")
         finally:
             log.info("stopped")
-            ro_conn.close()
-            wo_conn.close()
+            ro_pool.closeall()
+            wo_pool.closeall()
 
     def exit(self, signum, frame):
         if self.worker:
             self.worker.should_stop = True
 
     class Worker(ConsumerProducerMixin):
-        def __init__(self, connection, ro_conn, wo_conn):
+        def __init__(self, connection, ro_pool, wo_pool):
             self.connection = connection
             self.prefix_tree = None
+            # digests of the rules of every configured prefix
+            self.rule_digests = {}
             self.monitored_prefixes = set()
             self.configured_prefix_count = 0
             self.monitor_peers = 0
+            # monitor/peer ASNs known locally and not yet stored in redis
+            self.peer_asns = set()
+            self.new_peer_asns = set()
             self.rules = None
             self.timestamp = -1
             self.insert_bgp_entries = []
@@ -111,13 +216,43 @@ class Database:
             self.handled_bgp_entries = set()
             self.outdate_hijacks = set()
             self.insert_hijacks_entries = {}
+            # (hijack key, bgp update key) links to retry
+            self.hijack_bgp_entries = set()
+            # the buffered entries are flushed when they are enough, when the
+            # oldest of them has waited long enough or when hijacks arrive;
+            # the scheduler clock is only a fallback heartbeat
+            self.flush_max_entries = int(os.getenv("DB_FLUSH_MAX_ENTRIES", 10000))
+            self.flush_max_age = float(os.getenv("DB_FLUSH_MAX_AGE", 1))
+            self.flush_on_hijack = os.getenv("DB_FLUSH_ON_HIJACK", "true") == "true"
+            # entries failing this many bulks are dropped
+            self.flush_max_attempts = int(os.getenv("DB_FLUSH_MAX_ATTEMPTS", 5))
+            # (bulk part, entry id): failed bulks, of the buffered entries
+            self.bulk_attempts = {}
+            self.bulk_started = None
+            # ongoing hijacks (or updates to rekey) are replayed to detection
+            # in batches of this size
+            self.replay_batch_size = int(os.getenv("DB_REPLAY_BATCH_SIZE", 1000))
+            # redis is bootstrapped from the database in chunks of this size
+            self.bootstrap_chunk_size = int(os.getenv("DB_BOOTSTRAP_CHUNK_SIZE", 10000))
+            # bulk operations are applied by a background writer, while the
+            # consumer keeps buffering
+            self.bulk_queue = queue.Queue()
+            self.bulk_writer_idle = threading.Event()
+            self.bulk_writer_idle.set()
+            # entries of the last bulk that were rolled back, to be retried
+            self.unapplied_bulk = None
+            self.bulk_producer = None
+            self.bulk_writer_thread = threading.Thread(
+                target=self.bulk_writer, daemon=True
+            )
+            self.bulk_writer_thread.start()
 
             # DB variables
-            self.ro_conn = ro_conn
-            self.wo_conn = wo_conn
+            self.ro_pool = ro_pool
+            self.wo_pool = wo_pool
 
             try:
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_wo_cursor(self.wo_pool) as db_cur:
                     db_cur.execute("TRUNCATE table process_states")
 
                 query = (
@@ -133,7 +268,7 @@ class Database:
                         if x["name"] != "listener"
                     ]
 
-                    with get_wo_cursor(self.wo_conn) as db_cur:
+                    with get_wo_cursor(self.wo_pool) as db_cur:
                         psycopg2.extras.execute_batch(db_cur, query, processes)
 
             except Exception:
@@ -153,7 +288,7 @@ class Database:
                         if x["group"] in ["monitor", "detection", "mitigation"]
                     ]
 
-                    with get_wo_cursor(self.wo_conn) as db_cur:
+                    with get_wo_cursor(self.wo_pool) as db_cur:
                         psycopg2.extras.execute_batch(db_cur, query, processes)
 
             except Exception:
@@ -162,6 +297,8 @@ class Database:
             # redis db
             self.redis = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
             ping_redis(self.redis)
+            # seen bgp updates of the last 2 hours
+            self.seen_updates = SeenFilter(self.redis, "seen-updates")
             self.bootstrap_redis()
 
             # EXCHANGES
@@ -199,6 +336,15 @@ class Database:
             )
             self.hijack_hashing.declare()
 
+            self.detection_hashing = Exchange(
+                "detection-hashing",
+                channel=connection,
+                type="x-consistent-hash",
+                durable=False,
+                delivery_mode=1,
+            )
+            self.detection_hashing.declare()
+
             self.handled_exchange = Exchange(
                 "handled-update", type="direct", durable=False, delivery_mode=1
             )
@@ -445,7 +591,7 @@ class Database:
             try:
                 query = "SELECT name, running FROM intended_process_states"
 
-                with get_ro_cursor(self.ro_conn) as db_cur:
+                with get_ro_cursor(self.ro_pool) as db_cur:
                     db_cur.execute(query)
                     entries = db_cur.fetchall()
                 modules_state = ModulesState()
@@ -500,79 +646,93 @@ class Database:
 
         def handle_bgp_update(self, message):
             # log.debug('message: {}\npayload: {}'.format(message, message.payload))
-            msg_ = message.payload
-            # prefix, key, origin_as, peer_asn, as_path, service, type, communities,
-            # timestamp, hijack_key, handled, matched_prefix, orig_path
+            msgs_ = message.payload
+            # single BGP updates (monitors) or batches of them (detection)
+            if isinstance(msgs_, dict):
+                msgs_ = [msgs_]
 
-            if not self.redis.getset(msg_["key"], "1"):
-                best_match = (
-                    self.find_best_prefix_match(msg_["prefix"]),
-                )  # matched_prefix
+            # checking also resets the timer of already seen BGP updates
+            try:
+                seen = self.seen_updates.check_and_add([msg_["key"] for msg_ in msgs_])
+            except Exception:
+                log.exception("exception")
+                return
 
-                if not best_match:
-                    return
+            for (msg_, seen_) in zip(msgs_, seen):
+                # prefix, key, origin_as, peer_asn, as_path, service, type, communities,
+                # timestamp, handled, matched_prefix, orig_path
+                if not seen_:
+                    self.__handle_bgp_update(msg_)
 
-                try:
-                    origin_as = -1
-                    if len(msg_["path"]) >= 1:
-                        origin_as = msg_["path"][-1]
+            if not all(seen):
+                self.buffered()
+
+        def __handle_bgp_update(self, msg_):
+            # matched_prefix (NULL if there is no match)
+            best_match = self.find_best_prefix_match(msg_["prefix"])
 
+            try:
+                origin_as = -1
+                if len(msg_["path"]) >= 1:
+                    origin_as = msg_["path"][-1]
+
+                value = (
+                    msg_["prefix"],  # prefix
+                    msg_["key"],  # key
+                    origin_as,  # origin_as
+                    msg_["peer_asn"],  # peer_asn
+                    msg_["path"],  # as_path
+                    msg_["service"],  # service
+                    msg_["type"],  # type
+                    json.dumps(
+                        [(k["asn"], k["value"]) for k in msg_["communities"]]
+                    ),  # communities
+                    datetime.datetime.fromtimestamp((msg_["timestamp"])),  # timestamp
+                    False,  # handled
+                    best_match,
+                    json.dumps(msg_["orig_path"]),  # orig_path
+                )
+                # insert all types of BGP updates
+                self.insert_bgp_entries.append(value)
+
+                # register the monitor/peer ASN from whom we learned this BGP update
+                # (stored in redis on the next bulk operation)
+                if msg_["peer_asn"] not in self.peer_asns:
+                    self.peer_asns.add(msg_["peer_asn"])
+                    self.new_peer_asns.add(msg_["peer_asn"])
+            except Exception:
+                log.exception("{}".format(msg_))
+
+        def handle_withdraw_update(self, message):
+            # log.debug('message: {}\npayload: {}'.format(message, message.payload))
+            msgs_ = message.payload
+            # single withdrawals or batches of them (detection)
+            if isinstance(msgs_, dict):
+                msgs_ = [msgs_]
+
+            for msg_ in msgs_:
+                try:
+                    # update hijacks based on withdrawal messages
                     value = (
                         msg_["prefix"],  # prefix
-                        msg_["key"],  # key
-                        origin_as,  # origin_as
                         msg_["peer_asn"],  # peer_asn
-                        msg_["path"],  # as_path
-                        msg_["service"],  # service
-                        msg_["type"],  # type
-                        json.dumps(
-                            [(k["asn"], k["value"]) for k in msg_["communities"]]
-                        ),  # communities
                         datetime.datetime.fromtimestamp(
                             (msg_["timestamp"])
                         ),  # timestamp
-                        [],  # hijack_key
-                        False,  # handled
-                        best_match,
-                        json.dumps(msg_["orig_path"]),  # orig_path
+                        msg_["key"],  # key
                     )
-                    # insert all types of BGP updates
-                    self.insert_bgp_entries.append(value)
-
-                    # register the monitor/peer ASN from whom we learned this BGP update
-                    self.redis.sadd("peer-asns", msg_["peer_asn"])
-                    if self.redis.scard("peer-asns") != self.monitor_peers:
-                        self.monitor_peers = self.redis.scard("peer-asns")
-                        with get_wo_cursor(self.wo_conn) as db_cur:
-                            db_cur.execute(
-                                "UPDATE stats SET monitor_peers=%s;",
-                                (self.monitor_peers,),
-                            )
+                    self.handle_bgp_withdrawals.add(value)
                 except Exception:
                     log.exception("{}".format(msg_))
-            # reset timer each time we hit the same BGP update
-            self.redis.expire(msg_["key"], 2 * 60 * 60)
 
-        def handle_withdraw_update(self, message):
-            # log.debug('message: {}\npayload: {}'.format(message, message.payload))
-            msg_ = message.payload
-            try:
-                # update hijacks based on withdrawal messages
-                value = (
-                    msg_["prefix"],  # prefix
-                    msg_["peer_asn"],  # peer_asn
-                    datetime.datetime.fromtimestamp((msg_["timestamp"])),  # timestamp
-                    msg_["key"],  # key
-                )
-                self.handle_bgp_withdrawals.add(value)
-            except Exception:
-                log.exception("{}".format(msg_))
+            self.buffered()
 
         def handle_hijack_outdate(self, message):
             # log.debug('message: {}\npayload: {}'.format(message, message.payload))
             try:
                 raw = message.payload
                 self.outdate_hijacks.add((raw["persistent_hijack_key"],))
+                self.buffered()
             except Exception:
                 log.exception("{}".format(message))
 
@@ -585,49 +745,8 @@ class Database:
                 if not self.redis.sismember("persistent-keys", key):
                     # fetch BGP updates with deprecated hijack keys and
                     # republish to detection
-                    rekey_update_keys = list(msg_["monitor_keys"])
-                    rekey_updates = []
                     try:
-                        query = (
-                            "SELECT key, prefix, origin_as, peer_asn, as_path, service, "
-                            "type, communities, timestamp FROM bgp_updates "
-                            "WHERE bgp_updates.handled=false AND bgp_updates.key = %s"
-                        )
-
-                        with get_ro_cursor(self.ro_conn) as db_cur:
-                            psycopg2.extras.execute_batch(
-                                db_cur, query, (rekey_update_keys,), page_size=1000
-                            )
-                            entries = db_cur.fetchall()
-
-                        for entry in entries:
-                            rekey_updates.append(
-                                {
-                                    "key": entry[0],  # key
-                                    "prefix": entry[1],  # prefix
-                                    "origin_as": entry[2],  # origin_as
-                                    "peer_asn": entry[3],  # peer_asn
-                                    "path": entry[4],  # as_path
-                                    "service": entry[5],  # service
-                                    "type": entry[6],  # type
-                                    "communities": entry[7],  # communities
-                                    "timestamp": entry[8].timestamp(),
-                                }
-                            )
-
-                        # delete monitor keys from redis so that they can be
-                        # reprocessed
-                        for key in rekey_update_keys:
-                            self.redis.delete(key)
-
-                        # send to detection
-                        self.producer.publish(
-                            rekey_updates,
-                            exchange=self.update_exchange,
-                            routing_key="hijack-rekey",
-                            retry=False,
-                            priority=1,
-                        )
+                        self.rekey_hijack_updates(msg_)
                     except Exception:
                         log.exception("exception")
                     return
@@ -695,26 +814,92 @@ class Database:
                     self.insert_hijacks_entries[key]["community_annotation"] = msg_[
                         "community_annotation"
                     ]
+                # hijacks are flushed with low latency
+                self.buffered(urgent=self.flush_on_hijack)
             except Exception:
                 log.exception("{}".format(msg_))
 
+        def rekey_hijack_updates(self, msg_):
+            """
+            Republishes the unhandled bgp updates of a hijack with a deprecated
+            key to detection, in bounded batches. They are fetched at once,
+            within the time span of the hijack so that only the relevant
+            chunks of the hypertable are scanned.
+            """
+            query = (
+                "SELECT key, prefix, origin_as, peer_asn, as_path, service, "
+                "type, communities, timestamp FROM bgp_updates "
+                "WHERE bgp_updates.handled=false AND bgp_updates.key = ANY(%s) "
+                "AND bgp_updates.timestamp >= %s AND bgp_updates.timestamp <= %s"
+            )
+
+            with get_ro_cursor(self.ro_pool) as db_cur:
+                db_cur.execute(
+                    query,
+                    (
+                        list(msg_["monitor_keys"]),
+                        datetime.datetime.fromtimestamp(msg_["time_started"]),
+                        datetime.datetime.fromtimestamp(msg_["time_last"]),
+                    ),
+                )
+                entries = db_cur.fetchall()
+
+            rekey_updates = []
+            for entry in entries:
+                rekey_updates.append(
+                    {
+                        "key": entry[0],  # key
+                        "prefix": entry[1],  # prefix
+                        "origin_as": entry[2],  # origin_as
+                        "peer_asn": entry[3],  # peer_asn
+                        "path": entry[4],  # as_path
+                        "service": entry[5],  # service
+                        "type": entry[6],  # type
+                        "communities": entry[7],  # communities
+                        "timestamp": entry[8].timestamp(),
+                    }
+                )
+            if not rekey_updates:
+                return
+
+            # send to detection
+            if DETECTION_SHARDING == "true":
+                self.publish_detection_shards(
+                    rekey_updates, bucket_size=self.replay_batch_size
+                )
+            else:
+                for i in range(0, len(rekey_updates), self.replay_batch_size):
+                    self.producer.publish(
+                        rekey_updates[i : i + self.replay_batch_size],
+                        exchange=self.update_exchange,
+                        routing_key="hijack-rekey",
+                        retry=False,
+                        priority=1,
+                    )
+
         def handle_handled_bgp_update(self, message):
             # log.debug('message: {}\npayload: {}'.format(message, message.payload))
             try:
-                key_ = (message.payload,)
-                self.handled_bgp_entries.add(key_)
+                # single keys or batches of them (detection)
+                keys_ = message.payload
+                if not isinstance(keys_, list):
+                    keys_ = [keys_]
+                for key_ in keys_:
+                    self.handled_bgp_entries.add((key_,))
+                self.buffered()
             except Exception:
                 log.exception("{}".format(message))
 
         def build_prefix_tree(self):
             log.info("Starting building database prefix tree...")
-            self.prefix_tree = {
-                "v4": pytricia.PyTricia(32),
-                "v6": pytricia.PyTricia(128),
-            }
+            # built aside and swapped in at once, as it may be in use
+            prefix_tree = {"v4": pytricia.PyTricia(32), "v6": pytricia.PyTricia(128)}
             raw_prefix_count = 0
+            prefix_rules = {}
             for rule in self.rules:
                 try:
+                    # before the rule is translated in place
+                    rule_digest = get_hash(rule)
                     rule_translated_origin_asn_set = set()
                     for asn in rule["origin_asns"]:
                         this_translated_asn_list = flatten(translate_asn_range(asn))
@@ -736,20 +921,26 @@ class Database:
                     for prefix in rule["prefixes"]:
                         for translated_prefix in translate_rfc2622(prefix):
                             ip_version = get_ip_version(translated_prefix)
-                            if self.prefix_tree[ip_version].has_key(translated_prefix):
-                                node = self.prefix_tree[ip_version][translated_prefix]
+                            if prefix_tree[ip_version].has_key(translated_prefix):
+                                node = prefix_tree[ip_version][translated_prefix]
                             else:
                                 node = {
                                     "prefix": translated_prefix,
                                     "data": {"confs": []},
                                 }
-                                self.prefix_tree[ip_version].insert(
-                                    translated_prefix, node
-                                )
+                                prefix_tree[ip_version].insert(translated_prefix, node)
                             node["data"]["confs"].append(conf_obj)
+                            prefix_rules.setdefault(translated_prefix, []).append(
+                                rule_digest
+                            )
                             raw_prefix_count += 1
                 except Exception:
                     log.exception("Exception")
+            self.prefix_tree = prefix_tree
+            self.rule_digests = {
+                prefix: get_hash(rule_digests)
+                for (prefix, rule_digests) in prefix_rules.items()
+            }
             log.info(
                 "{} prefixes integrated in database prefix tree in total".format(
                     raw_prefix_count
@@ -770,7 +961,7 @@ class Database:
                     if monitored_prefix:
                         self.monitored_prefixes.add(monitored_prefix)
             try:
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_wo_cursor(self.wo_pool) as db_cur:
                     db_cur.execute(
                         "UPDATE stats SET monitored_prefixes=%s, configured_prefixes=%s;",
                         (len(self.monitored_prefixes), self.configured_prefix_count),
@@ -785,6 +976,33 @@ class Database:
                 return self.prefix_tree[ip_version].get_key(prefix)
             return None
 
+        def find_detection_shard(self, prefix):
+            # detection shards are keyed on the configured super-prefix, so that
+            # all the (more specific) prefixes it covers share a detector
+            ip_version = get_ip_version(prefix)
+            monitored_prefix = search_worst_prefix(prefix, self.prefix_tree[ip_version])
+            if monitored_prefix:
+                return monitored_prefix
+            return prefix
+
+        def publish_detection_shards(self, updates, bucket_size=None, producer=None):
+            producer = producer or self.producer
+            shards = {}
+            for update in updates:
+                shards.setdefault(
+                    self.find_detection_shard(update["prefix"]), []
+                ).append(update)
+            for (shard, shard_updates) in shards.items():
+                shard_bucket_size = bucket_size or len(shard_updates)
+                for i in range(0, len(shard_updates), shard_bucket_size):
+                    producer.publish(
+                        shard_updates[i : i + shard_bucket_size],
+                        exchange=self.detection_hashing,
+                        routing_key=shard,
+                        retry=False,
+                        priority=1,
+                    )
+
         def handle_config_notify(self, message):
             log.info("Reconfiguring database due to conf update...")
 
@@ -856,66 +1074,253 @@ class Database:
             if not last_timestamp or timestamp > float(last_timestamp):
                 self.redis.set("last_handled_timestamp", timestamp)
                 try:
-                    results = []
-                    query = (
-                        "SELECT b.key, b.prefix, b.origin_as, b.as_path, b.type, b.peer_asn, "
-                        "b.communities, b.timestamp, b.service, b.matched_prefix, h.key, h.hijack_as, h.type "
-                        "FROM hijacks AS h LEFT JOIN bgp_updates AS b ON (h.key = ANY(b.hijack_key)) "
-                        "WHERE h.active = true AND b.handled=true"
-                    )
-
-                    with get_ro_cursor(self.ro_conn) as db_cur:
-                        db_cur.execute(query)
-                        entries = db_cur.fetchall()
-
-                    for entry in entries:
-                        results.append(
-                            {
-                                "key": entry[0],  # key
-                                "prefix": entry[1],  # prefix
-                                "origin_as": entry[2],  # origin ASN
-                                "path": entry[3],  # as_path
-                                "type": entry[4],  # type
-                                "peer_asn": entry[5],  # peer_asn
-                                "communities": entry[6],  # communities
-                                "timestamp": entry[7].timestamp(),  # timestamp
-                                "service": entry[8],  # service
-                                "matched_prefix": entry[9],  # configured prefix
-                                "hij_key": entry[10],
-                                "hijack_as": entry[11],
-                                "hij_type": entry[12],
-                            }
-                        )
-
-                    if results:
-                        for result_bucket in [
-                            results[i : i + 10] for i in range(0, len(results), 10)
-                        ]:
-                            self.producer.publish(
-                                result_bucket,
-                                exchange=self.hijack_exchange,
-                                routing_key="ongoing",
-                                retry=False,
-                                priority=1,
+                    # the rule digests are only comparable if the database is
+                    # on the configuration of the request; else replay all
+                    hijack_keys = None
+                    if timestamp == self.timestamp:
+                        hijack_keys = self.get_outdated_replay_hijack_keys()
+                    if hijack_keys is None or hijack_keys:
+                        self.replay_ongoing_hijacks(hijack_keys)
+                    if timestamp == self.timestamp:
+                        redis_pipeline = self.redis.pipeline()
+                        redis_pipeline.delete("hijack-replay-watermark")
+                        if self.rule_digests:
+                            redis_pipeline.hmset(
+                                "hijack-replay-watermark", self.rule_digests
                             )
+                        redis_pipeline.execute()
                 except Exception:
                     log.exception("exception")
 
+        def get_outdated_replay_hijack_keys(self):
+            """
+            Returns the keys of the ongoing hijacks whose configured prefix
+            (best match) or its rules changed since the last replay, according
+            to the rule digests of the replay watermark.
+            """
+            replayed_digests = {
+                prefix.decode(): digest.decode()
+                for (prefix, digest) in self.redis.hgetall(
+                    "hijack-replay-watermark"
+                ).items()
+            }
+            query = (
+                "SELECT key, prefix, configured_prefix FROM hijacks WHERE active = true"
+            )
+            with get_ro_cursor(self.ro_pool) as db_cur:
+                db_cur.execute(query)
+                entries = db_cur.fetchall()
+
+            hijack_keys = []
+            for (key, prefix, configured_prefix) in entries:
+                best_match = self.find_best_prefix_match(prefix)
+                rule_digest = self.rule_digests.get(configured_prefix)
+                if (
+                    best_match != configured_prefix
+                    or replayed_digests.get(configured_prefix) != rule_digest
+                ):
+                    hijack_keys.append(key)
+            return hijack_keys
+
+        def replay_ongoing_hijacks(self, hijack_keys=None):
+            """
+            Streams the bgp updates of the ongoing hijacks (all of them, or
+            only the given ones) to detection, in batches.
+            """
+            query = (
+                "SELECT b.key, b.prefix, b.origin_as, b.as_path, b.type, b.peer_asn, "
+                "b.communities, b.timestamp, b.service, b.matched_prefix, h.key, h.hijack_as, h.type "
+                "FROM hijacks AS h JOIN hijack_bgp_updates AS hb ON (hb.hijack_key = h.key) "
+                "JOIN bgp_updates AS b ON (b.key = hb.update_key AND b.timestamp = hb.update_timestamp) "
+                "WHERE h.active = true AND b.handled=true"
+            )
+            params = None
+            if hijack_keys is not None:
+                query += " AND h.key = ANY(%s)"
+                params = (hijack_keys,)
+
+            results = []
+            with get_named_cursor(
+                self.ro_pool, "hijack-replay", itersize=self.replay_batch_size
+            ) as db_cur:
+                db_cur.execute(query, params)
+                for entry in db_cur:
+                    results.append(
+                        {
+                            "key": entry[0],  # key
+                            "prefix": entry[1],  # prefix
+                            "origin_as": entry[2],  # origin ASN
+                            "path": entry[3],  # as_path
+                            "type": entry[4],  # type
+                            "peer_asn": entry[5],  # peer_asn
+                            "communities": entry[6],  # communities
+                            "timestamp": entry[7].timestamp(),  # timestamp
+                            "service": entry[8],  # service
+                            "matched_prefix": entry[9],  # configured prefix
+                            "hij_key": entry[10],
+                            "hijack_as": entry[11],
+                            "hij_type": entry[12],
+                        }
+                    )
+                    if len(results) >= self.replay_batch_size:
+                        self.publish_ongoing_hijacks(results)
+                        results = []
+            if results:
+                self.publish_ongoing_hijacks(results)
+
+        def publish_ongoing_hijacks(self, results):
+            if DETECTION_SHARDING == "true":
+                self.publish_detection_shards(results)
+            else:
+                self.producer.publish(
+                    results,
+                    exchange=self.hijack_exchange,
+                    routing_key="ongoing",
+                    retry=False,
+                    priority=1,
+                )
+
         def bootstrap_redis(self):
+            """
+            Bootstraps redis from the database, unless it already holds a
+            consistent snapshot of it (same bootstrap generation). The
+            bootstrap steps run concurrently, each streaming its query on a
+            connection of its own.
+            """
             try:
+                generation = self.get_bootstrap_generation()
+                stored_generation = self.redis.get("bootstrap-generation")
+                if stored_generation and stored_generation.decode() == generation:
+                    log.info(
+                        "Redis already bootstrapped (generation {})".format(generation)
+                    )
+                    self.peer_asns = set(
+                        int(asn) for asn in self.redis.smembers("peer-asns")
+                    )
+                else:
+                    # invalidated until the bootstrap is complete
+                    self.redis.delete("bootstrap-generation")
+                    log.info("Bootstrapping redis...")
+                    start_time = time.time()
+                    steps = [
+                        ("ongoing hijacks", self.bootstrap_hijacks),
+                        ("seen bgp updates", self.bootstrap_seen_updates),
+                        ("hijack AS-links", self.bootstrap_hijack_links),
+                        ("monitor peers", self.bootstrap_peer_asns),
+                    ]
+                    results = {}
+                    threads = [
+                        threading.Thread(
+                            target=self.run_bootstrap_step, args=(name, step, results)
+                        )
+                        for (name, step) in steps
+                    ]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    log.info(
+                        "Bootstrapped redis in {:.2f}s".format(time.time() - start_time)
+                    )
+                    if all(results.get(name) for (name, _) in steps):
+                        self.redis.set("bootstrap-generation", generation)
 
-                # bootstrap ongoing hijack events
-                query = (
-                    "SELECT time_started, time_last, peers_seen, "
-                    "asns_inf, key, prefix, hijack_as, type, time_detected, "
-                    "configured_prefix, timestamp_of_config, community_annotation "
-                    "FROM hijacks WHERE active = true"
+                self.monitor_peers = self.redis.scard("peer-asns")
+                with get_wo_cursor(self.wo_pool) as db_cur:
+                    db_cur.execute(
+                        "UPDATE stats SET monitor_peers=%s;", (self.monitor_peers,)
+                    )
+
+            except Exception:
+                log.exception("exception")
+
+        def get_bootstrap_generation(self):
+            """
+            Returns the generation of a redis bootstrap: redis is consistent
+            with the database as long as the redis server (run id), the key
+            encoding and the database (version and upgrade time) are the same.
+            """
+            run_id = self.redis.info("server")["run_id"]
+            with get_ro_cursor(self.ro_pool) as db_cur:
+                db_cur.execute("SELECT version, upgraded_on FROM db_details")
+                (db_version, upgraded_on) = db_cur.fetchone()
+            return "{}|{}|{}|{}".format(
+                run_id, KEY_ENCODING, db_version, upgraded_on.timestamp()
+            )
+
+        def run_bootstrap_step(self, name, step, results):
+            try:
+                start_time = time.time()
+                with self.ro_pool.connection() as db_conn:
+                    count = step(db_conn, name)
+                log.info(
+                    "Bootstrapped {} {} in {:.2f}s".format(
+                        count, name, time.time() - start_time
+                    )
                 )
+                results[name] = True
+            except Exception:
+                log.exception("exception")
+                results[name] = False
+
+        def stream_bootstrap_query(self, db_conn, name, query):
+            """
+            Yields the rows of a bootstrap query in chunks, streamed from a
+            server-side cursor, and reports the progress.
+            """
+            count = 0
+            with get_named_cursor(
+                db_conn, "bootstrap", itersize=self.bootstrap_chunk_size
+            ) as db_cur:
+                db_cur.execute(query)
+                while True:
+                    entries = db_cur.fetchmany(self.bootstrap_chunk_size)
+                    if not entries:
+                        break
+                    yield entries
+                    count += len(entries)
+                    log.info("Bootstrapping {}: {} so far".format(name, count))
 
-                with get_ro_cursor(self.ro_conn) as db_cur:
-                    db_cur.execute(query)
-                    entries = db_cur.fetchall()
+        def bootstrap_hijacks(self, db_conn, name):
+            # bootstrap ongoing hijack events
+            query = (
+                "SELECT time_started, time_last, peers_seen, "
+                "asns_inf, key, prefix, hijack_as, type, time_detected, "
+                "configured_prefix, timestamp_of_config, community_annotation "
+                "FROM hijacks WHERE active = true"
+            )
 
+            count = 0
+            for entries in self.stream_bootstrap_query(db_conn, name, query):
+                legacy_hijacks = {}
+                if KEY_ENCODING != "legacy":
+                    # carry over hijacks stored under legacy (yaml-based)
+                    # redis keys, fetched and purged per chunk; their
+                    # ephemeral keys are rebuilt below
+                    legacy_redis_hijack_keys = [
+                        legacy_redis_key(entry[5], entry[6], entry[7])
+                        for entry in entries
+                    ]
+                    legacy_entries = [
+                        (legacy_redis_hijack_key, entry[4], legacy_hijack)
+                        for (legacy_redis_hijack_key, entry, legacy_hijack) in zip(
+                            legacy_redis_hijack_keys,
+                            entries,
+                            self.redis.mget(legacy_redis_hijack_keys),
+                        )
+                        if legacy_hijack
+                    ]
+                    purge_redis_eph_pers_keys_bulk(
+                        self.redis,
+                        [
+                            (legacy_key, hijack_key)
+                            for (legacy_key, hijack_key, _) in legacy_entries
+                        ],
+                    )
+                    legacy_hijacks = {
+                        hijack_key: decode_hijack(legacy_hijack)
+                        for (_, hijack_key, legacy_hijack) in legacy_entries
+                    }
                 redis_pipeline = self.redis.pipeline()
                 for entry in entries:
                     result = {
@@ -933,43 +1338,44 @@ class Database:
                         "community_annotation": entry[11],
                     }
                     redis_hijack_key = redis_key(entry[5], entry[6], entry[7])
-                    redis_pipeline.set(redis_hijack_key, yaml.dump(result))
+                    result = legacy_hijacks.get(entry[4]) or result
+                    redis_pipeline.set(redis_hijack_key, encode_hijack(result))
                     redis_pipeline.sadd("persistent-keys", entry[4])
                 redis_pipeline.execute()
+                count += len(entries)
+            return count
 
-                # bootstrap BGP updates
-                query = (
-                    "SELECT key, timestamp FROM bgp_updates "
-                    "WHERE timestamp > NOW() - interval '2 hours' "
-                    "ORDER BY timestamp ASC"
-                )
-
-                with get_ro_cursor(self.ro_conn) as db_cur:
-                    db_cur.execute(query)
-                    entries = db_cur.fetchall()
-
-                redis_pipeline = self.redis.pipeline()
-                for entry in entries:
-                    expire = max(
-                        int(entry[1].timestamp()) + 2 * 60 * 60 - int(time.time()), 60
-                    )
-                    redis_pipeline.set(entry[0], "1", ex=expire)
-                redis_pipeline.execute()
+        def bootstrap_seen_updates(self, db_conn, name):
+            # bootstrap BGP updates
+            query = (
+                "SELECT key, timestamp FROM bgp_updates "
+                "WHERE timestamp > NOW() - interval '2 hours' "
+                "ORDER BY timestamp ASC"
+            )
 
-                # bootstrap (origin, neighbor) AS-links of ongoing hijacks
-                query = (
-                    "SELECT bgp_updates.prefix, bgp_updates.peer_asn, bgp_updates.as_path, "
-                    "hijacks.prefix, hijacks.hijack_as, hijacks.type FROM "
-                    "hijacks LEFT JOIN bgp_updates ON (hijacks.key = ANY(bgp_updates.hijack_key)) "
-                    "WHERE bgp_updates.type = 'A' "
-                    "AND hijacks.active = true "
-                    "AND bgp_updates.handled = true"
+            count = 0
+            for entries in self.stream_bootstrap_query(db_conn, name, query):
+                self.seen_updates.add(
+                    [(entry[0], entry[1].timestamp()) for entry in entries]
                 )
+                count += len(entries)
+            return count
 
-                with get_ro_cursor(self.ro_conn) as db_cur:
-                    db_cur.execute(query)
-                    entries = db_cur.fetchall()
+        def bootstrap_hijack_links(self, db_conn, name):
+            # bootstrap (origin, neighbor) AS-links of ongoing hijacks
+            query = (
+                "SELECT bgp_updates.prefix, bgp_updates.peer_asn, bgp_updates.as_path, "
+                "hijacks.prefix, hijacks.hijack_as, hijacks.type FROM "
+                "hijacks JOIN hijack_bgp_updates ON (hijack_bgp_updates.hijack_key = hijacks.key) "
+                "JOIN bgp_updates ON (bgp_updates.key = hijack_bgp_updates.update_key "
+                "AND bgp_updates.timestamp = hijack_bgp_updates.update_timestamp) "
+                "WHERE bgp_updates.type = 'A' "
+                "AND hijacks.active = true "
+                "AND bgp_updates.handled = true"
+            )
 
+            count = 0
+            for entries in self.stream_bootstrap_query(db_conn, name, query):
                 redis_pipeline = self.redis.pipeline()
                 for entry in entries:
                     # store the origin, neighbor combination for this hijack BGP update
@@ -996,26 +1402,20 @@ class Database:
                         "{}_{}".format(entry[0], entry[1]),
                     )
                 redis_pipeline.execute()
+                count += len(entries)
+            return count
 
-                # bootstrap seen monitor peers
-                query = "SELECT DISTINCT peer_asn FROM bgp_updates"
-                with get_ro_cursor(self.ro_conn) as db_cur:
-                    db_cur.execute(query)
-                    entries = db_cur.fetchall()
-
-                redis_pipeline = self.redis.pipeline()
-                for entry in entries:
-                    redis_pipeline.sadd("peer-asns", int(entry[0]))
-                redis_pipeline.execute()
-                self.monitor_peers = self.redis.scard("peer-asns")
-
-                with get_wo_cursor(self.wo_conn) as db_cur:
-                    db_cur.execute(
-                        "UPDATE stats SET monitor_peers=%s;", (self.monitor_peers,)
-                    )
+        def bootstrap_peer_asns(self, db_conn, name):
+            # bootstrap seen monitor peers
+            query = "SELECT DISTINCT peer_asn FROM bgp_updates"
 
-            except Exception:
-                log.exception("exception")
+            count = 0
+            for entries in self.stream_bootstrap_query(db_conn, name, query):
+                peer_asns = [int(entry[0]) for entry in entries]
+                self.redis.sadd("peer-asns", *peer_asns)
+                self.peer_asns.update(peer_asns)
+                count += len(entries)
+            return count
 
         def handle_resolve_hijack(self, message):
             raw = message.payload
@@ -1025,10 +1425,11 @@ class Database:
                     raw["prefix"], raw["hijack_as"], raw["type"]
                 )
                 # if ongoing, force rekeying and delete persistent too
-                if self.redis.sismember("persistent-keys", raw["key"]):
-                    purge_redis_eph_pers_keys(self.redis, redis_hijack_key, raw["key"])
+                purge_redis_eph_pers_keys(
+                    self.redis, redis_hijack_key, raw["key"], only_persistent=True
+                )
 
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_wo_cursor(self.wo_pool) as db_cur:
                     db_cur.execute(
                         "UPDATE hijacks SET active=false, dormant=false, under_mitigation=false, resolved=true, seen=true, time_ended=%s WHERE key=%s;",
                         (datetime.datetime.now(), raw["key"]),
@@ -1044,17 +1445,17 @@ class Database:
                 redis_hijack_key = redis_key(
                     raw["prefix"], raw["hijack_as"], raw["type"]
                 )
-                if self.redis.sismember("persistent-keys", raw["key"]):
-                    purge_redis_eph_pers_keys(self.redis, redis_hijack_key, raw["key"])
+                purge_redis_eph_pers_keys(
+                    self.redis, redis_hijack_key, raw["key"], only_persistent=True
+                )
 
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_wo_cursor(self.wo_pool) as db_cur:
                     db_cur.execute("DELETE FROM hijacks WHERE key=%s;", (raw["key"],))
                     db_cur.execute(
-                        "DELETE FROM bgp_updates WHERE %s = ANY(hijack_key) AND array_length(hijack_key,1) = 1;",
-                        (raw["key"],),
+                        DELETE_HIJACK_BGP_UPDATES_QUERY, ([raw["key"]], [raw["key"]])
                     )
                     db_cur.execute(
-                        "UPDATE bgp_updates SET hijack_key = array_remove(hijack_key, %s);",
+                        "DELETE FROM hijack_bgp_updates WHERE hijack_key=%s;",
                         (raw["key"],),
                     )
 
@@ -1065,7 +1466,7 @@ class Database:
             raw = message.payload
             log.debug("payload: {}".format(raw))
             try:
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_wo_cursor(self.wo_pool) as db_cur:
                     db_cur.execute(
                         "UPDATE hijacks SET mitigation_started=%s, seen=true, under_mitigation=true WHERE key=%s;",
                         (datetime.datetime.fromtimestamp(raw["time"]), raw["key"]),
@@ -1081,9 +1482,10 @@ class Database:
                     raw["prefix"], raw["hijack_as"], raw["type"]
                 )
                 # if ongoing, force rekeying and delete persistent too
-                if self.redis.sismember("persistent-keys", raw["key"]):
-                    purge_redis_eph_pers_keys(self.redis, redis_hijack_key, raw["key"])
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                purge_redis_eph_pers_keys(
+                    self.redis, redis_hijack_key, raw["key"], only_persistent=True
+                )
+                with get_wo_cursor(self.wo_pool) as db_cur:
                     db_cur.execute(
                         "UPDATE hijacks SET active=false, dormant=false, under_mitigation=false, seen=false, ignored=true WHERE key=%s;",
                         (raw["key"],),
@@ -1095,7 +1497,7 @@ class Database:
             raw = message.payload
             log.debug("payload: {}".format(raw))
             try:
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_wo_cursor(self.wo_pool) as db_cur:
                     db_cur.execute(
                         "UPDATE hijacks SET comment=%s WHERE key=%s;",
                         (raw["comment"], raw["key"]),
@@ -1126,7 +1528,7 @@ class Database:
             raw = message.payload
             log.debug("payload: {}".format(raw))
             try:
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_wo_cursor(self.wo_pool) as db_cur:
                     db_cur.execute(
                         "UPDATE hijacks SET seen=%s WHERE key=%s;",
                         (raw["state"], raw["key"]),
@@ -1139,33 +1541,24 @@ class Database:
             log.debug("payload: {}".format(raw))
             query = None
             seen_action = False
-            ignore_action = False
             resolve_action = False
             delete_action = False
             try:
                 if not raw["keys"]:
                     query = None
                 elif raw["action"] == "hijack_action_resolve":
-                    query = "UPDATE hijacks SET resolved=true, active=false, dormant=false, under_mitigation=false, seen=true, time_ended=%s WHERE resolved=false AND ignored=false AND key=%s;"
+                    query = "UPDATE hijacks SET resolved=true, active=false, dormant=false, under_mitigation=false, seen=true, time_ended=%s WHERE resolved=false AND ignored=false AND key = ANY(%s);"
                     resolve_action = True
                 elif raw["action"] == "hijack_action_ignore":
-                    query = "UPDATE hijacks SET ignored=true, active=false, dormant=false, under_mitigation=false, seen=false WHERE ignored=false AND resolved=false AND key=%s;"
-                    ignore_action = True
+                    query = "UPDATE hijacks SET ignored=true, active=false, dormant=false, under_mitigation=false, seen=false WHERE ignored=false AND resolved=false AND key = ANY(%s);"
                 elif raw["action"] == "hijack_action_acknowledge":
-                    query = "UPDATE hijacks SET seen=true WHERE key=%s;"
+                    query = "UPDATE hijacks SET seen=true WHERE key = ANY(%s);"
                     seen_action = True
                 elif raw["action"] == "hijack_action_acknowledge_not":
-                    query = "UPDATE hijacks SET seen=false WHERE key=%s;"
+                    query = "UPDATE hijacks SET seen=false WHERE key = ANY(%s);"
                     seen_action = True
                 elif raw["action"] == "hijack_action_delete":
-                    query = []
-                    query.append("DELETE FROM hijacks WHERE key=%s;")
-                    query.append(
-                        "DELETE FROM bgp_updates WHERE %s = ANY(hijack_key) AND array_length(hijack_key,1) = 1;"
-                    )
-                    query.append(
-                        "UPDATE bgp_updates SET hijack_key = array_remove(hijack_key, %s);"
-                    )
+                    query = "DELETE FROM hijacks WHERE key = ANY(%s);"
                     delete_action = True
                 else:
                     raise BaseException("unreachable code reached")
@@ -1185,58 +1578,59 @@ class Database:
                     priority=4,
                 )
             else:
-                for hijack_key in raw["keys"]:
-                    try:
-                        with get_ro_cursor(self.ro_conn) as db_cur:
-                            db_cur.execute(
-                                "SELECT prefix, hijack_as, type FROM hijacks WHERE key = %s;",
-                                (hijack_key,),
-                            )
-                            entries = db_cur.fetchall()
+                hijack_keys = []
+                purge_keys = []
+                try:
+                    # look up all the hijacks at once
+                    with get_ro_cursor(self.ro_pool) as db_cur:
+                        db_cur.execute(
+                            "SELECT key, prefix, hijack_as, type FROM hijacks WHERE key = ANY(%s);",
+                            (list(raw["keys"]),),
+                        )
+                        entries = db_cur.fetchall()
 
-                        if entries:
-                            entry = entries[0]
+                    for entry in entries:
+                        hijack_keys.append(entry[0])
+                        if not seen_action:
                             redis_hijack_key = redis_key(
-                                entry[0],
-                                entry[1],
-                                entry[2],  # prefix  # hijack_as  # type
+                                entry[1], entry[2], entry[3]  # prefix, hijack_as, type
                             )
-                            if seen_action:
-                                with get_wo_cursor(self.wo_conn) as db_cur:
-                                    db_cur.execute(query, (hijack_key,))
-                            elif ignore_action:
-                                # if ongoing, force rekeying and delete persistent
-                                # too
-                                if self.redis.sismember("persistent-keys", hijack_key):
-                                    purge_redis_eph_pers_keys(
-                                        self.redis, redis_hijack_key, hijack_key
-                                    )
-                                with get_wo_cursor(self.wo_conn) as db_cur:
-                                    db_cur.execute(query, (hijack_key,))
-                            elif resolve_action:
-                                # if ongoing, force rekeying and delete persistent
-                                # too
-                                if self.redis.sismember("persistent-keys", hijack_key):
-                                    purge_redis_eph_pers_keys(
-                                        self.redis, redis_hijack_key, hijack_key
-                                    )
-                                with get_wo_cursor(self.wo_conn) as db_cur:
-                                    db_cur.execute(
-                                        query, (datetime.datetime.now(), hijack_key)
-                                    )
+                            purge_keys.append((redis_hijack_key, entry[0]))
+                except Exception:
+                    log.exception("{}".format(raw))
+
+                # if ongoing, force rekeying and delete persistent too
+                # (all hijacks at once)
+                try:
+                    purge_redis_eph_pers_keys_bulk(
+                        self.redis, purge_keys, only_persistent=True
+                    )
+                except Exception:
+                    log.exception("{}".format(raw))
+
+                # one statement per action for all the hijacks
+                try:
+                    if hijack_keys:
+                        with get_wo_cursor(self.wo_pool) as db_cur:
+                            if resolve_action:
+                                db_cur.execute(
+                                    query, (datetime.datetime.now(), hijack_keys)
+                                )
                             elif delete_action:
-                                if self.redis.sismember("persistent-keys", hijack_key):
-                                    purge_redis_eph_pers_keys(
-                                        self.redis, redis_hijack_key, hijack_key
-                                    )
-                                for query_ in query:
-                                    with get_wo_cursor(self.wo_conn) as db_cur:
-                                        db_cur.execute(query_, (hijack_key,))
+                                db_cur.execute(query, (hijack_keys,))
+                                # only the bgp updates linked to the hijacks
+                                db_cur.execute(
+                                    DELETE_HIJACK_BGP_UPDATES_QUERY,
+                                    (hijack_keys, hijack_keys),
+                                )
+                                db_cur.execute(
+                                    "DELETE FROM hijack_bgp_updates WHERE hijack_key = ANY(%s);",
+                                    (hijack_keys,),
+                                )
                             else:
-                                raise BaseException("unreachable code reached")
-
-                    except Exception:
-                        log.exception("{}".format(raw))
+                                db_cur.execute(query, (hijack_keys,))
+                except Exception:
+                    log.exception("{}".format(raw))
 
             self.producer.publish(
                 {"status": "accepted"},
@@ -1248,305 +1642,375 @@ class Database:
                 priority=4,
             )
 
-        def _insert_bgp_updates(self):
+        def _insert_bgp_updates(self, db_conn, bulk):
+            if not bulk["insert_bgp_entries"]:
+                return 0
             try:
-                query = (
-                    "INSERT INTO bgp_updates (prefix, key, origin_as, peer_asn, as_path, service, type, communities, "
-                    "timestamp, hijack_key, handled, matched_prefix, orig_path) VALUES %s"
-                )
-                with get_wo_cursor(self.wo_conn) as db_cur:
-                    psycopg2.extras.execute_values(
-                        db_cur, query, self.insert_bgp_entries, page_size=1000
+                # stream the rows with COPY, unless some already exist
+                copy_buffer = io.StringIO()
+                for entry in bulk["insert_bgp_entries"]:
+                    copy_buffer.write("\t".join(map(copy_text_value, entry)))
+                    copy_buffer.write("\n")
+                copy_buffer.seek(0)
+                with get_savepoint_cursor(db_conn) as db_cur:
+                    db_cur.execute(STATS_COUNTERS_OFF_QUERY)
+                    db_cur.copy_expert(
+                        "COPY bgp_updates ({}) FROM STDIN".format(
+                            ", ".join(BGP_UPDATES_COLUMNS)
+                        ),
+                        copy_buffer,
                     )
+                    # all rows were inserted, unless the COPY failed
+                    db_cur.execute(
+                        ADD_BGP_UPDATES_STATS_QUERY,
+                        (
+                            len(bulk["insert_bgp_entries"]),
+                            sum(
+                                1
+                                for entry in bulk["insert_bgp_entries"]
+                                if not entry[9]  # handled
+                            ),
+                        ),
+                    )
+                    db_cur.execute(STATS_COUNTERS_ON_QUERY)
+            except psycopg2.IntegrityError:
+                log.debug("bgp updates already exist, falling back to insert")
+                copy_buffer = None
             except Exception:
                 log.exception("exception")
-                return -1
-            finally:
-                num_of_entries = len(self.insert_bgp_entries)
-                self.insert_bgp_entries.clear()
-            return num_of_entries
+                copy_buffer = None
 
-        def _handle_bgp_withdrawals(self):
+            if copy_buffer is None:
+                try:
+                    query = (
+                        "INSERT INTO bgp_updates ({}) VALUES %s "
+                        "ON CONFLICT DO NOTHING RETURNING key, timestamp".format(
+                            ", ".join(BGP_UPDATES_COLUMNS)
+                        )
+                    )
+                    with get_savepoint_cursor(db_conn) as db_cur:
+                        # a single page, so that all inserted rows can be fetched
+                        psycopg2.extras.execute_values(
+                            db_cur,
+                            query,
+                            bulk["insert_bgp_entries"],
+                            page_size=len(bulk["insert_bgp_entries"]),
+                        )
+                        inserted = set(db_cur.fetchall())
+                except Exception:
+                    log.exception("exception")
+                    return -1
+                # the existing ones are not published to detection again
+                bulk["insert_bgp_entries"] = [
+                    entry
+                    for entry in bulk["insert_bgp_entries"]
+                    if (entry[1], entry[8]) in inserted  # key, timestamp
+                ]
+
+            # kept for publishing to detection once committed
+            return len(bulk["insert_bgp_entries"])
+
+        def _publish_inserted_bgp_updates(self, bulk):
+            """
+            In sharded mode, the database (instead of the db trigger) feeds
+            detection with the new bgp updates, once they are committed.
+            """
+            try:
+                self.publish_detection_shards(
+                    producer=self.bulk_producer,
+                    updates=[
+                        {
+                            "prefix": entry[0],  # prefix
+                            "key": entry[1],  # key
+                            "origin_as": entry[2],  # origin_as
+                            "peer_asn": entry[3],  # peer_asn
+                            "path": entry[4],  # as_path
+                            "service": entry[5],  # service
+                            "type": entry[6],  # type
+                            "communities": json.loads(entry[7]),  # communities
+                            "timestamp": entry[8].timestamp(),  # timestamp
+                        }
+                        for entry in bulk["insert_bgp_entries"]
+                    ],
+                )
+            except Exception:
+                log.exception("exception")
+
+        def _handle_bgp_withdrawals(self, db_conn, bulk):
             timestamp_thres = (
                 time.time() - 7 * 24 * 60 * 60 if HISTORIC == "false" else 0
             )
             timestamp_thres = datetime.datetime.fromtimestamp(timestamp_thres)
-            query = (
-                "SELECT DISTINCT ON (hijacks.key) hijacks.peers_seen, hijacks.peers_withdrawn, "
-                "hijacks.key, hijacks.hijack_as, hijacks.type, bgp_updates.timestamp, hijacks.time_last "
-                "FROM hijacks LEFT JOIN bgp_updates ON (hijacks.key = ANY(bgp_updates.hijack_key)) "
-                "WHERE bgp_updates.prefix = %s "
-                "AND bgp_updates.type = 'A' "
-                "AND bgp_updates.timestamp >= %s "
-                "AND hijacks.active = true "
-                "AND bgp_updates.peer_asn = %s "
-                "AND bgp_updates.handled = true "
-                "ORDER BY hijacks.key, bgp_updates.timestamp DESC"
-            )
+            # withdrawal -> 0: prefix, 1: peer_asn, 2: timestamp, 3: key;
+            # processed in timestamp order, as the hijack state they see
+            # depends on the previous ones
+            withdrawals = sorted(bulk["handle_bgp_withdrawals"], key=lambda x: x[2])
             update_normal_withdrawals = set()
             update_hijack_withdrawals = set()
-            for withdrawal in self.handle_bgp_withdrawals:
-                try:
-                    # withdrawal -> 0: prefix, 1: peer_asn, 2: timestamp, 3:
-                    # key
-                    with get_ro_cursor(self.ro_conn) as db_cur:
-                        db_cur.execute(
-                            query, (withdrawal[0], timestamp_thres, withdrawal[1])
+            failed = False
+            try:
+                # match all withdrawals with their hijacks at once
+                entries = []
+                if withdrawals:
+                    query = (
+                        "SELECT DISTINCT ON (data.idx, hijacks.key) data.idx, hijacks.peers_seen, hijacks.peers_withdrawn, "
+                        "hijacks.key, hijacks.hijack_as, hijacks.type, bgp_updates.timestamp, hijacks.time_last "
+                        "FROM (VALUES %s) AS data (idx, prefix, peer_asn) "
+                        "JOIN bgp_updates ON (bgp_updates.prefix = data.prefix AND bgp_updates.peer_asn = data.peer_asn) "
+                        "JOIN hijack_bgp_updates ON (hijack_bgp_updates.update_key = bgp_updates.key "
+                        "AND hijack_bgp_updates.update_timestamp = bgp_updates.timestamp) "
+                        "JOIN hijacks ON (hijacks.key = hijack_bgp_updates.hijack_key) "
+                        "WHERE bgp_updates.type = 'A' "
+                        "AND bgp_updates.timestamp >= {} "
+                        "AND hijacks.active = true "
+                        "AND bgp_updates.handled = true "
+                        "ORDER BY data.idx, hijacks.key, bgp_updates.timestamp DESC"
+                    )
+                    with get_savepoint_cursor(db_conn) as db_cur:
+                        query = query.format(
+                            db_cur.mogrify("%s", (timestamp_thres,)).decode()
+                        )
+                        # a single page, so that all entries can be fetched
+                        psycopg2.extras.execute_values(
+                            db_cur,
+                            query,
+                            [
+                                (i, withdrawal[0], withdrawal[1])
+                                for (i, withdrawal) in enumerate(withdrawals)
+                            ],
+                            template="(%s, %s::inet, %s::bigint)",
+                            page_size=len(withdrawals),
                         )
                         entries = db_cur.fetchall()
 
-                    if not entries:
-                        update_normal_withdrawals.add((withdrawal[3],))
-                        continue
-                    for entry in entries:
-                        # entry -> 0: peers_seen, 1: peers_withdrawn, 2:
-                        # hij.key, 3: hij.as, 4: hij.type, 5: timestamp
-                        # 6: time_last
-                        update_hijack_withdrawals.add((entry[2], withdrawal[3]))
-                        if entry[5] > withdrawal[2]:
+                withdrawal_entries = {}
+                for entry in entries:
+                    # entry -> 0: withdrawal index, 1: peers_seen, 2:
+                    # peers_withdrawn, 3: hij.key, 4: hij.as, 5: hij.type,
+                    # 6: timestamp, 7: time_last
+                    withdrawal_entries.setdefault(entry[0], []).append(entry)
+
+                # compute the hijack state transitions in memory
+                hijack_states = {}
+                withdrawn_hijacks = {}
+                for (i, withdrawal) in enumerate(withdrawals):
+                    matched = False
+                    for entry in withdrawal_entries.get(i, []):
+                        hijack_key = entry[3]
+                        if hijack_key not in hijack_states:
+                            hijack_states[hijack_key] = {
+                                "peers_seen": entry[1],
+                                "peers_withdrawn": entry[2],
+                                "time_last": entry[7],
+                                "withdrawn": False,
+                                "updated": False,
+                            }
+                        state = hijack_states[hijack_key]
+                        # no longer active
+                        if state["withdrawn"]:
+                            continue
+                        matched = True
+                        update_hijack_withdrawals.add(
+                            (hijack_key, withdrawal[3], withdrawal[2])
+                        )
+                        if entry[6] > withdrawal[2]:
                             continue
                         # matching withdraw with a hijack
-                        if withdrawal[1] not in entry[1] and withdrawal[1] in entry[0]:
-                            entry[1].append(withdrawal[1])
-                            timestamp = max(withdrawal[2], entry[6])
-                            if len(entry[0]) == len(entry[1]):
+                        if (
+                            withdrawal[1] not in state["peers_withdrawn"]
+                            and withdrawal[1] in state["peers_seen"]
+                        ):
+                            state["peers_withdrawn"].append(withdrawal[1])
+                            state["time_last"] = max(withdrawal[2], state["time_last"])
+                            state["updated"] = True
+                            if len(state["peers_seen"]) == len(
+                                state["peers_withdrawn"]
+                            ):
                                 # set hijack as withdrawn and delete from redis
-                                redis_hijack_key = redis_key(
-                                    withdrawal[0], entry[3], entry[4]
-                                )
-                                hijack = self.redis.get(redis_hijack_key)
-                                if hijack:
-                                    hijack = yaml.safe_load(hijack)
-                                    hijack["end_tag"] = "withdrawn"
-                                purge_redis_eph_pers_keys(
-                                    self.redis, redis_hijack_key, entry[2]
+                                state["withdrawn"] = True
+                                withdrawn_hijacks[hijack_key] = redis_key(
+                                    withdrawal[0], entry[4], entry[5]
                                 )
-                                with get_wo_cursor(self.wo_conn) as db_cur:
-                                    db_cur.execute(
-                                        "UPDATE hijacks SET active=false, dormant=false, under_mitigation=false, resolved=false, withdrawn=true, time_ended=%s, "
-                                        "peers_withdrawn=%s, time_last=%s WHERE key=%s;",
-                                        (timestamp, entry[1], timestamp, entry[2]),
-                                    )
-                                log.debug("withdrawn hijack {}".format(entry))
-                                if hijack:
-                                    mail_log.info(
-                                        "{}".format(
-                                            json.dumps(
-                                                hijack_log_field_formatter(hijack),
-                                                indent=4,
-                                                cls=SetEncoder,
-                                            )
-                                        ),
-                                        extra={
-                                            "community_annotation": hijack.get(
-                                                "community_annotation", "NA"
-                                            )
-                                        },
-                                    )
-                                    hij_log.info(
-                                        "{}".format(
-                                            json.dumps(
-                                                hijack_log_field_formatter(hijack),
-                                                cls=SetEncoder,
-                                            )
-                                        ),
-                                        extra={
-                                            "community_annotation": hijack.get(
-                                                "community_annotation", "NA"
-                                            )
-                                        },
-                                    )
-                            else:
-                                # add withdrawal to hijack
-                                with get_wo_cursor(self.wo_conn) as db_cur:
-                                    db_cur.execute(
-                                        "UPDATE hijacks SET peers_withdrawn=%s, time_last=%s, dormant=false WHERE key=%s;",
-                                        (entry[1], timestamp, entry[2]),
-                                    )
-
-                                log.debug("updating hijack {}".format(entry))
-                except Exception:
-                    log.exception("exception")
+                    if not matched:
+                        update_normal_withdrawals.add((withdrawal[3],))
 
-            try:
-                update_hijack_withdrawals_dict = {}
-                for update_hijack_withdrawal in update_hijack_withdrawals:
-                    hijack_key = update_hijack_withdrawal[0]
-                    withdrawal_key = update_hijack_withdrawal[1]
-                    if withdrawal_key not in update_hijack_withdrawals_dict:
-                        update_hijack_withdrawals_dict[withdrawal_key] = set()
-                    update_hijack_withdrawals_dict[withdrawal_key].add(hijack_key)
-                update_hijack_withdrawals_parallel = set()
-                update_hijack_withdrawals_serial = set()
-                for withdrawal_key in update_hijack_withdrawals_dict:
-                    if len(update_hijack_withdrawals_dict[withdrawal_key]) == 1:
-                        for hijack_key in update_hijack_withdrawals_dict[
-                            withdrawal_key
-                        ]:
-                            update_hijack_withdrawals_parallel.add(
-                                (hijack_key, withdrawal_key)
-                            )
-                    else:
-                        for hijack_key in update_hijack_withdrawals_dict[
-                            withdrawal_key
-                        ]:
-                            update_hijack_withdrawals_serial.add(
-                                (hijack_key, withdrawal_key)
-                            )
+                # delete withdrawn hijacks from redis (all at once)
+                withdrawn_hijack_records = purge_redis_eph_pers_keys_bulk(
+                    self.redis,
+                    [
+                        (redis_hijack_key, hijack_key)
+                        for (hijack_key, redis_hijack_key) in withdrawn_hijacks.items()
+                    ],
+                )
 
-                # execute parallel execute values query
+                # write the hijack states back with a single query
                 query = (
-                    "UPDATE bgp_updates SET handled=true, hijack_key=array_distinct(hijack_key || array[data.v1]) "
-                    "FROM (VALUES %s) AS data (v1, v2) WHERE bgp_updates.key=data.v2"
+                    "UPDATE hijacks SET peers_withdrawn=data.peers_withdrawn, time_last=data.time_last, dormant=false, "
+                    "active=(hijacks.active AND NOT data.withdrawn), "
+                    "under_mitigation=(hijacks.under_mitigation AND NOT data.withdrawn), "
+                    "resolved=(hijacks.resolved AND NOT data.withdrawn), "
+                    "withdrawn=(hijacks.withdrawn OR data.withdrawn), "
+                    "time_ended=(CASE WHEN data.withdrawn THEN data.time_last ELSE hijacks.time_ended END) "
+                    "FROM (VALUES %s) AS data (key, peers_withdrawn, time_last, withdrawn) "
+                    "WHERE hijacks.key=data.key"
                 )
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_savepoint_cursor(db_conn) as db_cur:
                     psycopg2.extras.execute_values(
                         db_cur,
                         query,
-                        list(update_hijack_withdrawals_parallel),
+                        [
+                            (
+                                hijack_key,
+                                state["peers_withdrawn"],
+                                state["time_last"],
+                                state["withdrawn"],
+                            )
+                            for (hijack_key, state) in hijack_states.items()
+                            if state["updated"]
+                        ],
+                        template="(%s, %s::bigint[], %s::timestamp, %s)",
                         page_size=1000,
                     )
-
-                # execute serial execute_batch query
-                query = (
-                    "UPDATE bgp_updates SET handled=true, hijack_key=array_distinct(hijack_key || array[%s]) "
-                    "WHERE bgp_updates.key=%s"
-                )
-                with get_wo_cursor(self.wo_conn) as db_cur:
-                    psycopg2.extras.execute_batch(
-                        db_cur,
-                        query,
-                        list(update_hijack_withdrawals_serial),
-                        page_size=1000,
+                for (hijack_key, state) in hijack_states.items():
+                    if state["withdrawn"]:
+                        log.debug("withdrawn hijack {}".format(hijack_key))
+                    elif state["updated"]:
+                        log.debug("updating hijack {}".format(hijack_key))
+
+                for hijack in withdrawn_hijack_records:
+                    if not hijack:
+                        continue
+                    hijack = decode_hijack(hijack)
+                    hijack["end_tag"] = "withdrawn"
+                    mail_log.info(
+                        "{}".format(
+                            json.dumps(
+                                hijack_log_field_formatter(hijack),
+                                indent=4,
+                                cls=SetEncoder,
+                            )
+                        ),
+                        extra={
+                            "community_annotation": hijack.get(
+                                "community_annotation", "NA"
+                            )
+                        },
+                    )
+                    hij_log.info(
+                        "{}".format(
+                            json.dumps(
+                                hijack_log_field_formatter(hijack), cls=SetEncoder
+                            )
+                        ),
+                        extra={
+                            "community_annotation": hijack.get(
+                                "community_annotation", "NA"
+                            )
+                        },
                     )
-                update_hijack_withdrawals_parallel.clear()
-                update_hijack_withdrawals_serial.clear()
-                update_hijack_withdrawals_dict.clear()
+            except Exception:
+                log.exception("exception")
+                failed = True
+
+            try:
+                with get_savepoint_cursor(db_conn) as db_cur:
+                    self._link_hijack_bgp_updates(db_cur, update_hijack_withdrawals)
 
                 query = "UPDATE bgp_updates SET handled=true FROM (VALUES %s) AS data (key) WHERE bgp_updates.key=data.key"
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_savepoint_cursor(db_conn) as db_cur:
                     psycopg2.extras.execute_values(
                         db_cur, query, list(update_normal_withdrawals), page_size=1000
                     )
             except Exception:
                 log.exception("exception")
+                failed = True
 
-            num_of_entries = len(self.handle_bgp_withdrawals)
-            self.handle_bgp_withdrawals.clear()
-            return num_of_entries
+            if failed:
+                return -1
+            return len(bulk["handle_bgp_withdrawals"])
+
+        @staticmethod
+        def _link_hijack_bgp_updates(db_cur, hijack_bgp_updates):
+            """
+            Links hijacks to the bgp updates they consist of and marks
+            the latter as handled.
+
+            :param hijack_bgp_updates: iterable of (hijack key, bgp update key,
+            min bgp update timestamp)
+            """
+            hijack_bgp_updates = list(hijack_bgp_updates)
+            query = (
+                "INSERT INTO hijack_bgp_updates (hijack_key, update_key, update_timestamp) "
+                "SELECT data.v1, bgp_updates.key, bgp_updates.timestamp FROM (VALUES %s) AS data (v1, v2, v3) "
+                "JOIN bgp_updates ON (bgp_updates.key=data.v2 AND bgp_updates.timestamp >= data.v3) "
+                "ON CONFLICT DO NOTHING"
+            )
+            psycopg2.extras.execute_values(
+                db_cur, query, hijack_bgp_updates, page_size=1000
+            )
+            query = "UPDATE bgp_updates SET handled=true FROM (VALUES %s) AS data (key) WHERE bgp_updates.key=data.key"
+            psycopg2.extras.execute_values(
+                db_cur,
+                query,
+                list({(entry[1],) for entry in hijack_bgp_updates}),
+                page_size=1000,
+            )
 
-        def _update_bgp_updates(self):
+        @staticmethod
+        def _hijack_bgp_entries(bulk):
+            """
+            (hijack key, bgp update key) links of the hijacks of a bulk, along
+            with the ones to retry.
+            """
+            hijack_bgp_entries = set(bulk["hijack_bgp_entries"])
+            for (hijack_key, entry) in bulk["insert_hijacks_entries"].items():
+                for bgp_entry_to_update in entry["monitor_keys"]:
+                    hijack_bgp_entries.add((hijack_key, bgp_entry_to_update))
+            return hijack_bgp_entries
+
+        def _update_bgp_updates(self, db_conn, bulk):
             num_of_updates = 0
-            update_bgp_entries = set()
             timestamp_thres = (
                 time.time() - 7 * 24 * 60 * 60 if HISTORIC == "false" else 0
             )
             timestamp_thres = datetime.datetime.fromtimestamp(timestamp_thres)
             # Update the BGP entries using the hijack messages
-            for hijack_key in self.insert_hijacks_entries:
-                for bgp_entry_to_update in self.insert_hijacks_entries[hijack_key][
-                    "monitor_keys"
-                ]:
-                    num_of_updates += 1
-                    update_bgp_entries.add(
-                        (hijack_key, bgp_entry_to_update, timestamp_thres)
-                    )
-                    # exclude handle bgp updates that point to same hijack as
-                    # this
-                    self.handled_bgp_entries.discard(bgp_entry_to_update)
+            update_bgp_entries = self._hijack_bgp_entries(bulk)
 
-            if update_bgp_entries:
+            # the bgp updates of hijacks are handled too (once)
+            handled_keys = {entry[1] for entry in update_bgp_entries}
+            handled_keys.update(entry[0] for entry in bulk["handled_bgp_entries"])
+            if handled_keys:
                 try:
-                    query = (
-                        "UPDATE hijacks SET peers_withdrawn=array_remove(peers_withdrawn, removed.peer_asn) FROM "
-                        "(SELECT witann.key, witann.peer_asn FROM "
-                        "(SELECT hij.key, wit.peer_asn, wit.timestamp AS wit_time, ann.timestamp AS ann_time FROM "
-                        "((VALUES %s) AS data (v1, v2, v3) LEFT JOIN hijacks AS hij ON (data.v1=hij.key) "
-                        "LEFT JOIN bgp_updates AS ann ON (data.v2=ann.key) "
-                        "LEFT JOIN bgp_updates AS wit ON (hij.key=ANY(wit.hijack_key))) WHERE "
-                        "ann.timestamp >= data.v3 AND wit.timestamp >= data.v3 AND "
-                        "ann.type='A' AND wit.prefix=ann.prefix AND wit.peer_asn=ann.peer_asn AND wit.type='W' "
-                        "ORDER BY wit_time DESC LIMIT 1) AS witann WHERE witann.wit_time < witann.ann_time) "
-                        "AS removed WHERE hijacks.key=removed.key"
-                    )
-                    with get_wo_cursor(self.wo_conn) as db_cur:
-                        psycopg2.extras.execute_values(
-                            db_cur, query, list(update_bgp_entries), page_size=1000
-                        )
-                    update_bgp_entries_dict = {}
-                    for update_bgp_entry in update_bgp_entries:
-                        hijack_key = update_bgp_entry[0]
-                        bgp_entry_to_update = update_bgp_entry[1]
-                        if bgp_entry_to_update not in update_bgp_entries_dict:
-                            update_bgp_entries_dict[bgp_entry_to_update] = set()
-                        update_bgp_entries_dict[bgp_entry_to_update].add(hijack_key)
-                    update_bgp_entries_parallel = set()
-                    update_bgp_entries_serial = set()
-                    for bgp_entry_to_update in update_bgp_entries_dict:
-                        if len(update_bgp_entries_dict[bgp_entry_to_update]) == 1:
-                            for hijack_key in update_bgp_entries_dict[
-                                bgp_entry_to_update
-                            ]:
-                                update_bgp_entries_parallel.add(
-                                    (hijack_key, bgp_entry_to_update)
-                                )
-                        else:
-                            for hijack_key in update_bgp_entries_dict[
-                                bgp_entry_to_update
-                            ]:
-                                update_bgp_entries_serial.add(
-                                    (hijack_key, bgp_entry_to_update)
-                                )
-
-                    # execute parallel execute values query
-                    query = "UPDATE bgp_updates SET handled=true, hijack_key=array_distinct(hijack_key || array[data.v1]) FROM (VALUES %s) AS data (v1, v2) WHERE bgp_updates.key=data.v2"
-                    with get_wo_cursor(self.wo_conn) as db_cur:
-                        psycopg2.extras.execute_values(
-                            db_cur,
-                            query,
-                            list(update_bgp_entries_parallel),
-                            page_size=1000,
+                    with get_savepoint_cursor(db_conn) as db_cur:
+                        db_cur.execute(STATS_COUNTERS_OFF_QUERY)
+                        db_cur.execute(
+                            UPDATE_BGP_UPDATES_QUERY,
+                            {
+                                "hijack_keys": [
+                                    entry[0] for entry in update_bgp_entries
+                                ],
+                                "update_keys": [
+                                    entry[1] for entry in update_bgp_entries
+                                ],
+                                "timestamp_thres": timestamp_thres,
+                                "handled_keys": list(handled_keys),
+                            },
                         )
-
-                    # execute serial execute_batch query
-                    query = "UPDATE bgp_updates SET handled=true, hijack_key=array_distinct(hijack_key || array[%s]) WHERE bgp_updates.key=%s"
-                    with get_wo_cursor(self.wo_conn) as db_cur:
-                        psycopg2.extras.execute_batch(
-                            db_cur,
-                            query,
-                            list(update_bgp_entries_serial),
-                            page_size=1000,
+                        # only unhandled ones are updated
+                        db_cur.execute(
+                            ADD_BGP_UPDATES_STATS_QUERY, (0, -db_cur.rowcount)
                         )
-                    update_bgp_entries_parallel.clear()
-                    update_bgp_entries_serial.clear()
-                    update_bgp_entries_dict.clear()
-
+                        db_cur.execute(STATS_COUNTERS_ON_QUERY)
                 except Exception:
                     log.exception("exception")
                     return -1
 
             num_of_updates += len(update_bgp_entries)
-            update_bgp_entries.clear()
-
-            # Update the BGP entries using the handled messages
-            if self.handled_bgp_entries:
-                try:
-                    query = "UPDATE bgp_updates SET handled=true FROM (VALUES %s) AS data (key) WHERE bgp_updates.key=data.key"
-                    with get_wo_cursor(self.wo_conn) as db_cur:
-                        psycopg2.extras.execute_values(
-                            db_cur, query, self.handled_bgp_entries, page_size=1000
-                        )
-                except Exception:
-                    log.exception(
-                        "handled bgp entries {}".format(self.handled_bgp_entries)
-                    )
-                    return -1
-
-            num_of_updates += len(self.handled_bgp_entries)
-            self.handled_bgp_entries.clear()
+            num_of_updates += len(bulk["handled_bgp_entries"])
             return num_of_updates
 
-        def _insert_update_hijacks(self):
+        def _insert_update_hijacks(self, db_conn, bulk):
 
             try:
                 query = (
@@ -1561,27 +2025,27 @@ class Database:
 
                 values = []
 
-                for key in self.insert_hijacks_entries:
+                for key in bulk["insert_hijacks_entries"]:
                     entry = (
                         key,  # key
-                        self.insert_hijacks_entries[key]["type"],  # type
-                        self.insert_hijacks_entries[key]["prefix"],  # prefix
+                        bulk["insert_hijacks_entries"][key]["type"],  # type
+                        bulk["insert_hijacks_entries"][key]["prefix"],  # prefix
                         # hijack_as
-                        self.insert_hijacks_entries[key]["hijack_as"],
+                        bulk["insert_hijacks_entries"][key]["hijack_as"],
                         # num_peers_seen
-                        self.insert_hijacks_entries[key]["num_peers_seen"],
+                        bulk["insert_hijacks_entries"][key]["num_peers_seen"],
                         # num_asns_inf
-                        self.insert_hijacks_entries[key]["num_asns_inf"],
+                        bulk["insert_hijacks_entries"][key]["num_asns_inf"],
                         datetime.datetime.fromtimestamp(
-                            self.insert_hijacks_entries[key]["time_started"]
+                            bulk["insert_hijacks_entries"][key]["time_started"]
                         ),  # time_started
                         datetime.datetime.fromtimestamp(
-                            self.insert_hijacks_entries[key]["time_last"]
+                            bulk["insert_hijacks_entries"][key]["time_last"]
                         ),  # time_last
                         None,  # time_ended
                         None,  # mitigation_started
                         datetime.datetime.fromtimestamp(
-                            self.insert_hijacks_entries[key]["time_detected"]
+                            bulk["insert_hijacks_entries"][key]["time_detected"]
                         ),  # time_detected
                         False,  # under_mitigation
                         True,  # active
@@ -1590,21 +2054,21 @@ class Database:
                         False,  # withdrawn
                         False,  # dormant
                         # configured_prefix
-                        self.insert_hijacks_entries[key]["configured_prefix"],
+                        bulk["insert_hijacks_entries"][key]["configured_prefix"],
                         datetime.datetime.fromtimestamp(
-                            self.insert_hijacks_entries[key]["timestamp_of_config"]
+                            bulk["insert_hijacks_entries"][key]["timestamp_of_config"]
                         ),  # timestamp_of_config
                         "",  # comment
                         # peers_seen
-                        self.insert_hijacks_entries[key]["peers_seen"],
+                        bulk["insert_hijacks_entries"][key]["peers_seen"],
                         [],  # peers_withdrawn
                         # asns_inf
-                        self.insert_hijacks_entries[key]["asns_inf"],
-                        self.insert_hijacks_entries[key]["community_annotation"],
+                        bulk["insert_hijacks_entries"][key]["asns_inf"],
+                        bulk["insert_hijacks_entries"][key]["community_annotation"],
                     )
                     values.append(entry)
 
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_savepoint_cursor(db_conn) as db_cur:
                     psycopg2.extras.execute_values(
                         db_cur, query, values, page_size=1000
                     )
@@ -1612,9 +2076,7 @@ class Database:
                 log.exception("exception")
                 return -1
 
-            num_of_entries = len(self.insert_hijacks_entries)
-            self.insert_hijacks_entries.clear()
-            return num_of_entries
+            return len(bulk["insert_hijacks_entries"])
 
         # def _retrieve_unhandled(self, amount):
         #     results = []
@@ -1623,7 +2085,7 @@ class Database:
         #         "type, communities, timestamp FROM bgp_updates WHERE "
         #         "handled = false ORDER BY timestamp DESC LIMIT(%s)"
         #     )
-        #     with get_ro_cursor(self.ro_conn) as db_cur:
+        #     with get_ro_cursor(self.ro_pool) as db_cur:
         #         db_cur.execute(query, (amount,))
         #         entries = db_cur.fetchall()
         #
@@ -1650,27 +2112,241 @@ class Database:
         #             priority=2,
         #         )
 
-        def _handle_hijack_outdate(self):
-            if not self.outdate_hijacks:
-                return
+        def _handle_hijack_outdate(self, db_conn, bulk):
+            if not bulk["outdate_hijacks"]:
+                return 0
             try:
                 query = "UPDATE hijacks SET active=false, dormant=false, under_mitigation=false, outdated=true FROM (VALUES %s) AS data (key) WHERE hijacks.key=data.key;"
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_savepoint_cursor(db_conn) as db_cur:
                     psycopg2.extras.execute_values(
-                        db_cur, query, list(self.outdate_hijacks), page_size=1000
+                        db_cur, query, list(bulk["outdate_hijacks"]), page_size=1000
                     )
-                self.outdate_hijacks.clear()
             except Exception:
                 log.exception("")
+                return -1
+            return len(bulk["outdate_hijacks"])
+
+        def _update_monitor_peers(self):
+            if not self.new_peer_asns:
+                return
+            try:
+                redis_pipeline = self.redis.pipeline()
+                redis_pipeline.sadd("peer-asns", *self.new_peer_asns)
+                redis_pipeline.scard("peer-asns")
+                monitor_peers = redis_pipeline.execute()[1]
+                self.new_peer_asns.clear()
+                if monitor_peers != self.monitor_peers:
+                    self.monitor_peers = monitor_peers
+                    with get_wo_cursor(self.wo_pool) as db_cur:
+                        db_cur.execute(
+                            "UPDATE stats SET monitor_peers=%s;", (self.monitor_peers,)
+                        )
+            except Exception:
+                log.exception("exception")
+
+        def bulk_size(self):
+            return (
+                len(self.insert_bgp_entries)
+                + len(self.handle_bgp_withdrawals)
+                + len(self.handled_bgp_entries)
+                + len(self.outdate_hijacks)
+                + len(self.insert_hijacks_entries)
+                + len(self.hijack_bgp_entries)
+            )
+
+        def buffered(self, urgent=False):
+            """
+            Flushes the buffered entries if they are enough, or right away
+            if urgent (e.g., hijacks).
+            """
+            if self.bulk_started is None:
+                self.bulk_started = time.time()
+            if urgent or self.bulk_size() >= self.flush_max_entries:
+                self._update_bulk()
+
+        def on_iteration(self):
+            """
+            Flushes the buffered entries if the oldest of them has been
+            waiting for more than the max flush age.
+            """
+            self.restore_unapplied_bulk()
+            if (
+                self.bulk_started is not None
+                and time.time() - self.bulk_started >= self.flush_max_age
+            ):
+                self._update_bulk()
+
+        def restore_unapplied_bulk(self):
+            """
+            Puts the entries of the last bulk that were rolled back back into
+            the buffers, to be retried with the next bulk, unless they have
+            failed the max number of bulks already.
+            """
+            if not self.bulk_writer_idle.is_set() or self.unapplied_bulk is None:
+                return
+            unapplied = self.unapplied_bulk
+            self.unapplied_bulk = None
+            dropped = {}
+
+            def retried(part, entry_id):
+                attempts = unapplied["attempts"].get((part, entry_id), 0) + 1
+                if attempts >= self.flush_max_attempts:
+                    dropped[part] = dropped.get(part, 0) + 1
+                    return False
+                self.bulk_attempts[(part, entry_id)] = attempts
+                return True
+
+            self.insert_bgp_entries[:0] = [
+                entry
+                for entry in unapplied["insert_bgp_entries"]
+                if retried("insert_bgp_entries", entry[1])  # key
+            ]
+            self.handle_bgp_withdrawals.update(
+                entry
+                for entry in unapplied["handle_bgp_withdrawals"]
+                if retried("handle_bgp_withdrawals", entry)
+            )
+            self.handled_bgp_entries.update(
+                entry
+                for entry in unapplied["handled_bgp_entries"]
+                if retried("handled_bgp_entries", entry)
+            )
+            self.hijack_bgp_entries.update(
+                entry
+                for entry in unapplied["hijack_bgp_entries"]
+                if retried("hijack_bgp_entries", entry)
+            )
+            self.outdate_hijacks.update(
+                entry
+                for entry in unapplied["outdate_hijacks"]
+                if retried("outdate_hijacks", entry)
+            )
+            for (key, entry) in unapplied["insert_hijacks_entries"].items():
+                if not retried("insert_hijacks_entries", key):
+                    continue
+                if key not in self.insert_hijacks_entries:
+                    self.insert_hijacks_entries[key] = entry
+                    continue
+                # the buffered entry is more recent
+                buffered_entry = self.insert_hijacks_entries[key]
+                buffered_entry["time_started"] = min(
+                    buffered_entry["time_started"], entry["time_started"]
+                )
+                buffered_entry["time_last"] = max(
+                    buffered_entry["time_last"], entry["time_last"]
+                )
+                buffered_entry["monitor_keys"].update(entry["monitor_keys"])
+            for (part, count) in dropped.items():
+                log.error(
+                    "dropped {} {} after {} failed bulks".format(
+                        count, part, self.flush_max_attempts
+                    )
+                )
+            if self.bulk_started is None:
+                self.bulk_started = time.time()
 
         def _update_bulk(self):
-            inserts, updates, hijacks, withdrawals = (
-                self._insert_bgp_updates(),
-                self._update_bgp_updates(),
-                self._insert_update_hijacks(),
-                self._handle_bgp_withdrawals(),
+            # before the bgp updates are inserted, so that their peers are known
+            self._update_monitor_peers()
+            self.restore_unapplied_bulk()
+            # hand the buffered entries over to the bulk writer, unless there
+            # are none or it is still busy with the previous ones, and keep
+            # buffering in new ones
+            if self.bulk_started is None or not self.bulk_writer_idle.is_set():
+                return
+            bulk = {
+                "insert_bgp_entries": self.insert_bgp_entries,
+                "handle_bgp_withdrawals": self.handle_bgp_withdrawals,
+                "handled_bgp_entries": self.handled_bgp_entries,
+                "outdate_hijacks": self.outdate_hijacks,
+                "insert_hijacks_entries": self.insert_hijacks_entries,
+                "hijack_bgp_entries": self.hijack_bgp_entries,
+                "attempts": self.bulk_attempts,
+            }
+            self.insert_bgp_entries = []
+            self.handle_bgp_withdrawals = set()
+            self.handled_bgp_entries = set()
+            self.outdate_hijacks = set()
+            self.insert_hijacks_entries = {}
+            self.hijack_bgp_entries = set()
+            self.bulk_attempts = {}
+            self.bulk_started = None
+            self.bulk_writer_idle.clear()
+            self.bulk_queue.put(bulk)
+
+        def bulk_writer(self):
+            """
+            Applies the bulk operations handed over by the consumer in a
+            single transaction each, on a pooled connection; failing
+            statements are rolled back to their savepoints only, and their
+            entries are handed back to the consumer to be retried.
+            """
+            with Connection(RABBITMQ_URI) as connection:
+                self.bulk_producer = Producer(connection)
+                while True:
+                    bulk = self.bulk_queue.get()
+                    if bulk is None:
+                        break
+                    try:
+                        with self.wo_pool.connection() as db_conn:
+                            try:
+                                unapplied = self._write_bulk(db_conn, bulk)
+                            except Exception:
+                                db_conn.rollback()
+                                raise
+                    except Exception:
+                        log.exception("exception")
+                        # the whole bulk was rolled back
+                        unapplied = dict(bulk)
+                    finally:
+                        if any(
+                            entries
+                            for (part, entries) in unapplied.items()
+                            if part != "attempts"
+                        ):
+                            unapplied["attempts"] = bulk["attempts"]
+                            self.unapplied_bulk = unapplied
+                        self.bulk_writer_idle.set()
+
+        def _write_bulk(self, db_conn, bulk):
+            """
+            Applies a bulk in a single transaction, returning the entries of
+            the failing (rolled back to their savepoint) steps.
+            """
+            inserts, updates, hijacks, withdrawals, outdates = (
+                self._insert_bgp_updates(db_conn, bulk),
+                self._update_bgp_updates(db_conn, bulk),
+                self._insert_update_hijacks(db_conn, bulk),
+                self._handle_bgp_withdrawals(db_conn, bulk),
+                self._handle_hijack_outdate(db_conn, bulk),
             )
-            self._handle_hijack_outdate()
+            db_conn.commit()
+            self._compact_stats_counters(db_conn)
+            # the bgp updates that were not inserted cannot have been handled
+            # (or linked to their hijacks), and withdrawals are matched with
+            # the inserted bgp updates and hijacks
+            unapplied = {
+                "insert_bgp_entries": bulk["insert_bgp_entries"] if inserts < 0 else [],
+                "handle_bgp_withdrawals": (
+                    bulk["handle_bgp_withdrawals"]
+                    if min(inserts, hijacks, withdrawals) < 0
+                    else set()
+                ),
+                "handled_bgp_entries": (
+                    bulk["handled_bgp_entries"] if min(inserts, updates) < 0 else set()
+                ),
+                "hijack_bgp_entries": (
+                    self._hijack_bgp_entries(bulk)
+                    if min(inserts, updates) < 0
+                    else set()
+                ),
+                "outdate_hijacks": bulk["outdate_hijacks"] if outdates < 0 else set(),
+                "insert_hijacks_entries": (
+                    bulk["insert_hijacks_entries"] if hijacks < 0 else {}
+                ),
+            }
+            if inserts > 0 and DETECTION_SHARDING == "true":
+                self._publish_inserted_bgp_updates(bulk)
             str_ = ""
             if inserts:
                 str_ += "BGP Updates Inserted: {}\n".format(inserts)
@@ -1682,6 +2358,20 @@ class Database:
                 str_ += "Withdrawals Handled: {}".format(withdrawals)
             if str_ != "":
                 log.debug("{}".format(str_))
+            return unapplied
+
+        def _compact_stats_counters(self, db_conn):
+            """
+            Folds the stats counter deltas appended by the committed
+            statements into the counters, in a short transaction of its own.
+            """
+            try:
+                with db_conn.cursor() as db_cur:
+                    db_cur.execute("SELECT stats_counters_compact();")
+                db_conn.commit()
+            except Exception:
+                log.exception("exception")
+                db_conn.rollback()
 
         def _scheduler_instruction(self, message):
             msg_ = message.payload
@@ -1701,7 +2391,7 @@ class Database:
                     "INSERT INTO configs (key, raw_config, time_modified, comment)"
                     "VALUES (%s, %s, %s, %s);"
                 )
-                with get_wo_cursor(self.wo_conn) as db_cur:
+                with get_wo_cursor(self.wo_pool) as db_cur:
                     db_cur.execute(
                         query,
                         (config_hash, raw_config, datetime.datetime.now(), comment),
@@ -1711,7 +2401,7 @@ class Database:
 
         def _retrieve_most_recent_config_hash(self):
             try:
-                with get_ro_cursor(self.ro_conn) as db_cur:
+                with get_ro_cursor(self.ro_pool) as db_cur:
                     db_cur.execute(
                         "SELECT key from configs ORDER BY time_modified DESC LIMIT 1"
                     )
@@ -1723,6 +2413,175 @@ class Database:
                 log.exception("failed to retrieved most recent config hash in db")
             return None
 
+    class LaneWorker(Worker):
+        """
+        Worker of the lanes runtime: messages are still consumed through
+        kombu (in a thread of their own), but handled on lanes of bounded
+        concurrency (scheduled by an asyncio loop), so that e.g. replays and
+        hijack actions do not wait for the bgp updates in front of them. The
+        (blocking) handlers run in a thread pool, each thread publishing
+        through a producer of its own; actions on the same hijacks run in
+        the order they arrived.
+        """
+
+        def __init__(self, connection, ro_pool, wo_pool):
+            self.loop = asyncio.new_event_loop()
+            self.thread_producers = threading.local()
+            # all producers of the threads, closed once the runtime stops
+            self.producers = []
+            self.producers_lock = threading.Lock()
+            # lane: concurrency; the ingest lane owns the buffered entries,
+            # so it is serial
+            self.lane_concurrency = {
+                "ingest": 1,
+                "config": 1,
+                "replay": 1,
+                "actions": int(os.getenv("DB_LANE_ACTION_CONCURRENCY", 4)),
+            }
+            self.lane_size = int(os.getenv("DB_LANE_SIZE", 1000))
+            # created within the running loop
+            self.lanes = {}
+            # hijack key: (future of) the last action on it
+            self.hijack_actions = {}
+            self.executor = ThreadPoolExecutor(
+                max_workers=sum(self.lane_concurrency.values())
+            )
+            super().__init__(connection, ro_pool, wo_pool)
+
+        @property
+        def producer(self):
+            producer = getattr(self.thread_producers, "producer", None)
+            if producer is None:
+                producer = Producer(Connection(RABBITMQ_URI))
+                self.thread_producers.producer = producer
+                with self.producers_lock:
+                    self.producers.append(producer)
+            return producer
+
+        def close_producers(self):
+            with self.producers_lock:
+                producers = self.producers
+                self.producers = []
+            for producer in producers:
+                try:
+                    producer.release()
+                    producer.connection.release()
+                except Exception:
+                    log.exception("exception")
+
+        def get_consumers(self, Consumer, channel):
+            lanes = {
+                self.handle_config_notify: "config",
+                self.handle_hijack_ongoing_request: "replay",
+                self.handle_resolve_hijack: "actions",
+                self.handle_mitigation_request: "actions",
+                self.handle_hijack_ignore_request: "actions",
+                self.handle_hijack_comment: "actions",
+                self.handle_hijack_seen: "actions",
+                self.handle_hijack_multiple_action: "actions",
+                self.handle_delete_hijack: "actions",
+            }
+            consumers = super().get_consumers(Consumer, channel)
+            for consumer in consumers:
+                handler = consumer.on_message
+                consumer.on_message = partial(
+                    self.dispatch, lanes.get(handler, "ingest"), handler
+                )
+            return consumers
+
+        def dispatch(self, lane, handler, message):
+            # blocks the consumer thread while the lane is full
+            asyncio.run_coroutine_threadsafe(
+                self.enqueue(lane, handler, message), self.loop
+            ).result()
+
+        @staticmethod
+        def action_hijack_keys(payload):
+            if "keys" in payload:
+                return set(payload["keys"] or [])
+            if "key" in payload:
+                return {payload["key"]}
+            return set()
+
+        async def enqueue(self, lane, handler, message):
+            ordering = None
+            if lane == "actions":
+                # an action waits for the previous actions on its hijacks
+                try:
+                    keys = self.action_hijack_keys(message.payload)
+                except Exception:
+                    keys = set()
+                done = self.loop.create_future()
+                after = {
+                    self.hijack_actions[key]
+                    for key in keys
+                    if key in self.hijack_actions
+                }
+                for key in keys:
+                    self.hijack_actions[key] = done
+                ordering = (keys, after, done)
+            await self.lanes[lane].put((handler, message, ordering))
+
+        def on_iteration(self):
+            # the buffered entries are flushed on age by the ticker instead
+            pass
+
+        def flush_on_age(self, message):
+            super().on_iteration()
+
+        async def run_lane(self, lane):
+            while True:
+                (handler, message, ordering) = await self.lanes[lane].get()
+                try:
+                    if ordering is not None and ordering[1]:
+                        await asyncio.wait(ordering[1])
+                    await self.loop.run_in_executor(self.executor, handler, message)
+                except Exception:
+                    log.exception("exception")
+                finally:
+                    if ordering is not None:
+                        (keys, _, done) = ordering
+                        done.set_result(None)
+                        for key in keys:
+                            if self.hijack_actions.get(key) is done:
+                                del self.hijack_actions[key]
+
+        async def run_ticker(self):
+            while not self.should_stop:
+                await asyncio.sleep(min(self.flush_max_age, 1))
+                await self.lanes["ingest"].put((self.flush_on_age, None, None))
+
+        async def consume(self):
+            self.lanes = {
+                lane: asyncio.Queue(maxsize=self.lane_size)
+                for lane in self.lane_concurrency
+            }
+            tasks = [
+                asyncio.ensure_future(self.run_lane(lane))
+                for (lane, concurrency) in self.lane_concurrency.items()
+                for _ in range(concurrency)
+            ]
+            tasks.append(asyncio.ensure_future(self.run_ticker()))
+            consumer_executor = ThreadPoolExecutor(1)
+            try:
+                # the kombu consumer loop
+                await self.loop.run_in_executor(consumer_executor, self.run)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                consumer_executor.shutdown()
+                # the handlers still running publish until they are done
+                self.executor.shutdown()
+                self.close_producers()
+
+        def run_lanes(self):
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.loop.run_until_complete(self.consume())
+            finally:
+                self.loop.close()
+
 
 def run():
     service = Database()
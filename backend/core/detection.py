@@ -4,28 +4,34 @@ import logging
 import os
 import re
 import signal
+import threading
 import time
+from collections import namedtuple
+from collections import OrderedDict
 from datetime import datetime
-from typing import Callable
+from itertools import chain
 from typing import Dict
 from typing import List
 from typing import NoReturn
 from typing import Tuple
 
+import numpy as np
 import pytricia
 import redis
-import yaml
 from kombu import Connection
 from kombu import Consumer
 from kombu import Exchange
 from kombu import Queue
 from kombu import uuid
 from kombu.mixins import ConsumerProducerMixin
-from utils import exception_handler
+from utils import decode_hijack
+from utils import DETECTION_SHARDING
+from utils import encode_hijack
 from utils import flatten
-from utils import get_hash
 from utils import get_ip_version
 from utils import get_logger
+from utils import HIJACK_CACHE_CHANNEL
+from utils import hijack_key_generator
 from utils import hijack_log_field_formatter
 from utils import key_generator
 from utils import ping_redis
@@ -38,21 +44,132 @@ from utils import SetEncoder
 from utils import translate_asn_range
 from utils import translate_rfc2622
 
-HIJACK_DIM_COMBINATIONS = [
-    ["S", "0", "-", "-"],
-    ["S", "0", "-", "L"],
-    ["S", "1", "-", "-"],
-    ["S", "1", "-", "L"],
-    ["S", "-", "-", "-"],
-    ["S", "-", "-", "L"],
-    ["E", "0", "-", "-"],
-    ["E", "0", "-", "L"],
-    ["E", "1", "-", "-"],
-    ["E", "1", "-", "L"],
-    ["E", "-", "-", "L"],
-    ["Q", "0", "-", "-"],
-    ["Q", "0", "-", "L"],
-]
+HIJACK_DIM_COMBINATIONS = {
+    ("S", "0", "-", "-"),
+    ("S", "0", "-", "L"),
+    ("S", "1", "-", "-"),
+    ("S", "1", "-", "L"),
+    ("S", "-", "-", "-"),
+    ("S", "-", "-", "L"),
+    ("E", "0", "-", "-"),
+    ("E", "0", "-", "L"),
+    ("E", "1", "-", "-"),
+    ("E", "1", "-", "L"),
+    ("E", "-", "-", "L"),
+    ("Q", "0", "-", "-"),
+    ("Q", "0", "-", "L"),
+}
+
+# below this number of AS paths, the batched path cleaning falls back to
+# (faster for few paths) pure python
+AS_PATH_BATCH_THRESHOLD = 64
+# max (deduplicated) AS path length checked for loops in a vectorized way
+AS_PATH_MATRIX_WIDTH = 32
+
+# compiled per-prefix lookup tables, built once per configuration so that
+# classifying a BGP update only needs a handful of set lookups
+PrefixVerdict = namedtuple(
+    "PrefixVerdict",
+    [
+        "prefix_len",  # length of the configured prefix
+        "squatting",  # no origin ASNs configured at all (not even wildcards)
+        "any_origin",  # some rule allows any origin (wildcard)
+        "origins",  # origins allowed by some rule
+        "any_origin_any_neighbor",  # some rule allows any origin via any neighbor
+        "any_origin_neighbors",  # neighbors allowed for any origin
+        "any_neighbor_origins",  # origins allowed via any neighbor
+        "origin_neighbors",  # allowed (origin, neighbor) pairs
+        "no_export",  # some rule carries the no-export policy
+        "annotation_ranking",  # community annotations, in order of preference
+    ],
+)
+
+
+# atomic server-side merge of a (batched) hijack value into the hijack record
+# stored in redis; records are encoded as in utils.encode_hijack.
+# KEYS[1]: redis hijack key, KEYS[2]: persistent keys set,
+# KEYS[3]: hijack cache invalidation channel
+# ARGV[1]: encoded hijack value, ARGV[2]: id of the writing detector,
+# ARGV[3:]: community annotations by rank
+# returns {1, record} for new hijacks, {0, record} for updated hijacks
+# and -1 if the stored record is legacy (YAML), to be migrated by the caller
+MERGE_HIJACK_SCRIPT = """
+local stored = redis.call('GET', KEYS[1])
+local value = cmsgpack.unpack(string.sub(ARGV[1], 2))
+if not stored then
+    redis.call('SET', KEYS[1], ARGV[1])
+    redis.call('SADD', KEYS[2], value['key'])
+    redis.call('PUBLISH', KEYS[3], KEYS[1] .. ' ' .. ARGV[2])
+    return {1, ARGV[1]}
+end
+if string.sub(stored, 1, 1) ~= '\\1' then
+    return -1
+end
+
+local record = cmsgpack.unpack(string.sub(stored, 2))
+record['time_started'] = math.min(record['time_started'], value['time_started'])
+record['time_last'] = math.max(record['time_last'], value['time_last'])
+for _, field in ipairs({'peers_seen', 'asns_inf'}) do
+    record[field] = record[field] or {}
+    local seen = {}
+    for _, member in ipairs(record[field]) do
+        seen[member] = true
+    end
+    for _, member in ipairs(value[field]) do
+        if not seen[member] then
+            seen[member] = true
+            table.insert(record[field], member)
+        end
+    end
+end
+-- no update since db already knows!
+record['monitor_keys'] = value['monitor_keys']
+record['outdated_parent'] = value['outdated_parent']
+
+-- keep the best ranked community annotation
+local rank = {}
+for i = 3, #ARGV do
+    rank[ARGV[i]] = i
+end
+local annotation = value['community_annotation']
+local stored_annotation = record['community_annotation']
+if annotation and annotation ~= 'NA' then
+    if stored_annotation == nil or stored_annotation == 'NA'
+        or (rank[annotation] or #ARGV + 1) < (rank[stored_annotation] or #ARGV + 1) then
+        record['community_annotation'] = annotation
+    end
+end
+
+local merged = '\\1' .. cmsgpack.pack(record)
+redis.call('SET', KEYS[1], merged)
+redis.call('PUBLISH', KEYS[3], KEYS[1] .. ' ' .. ARGV[2])
+return {0, merged}
+"""
+
+# atomic server-side update of the times of a hijack record stored in redis,
+# for batched values that add nothing else to it (see MERGE_HIJACK_SCRIPT);
+# the caches of the other detectors are not invalidated, as they merge the
+# times themselves (and the db keeps min/max times anyway).
+# KEYS[1]: redis hijack key
+# ARGV[1]: time_started, ARGV[2]: time_last
+# returns 1 if the record was updated, 0 otherwise (no, legacy or covering
+# record)
+MERGE_HIJACK_TIMES_SCRIPT = """
+local stored = redis.call('GET', KEYS[1])
+if not stored or string.sub(stored, 1, 1) ~= '\\1' then
+    return 0
+end
+local record = cmsgpack.unpack(string.sub(stored, 2))
+local time_started = tonumber(ARGV[1])
+local time_last = tonumber(ARGV[2])
+if record['time_started'] <= time_started and record['time_last'] >= time_last then
+    return 0
+end
+record['time_started'] = math.min(record['time_started'], time_started)
+record['time_last'] = math.max(record['time_last'], time_last)
+redis.call('SET', KEYS[1], '\\1' .. cmsgpack.pack(record))
+return 1
+"""
 
 log = get_logger()
 hij_log = logging.getLogger("hijack_logger")
@@ -97,7 +214,12 @@ class Detection:
         try:
             with Connection(RABBITMQ_URI) as connection:
                 self.worker = self.Worker(connection)
-                self.worker.run()
+                if self.worker.batch_mode:
+                    # wake up often enough to flush batches on timeout
+                    self.worker.run(safety_interval=self.worker.batch_timeout)
+                    self.worker.flush_update_batch()
+                else:
+                    self.worker.run()
         except Exception:
             log.exception("exception")
         finally:
@@ -119,8 +241,34 @@ class Detection:
             self.prefix_tree = None
             self.mon_num = 1
 
+            # batch mode: detect the bgp updates of the prefetch window at once
+            self.batch_mode = os.getenv("DETECTION_BATCH_MODE", "false") == "true"
+            self.batch_size = int(os.getenv("DETECTION_BATCH_SIZE", 1000))
+            self.batch_timeout = float(os.getenv("DETECTION_BATCH_TIMEOUT", 0.1))
+            self.update_batch = []
+            self.update_batch_started = None
+
             self.redis = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
             ping_redis(self.redis)
+            self.merge_hijack_script = self.redis.register_script(MERGE_HIJACK_SCRIPT)
+            self.merge_hijack_times_script = self.redis.register_script(
+                MERGE_HIJACK_TIMES_SCRIPT
+            )
+
+            # write-through LRU cache of hijack records (and of their known
+            # redis origin/neighbor and prefix/peer memberships)
+            self.hijack_cache = OrderedDict()
+            self.hijack_cache_size = int(
+                os.getenv("DETECTION_HIJACK_CACHE_SIZE", 10000)
+            )
+            # cached records are revalidated against redis after this many
+            # secs, in case their invalidation was missed
+            self.hijack_cache_ttl = float(os.getenv("DETECTION_HIJACK_CACHE_TTL", 60))
+            self.hijack_cache_lock = threading.Lock()
+            self.cache_writer_id = uuid()
+            self.redis_pubsub = None
+            self.redis_listener_thread = None
+            self.setup_hijack_cache_listener()
 
             # EXCHANGES
             self.update_exchange = Exchange(
@@ -150,6 +298,15 @@ class Detection:
             )
             self.hijack_hashing.declare()
 
+            self.update_hashing = Exchange(
+                "detection-hashing",
+                channel=connection,
+                type="x-consistent-hash",
+                durable=False,
+                delivery_mode=1,
+            )
+            self.update_hashing.declare()
+
             self.handled_exchange = Exchange(
                 "handled-update",
                 channel=connection,
@@ -207,6 +364,15 @@ class Detection:
                 max_priority=3,
                 consumer_arguments={"x-priority": 3},
             )
+            self.update_shard_queue = Queue(
+                "detection-update-shard-{}".format(uuid()),
+                exchange=self.update_hashing,
+                routing_key="1",
+                durable=False,
+                auto_delete=True,
+                max_priority=1,
+                consumer_arguments={"x-priority": 1},
+            )
             self.update_rekey_queue = Queue(
                 "detection-update-rekey",
                 exchange=self.update_exchange,
@@ -223,19 +389,39 @@ class Detection:
         def get_consumers(
             self, Consumer: Consumer, channel: Connection
         ) -> List[Consumer]:
-            return [
+            consumers = [
                 Consumer(
                     queues=[self.config_queue],
                     on_message=self.handle_config_notify,
                     prefetch_count=1,
                     no_ack=True,
-                ),
-                Consumer(
-                    queues=[self.update_queue],
-                    on_message=self.handle_bgp_update,
-                    prefetch_count=1000,
-                    no_ack=True,
-                ),
+                )
+            ]
+            if DETECTION_SHARDING == "true":
+                # this detector owns a slice of the configured prefixes;
+                # the database routes new, ongoing and rekeyed updates to it
+                consumers.append(
+                    Consumer(
+                        queues=[self.update_shard_queue],
+                        on_message=self.handle_shard_updates,
+                        prefetch_count=10,
+                        no_ack=True,
+                    )
+                )
+            else:
+                consumers.append(
+                    Consumer(
+                        queues=[self.update_queue],
+                        on_message=self.buffer_bgp_update
+                        if self.batch_mode
+                        else self.handle_bgp_update,
+                        prefetch_count=max(self.batch_size, 1000)
+                        if self.batch_mode
+                        else 1000,
+                        no_ack=True,
+                    )
+                )
+            consumers += [
                 Consumer(
                     queues=[self.update_unhandled_queue],
                     on_message=self.handle_unhandled_bgp_updates,
@@ -255,6 +441,7 @@ class Detection:
                     no_ack=True,
                 ),
             ]
+            return consumers
 
         def on_consume_ready(self, connection, channel, consumers, **kwargs):
             self.producer.publish(
@@ -264,6 +451,94 @@ class Detection:
                 priority=1,
             )
 
+        def setup_hijack_cache_listener(self) -> NoReturn:
+            """
+            Listens for hijack records that are written or purged by other
+            processes, to invalidate them in the local cache.
+            """
+
+            def redis_event_handler(msg):
+                try:
+                    (redis_hijack_key, _, writer_id) = (
+                        msg["data"].decode().partition(" ")
+                    )
+                    if writer_id != self.cache_writer_id:
+                        self.invalidate_cached_hijack(redis_hijack_key)
+                except Exception:
+                    log.exception("exception")
+
+            try:
+                if self.redis_pubsub is not None:
+                    self.redis_pubsub.close()
+                self.redis_pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                self.redis_pubsub.subscribe(
+                    **{HIJACK_CACHE_CHANNEL: redis_event_handler}
+                )
+                self.redis_listener_thread = self.redis_pubsub.run_in_thread(
+                    sleep_time=1, daemon=True
+                )
+            except Exception:
+                log.exception("Exception")
+
+        def check_hijack_cache_listener(self) -> NoReturn:
+            """
+            Restarts the cache invalidation listener if it has died (e.g., on
+            a redis connection error), dropping the cache as invalidations
+            may have been missed meanwhile.
+            """
+            if (
+                self.redis_listener_thread is not None
+                and self.redis_listener_thread.is_alive()
+            ):
+                return
+            log.warning("hijack cache listener is down, restarting it")
+            with self.hijack_cache_lock:
+                self.hijack_cache.clear()
+            self.setup_hijack_cache_listener()
+
+        def get_cached_hijack(self, redis_hijack_key: str) -> Dict:
+            """
+            Returns the cached entry of a hijack (marking it as recently used),
+            if any and not due for revalidation against redis.
+            """
+            with self.hijack_cache_lock:
+                entry = self.hijack_cache.get(redis_hijack_key)
+                if entry and time.time() - entry["validated"] > self.hijack_cache_ttl:
+                    del self.hijack_cache[redis_hijack_key]
+                    return None
+                if entry:
+                    self.hijack_cache.move_to_end(redis_hijack_key)
+                return entry
+
+        def cache_hijack(
+            self, redis_hijack_key: str, hijack: Dict, validated: bool = True
+        ) -> Dict:
+            """
+            Caches a hijack record, evicting the least recently used
+            hijacks if the cache is full; validated records come from redis
+            and restart the revalidation period.
+            """
+            with self.hijack_cache_lock:
+                entry = self.hijack_cache.get(redis_hijack_key)
+                if entry:
+                    entry["record"] = hijack
+                    if validated:
+                        entry["validated"] = time.time()
+                    self.hijack_cache.move_to_end(redis_hijack_key)
+                    return entry
+                entry = {"record": hijack, "members": set(), "validated": time.time()}
+                self.hijack_cache[redis_hijack_key] = entry
+                while len(self.hijack_cache) > self.hijack_cache_size:
+                    self.hijack_cache.popitem(last=False)
+                return entry
+
+        def invalidate_cached_hijack(self, redis_hijack_key: str) -> NoReturn:
+            """
+            Removes a hijack from the cache.
+            """
+            with self.hijack_cache_lock:
+                self.hijack_cache.pop(redis_hijack_key, None)
+
         def handle_config_notify(self, message: Dict) -> NoReturn:
             """
             Consumer for Config-Notify messages that come
@@ -398,6 +673,13 @@ class Detection:
             )
             log.info("Finished building detection prefix tree.")
 
+            log.info("Compiling detection prefix verdicts...")
+            for ip_version in self.prefix_tree:
+                for prefix in self.prefix_tree[ip_version]:
+                    node = self.prefix_tree[ip_version][prefix]
+                    node["data"]["verdict"] = Detection.Worker.__compile_verdict(node)
+            log.info("Compiled detection prefix verdicts.")
+
             log.info("Detection initiated, configured and running.")
 
         def handle_ongoing_hijacks(self, message: Dict) -> NoReturn:
@@ -413,8 +695,7 @@ class Detection:
             Handles unhanlded bgp updates from the database in batches of 50.
             """
             # log.debug('{} unhandled events'.format(len(message.payload)))
-            for update in message.payload:
-                self.handle_bgp_update(update)
+            self.handle_bgp_updates(message.payload)
 
         def handle_rekey_update(self, message: Dict) -> NoReturn:
             """
@@ -424,197 +705,243 @@ class Detection:
             for update in message.payload:
                 self.handle_bgp_update(update)
 
+        def handle_shard_updates(self, message: Dict) -> NoReturn:
+            """
+            Handles batches of bgp updates (new, ongoing or needing rekeying)
+            routed by the database to this detection shard.
+            """
+            # log.debug('{} shard events'.format(len(message.payload)))
+            updates = []
+            for update in message.payload:
+                # ongoing hijack updates may purge hijacks; keep them in order
+                if "hij_key" in update:
+                    self.handle_bgp_update(update)
+                else:
+                    updates.append(update)
+            self.handle_bgp_updates(updates)
+
+        def buffer_bgp_update(self, message: Dict) -> NoReturn:
+            """
+            Callback function (batch mode) that buffers bgp updates
+            of the prefetch window, so that they are detected all at once.
+            """
+            if not self.update_batch:
+                self.update_batch_started = time.time()
+            self.update_batch.append(message)
+            if len(self.update_batch) >= self.batch_size:
+                self.flush_update_batch()
+
+        def on_iteration(self) -> NoReturn:
+            """
+            Flushes the buffered bgp updates (batch mode) if they have been
+            waiting for more than the batch timeout.
+            """
+            self.check_hijack_cache_listener()
+            if (
+                self.update_batch
+                and time.time() - self.update_batch_started >= self.batch_timeout
+            ):
+                self.flush_update_batch()
+
+        def flush_update_batch(self) -> NoReturn:
+            """
+            Detects hijacks for all the buffered bgp updates.
+            """
+            messages = self.update_batch
+            self.update_batch = []
+            monitor_events = []
+            for message in messages:
+                try:
+                    monitor_events.append(Detection.Worker.__parse_update(message))
+                except Exception:
+                    log.exception("exception")
+            self.handle_bgp_updates(monitor_events)
+
+        @staticmethod
+        def __parse_update(message: Dict) -> Dict:
+            """
+            Static method that extracts a monitor event from
+            a bgp update message coming from the database.
+            """
+            if isinstance(message, dict):
+                return message
+            monitor_event = json.loads(message.payload)
+            monitor_event["path"] = monitor_event["as_path"]
+            monitor_event["timestamp"] = datetime(
+                *map(int, re.findall(r"\d+", monitor_event["timestamp"]))
+            ).timestamp()
+            return monitor_event
+
         def handle_bgp_update(self, message: Dict) -> NoReturn:
             """
             Callback function that runs the main logic of
             detecting hijacks for every bgp update.
             """
             # log.debug('{}'.format(message))
-            if isinstance(message, dict):
-                monitor_event = message
-            else:
-                monitor_event = json.loads(message.payload)
-                monitor_event["path"] = monitor_event["as_path"]
-                monitor_event["timestamp"] = datetime(
-                    *map(int, re.findall(r"\d+", monitor_event["timestamp"]))
-                ).timestamp()
-
-            raw = monitor_event.copy()
-
-            # mark the initial redis hijack key since it may change upon
-            # outdated checks
-            if "hij_key" in monitor_event:
-                monitor_event["initial_redis_hijack_key"] = redis_key(
-                    monitor_event["prefix"],
-                    monitor_event["hijack_as"],
-                    monitor_event["hij_type"],
-                )
+            self.handle_bgp_updates([Detection.Worker.__parse_update(message)])
 
-            is_hijack = False
+        def handle_bgp_updates(self, monitor_events: List[Dict]) -> NoReturn:
+            """
+            Runs the main logic of detecting hijacks for a batch of bgp updates.
+            All updates are classified in one pass, the redis operations for
+            the resulting hijacks are grouped per batch and the handled updates
+            and withdrawals are published as batched payloads.
+            """
+            # normalize the AS paths of all announcements at once
+            announcements = [
+                monitor_event
+                for monitor_event in monitor_events
+                if monitor_event["type"] == "A"
+            ]
+            clean_as_paths = Detection.Worker.__clean_as_paths(
+                [monitor_event["path"] for monitor_event in announcements]
+            )
+            for (monitor_event, clean_as_path) in zip(announcements, clean_as_paths):
+                monitor_event["path"] = clean_as_path
+
+            hijacks = []
+            benign_events = []
+            withdrawals = []
+            for monitor_event in monitor_events:
+                # mark the initial redis hijack key since it may change upon
+                # outdated checks
+                if "hij_key" in monitor_event:
+                    monitor_event["initial_redis_hijack_key"] = redis_key(
+                        monitor_event["prefix"],
+                        monitor_event["hijack_as"],
+                        monitor_event["hij_type"],
+                    )
 
-            if monitor_event["type"] == "A":
-                monitor_event["path"] = Detection.Worker.__clean_as_path(
-                    monitor_event["path"]
-                )
+                if monitor_event["type"] == "A":
+                    is_hijack = False
+                    ip_version = get_ip_version(monitor_event["prefix"])
+                    prefix_node = self.prefix_tree[ip_version].get(
+                        monitor_event["prefix"]
+                    )
+                    if prefix_node:
+                        monitor_event["matched_prefix"] = prefix_node["prefix"]
 
-                ip_version = get_ip_version(monitor_event["prefix"])
-                if monitor_event["prefix"] in self.prefix_tree[ip_version]:
-                    prefix_node = self.prefix_tree[ip_version][monitor_event["prefix"]]
-                    monitor_event["matched_prefix"] = prefix_node["prefix"]
+                        try:
+                            hijacker, hij_dimensions = self.__classify(
+                                monitor_event, prefix_node["data"]["verdict"]
+                            )
+                            # check if dimension combination in hijack combinations
+                            if hij_dimensions in HIJACK_DIM_COMBINATIONS:
+                                is_hijack = True
+                                hijacks.append(
+                                    (monitor_event, hijacker, hij_dimensions)
+                                )
+                        except Exception:
+                            log.exception("exception")
+
+                    if not is_hijack:
+                        benign_events.append(monitor_event)
+
+                elif monitor_event["type"] == "W":
+                    withdrawals.append(
+                        {
+                            "prefix": monitor_event["prefix"],
+                            "peer_asn": monitor_event["peer_asn"],
+                            "timestamp": monitor_event["timestamp"],
+                            "key": monitor_event["key"],
+                        }
+                    )
 
-                    try:
-                        path_hijacker = -1
-                        pol_hijacker = -1
-                        hij_dimensions = [
-                            "-",
-                            "-",
-                            "-",
-                            "-",
-                        ]  # prefix, path, dplane, policy
-                        hij_dimension_index = 0
-                        for func_dim in self.__hijack_dimension_checker_gen():
-                            if hij_dimension_index == 0:
-                                # prefix dimension
-                                for func_pref in func_dim():
-                                    hij_dimensions[hij_dimension_index] = func_pref(
-                                        monitor_event, prefix_node
-                                    )
-                                    if hij_dimensions[hij_dimension_index] != "-":
-                                        break
-                            elif hij_dimension_index == 1:
-                                # path type dimension
-                                for func_path in func_dim(len(monitor_event["path"])):
-                                    (
-                                        path_hijacker,
-                                        hij_dimensions[hij_dimension_index],
-                                    ) = func_path(monitor_event, prefix_node)
-                                    if hij_dimensions[hij_dimension_index] != "-":
-                                        break
-                            elif hij_dimension_index == 2:
-                                # data plane dimension
-                                for func_dplane in func_dim():
-                                    hij_dimensions[hij_dimension_index] = func_dplane(
-                                        monitor_event, prefix_node
-                                    )
-                                    if hij_dimensions[hij_dimension_index] != "-":
-                                        break
-                            elif hij_dimension_index == 3:
-                                # policy dimension
-                                for func_pol in func_dim(len(monitor_event["path"])):
-                                    (
-                                        pol_hijacker,
-                                        hij_dimensions[hij_dimension_index],
-                                    ) = func_pol(monitor_event, prefix_node)
-                                    if hij_dimensions[hij_dimension_index] != "-":
-                                        break
-                            hij_dimension_index += 1
-                        # check if dimension combination in hijack combinations
-                        # and commit hijack
-                        if hij_dimensions in HIJACK_DIM_COMBINATIONS:
-                            is_hijack = True
-                            # show pol hijacker only if the path hijacker is uncertain
-                            hijacker = path_hijacker
-                            if path_hijacker == -1 and pol_hijacker != -1:
-                                hijacker = pol_hijacker
-                            self.commit_hijack(monitor_event, hijacker, hij_dimensions)
-                    except Exception:
-                        log.exception("exception")
+            # commit the hijacks of the whole batch
+            if hijacks:
+                try:
+                    self.commit_hijacks(hijacks)
+                except Exception:
+                    log.exception("exception")
 
-                outdated_hijack = None
-                if not is_hijack and "hij_key" in monitor_event:
+            handled_events = []
+            for monitor_event in benign_events:
+                if "hij_key" in monitor_event:
                     try:
                         # outdated hijack, benign from now on
-                        redis_hijack_key = redis_key(
-                            monitor_event["prefix"],
-                            monitor_event["hijack_as"],
-                            monitor_event["hij_type"],
+                        self.purge_outdated_hijack(
+                            monitor_event, monitor_event["initial_redis_hijack_key"]
                         )
-                        outdated_hijack = self.redis.get(redis_hijack_key)
-                        purge_redis_eph_pers_keys(
-                            self.redis, redis_hijack_key, monitor_event["hij_key"]
-                        )
-                        # mark in DB only if it is the first time this hijack was purged (pre-existsent in redis)
-                        if outdated_hijack:
-                            self.mark_outdated(
-                                monitor_event["hij_key"], redis_hijack_key
-                            )
                     except Exception:
                         log.exception("exception")
-                elif (
-                    is_hijack
-                    and "hij_key" in monitor_event
+                else:
+                    handled_events.append(monitor_event)
+
+            for (monitor_event, _, _) in hijacks:
+                if (
+                    "hij_key" in monitor_event
                     and monitor_event["initial_redis_hijack_key"]
                     != monitor_event["final_redis_hijack_key"]
                 ):
                     try:
-                        outdated_hijack = self.redis.get(
-                            monitor_event["initial_redis_hijack_key"]
-                        )
                         # outdated hijack, but still a hijack; need key change
-                        purge_redis_eph_pers_keys(
-                            self.redis,
-                            monitor_event["initial_redis_hijack_key"],
-                            monitor_event["hij_key"],
+                        self.purge_outdated_hijack(
+                            monitor_event, monitor_event["initial_redis_hijack_key"]
                         )
-                        # mark in DB only if it is the first time this hijack was purged (pre-existsent in redis)
-                        if outdated_hijack:
-                            self.mark_outdated(
-                                monitor_event["hij_key"],
-                                monitor_event["initial_redis_hijack_key"],
-                            )
                     except Exception:
                         log.exception("exception")
-                elif not is_hijack:
-                    self.gen_implicit_withdrawal(monitor_event)
-                    self.mark_handled(raw)
 
-                if outdated_hijack:
-                    try:
-                        outdated_hijack = yaml.safe_load(outdated_hijack)
-                        outdated_hijack["end_tag"] = "outdated"
-                        mail_log.info(
-                            "{}".format(
-                                json.dumps(
-                                    hijack_log_field_formatter(outdated_hijack),
-                                    indent=4,
-                                    cls=SetEncoder,
-                                )
-                            ),
-                            extra={
-                                "community_annotation": outdated_hijack.get(
-                                    "community_annotation", "NA"
-                                )
-                            },
-                        )
-                        hij_log.info(
-                            "{}".format(
-                                json.dumps(
-                                    hijack_log_field_formatter(outdated_hijack),
-                                    cls=SetEncoder,
-                                )
-                            ),
-                            extra={
-                                "community_annotation": outdated_hijack.get(
-                                    "community_annotation", "NA"
-                                )
-                            },
-                        )
-                    except Exception:
-                        log.exception("exception")
+            if handled_events:
+                self.gen_implicit_withdrawals(handled_events)
+                self.mark_handled(handled_events)
 
-            elif monitor_event["type"] == "W":
+            if withdrawals:
                 self.producer.publish(
-                    {
-                        "prefix": monitor_event["prefix"],
-                        "peer_asn": monitor_event["peer_asn"],
-                        "timestamp": monitor_event["timestamp"],
-                        "key": monitor_event["key"],
-                    },
+                    withdrawals,
                     exchange=self.update_exchange,
                     routing_key="withdraw",
                     priority=0,
                 )
 
+        def purge_outdated_hijack(
+            self, monitor_event: Dict, redis_hijack_key: str
+        ) -> NoReturn:
+            """
+            Purges an outdated hijack from redis and marks it as outdated
+            on the database (only if it was pre-existent in redis).
+            """
+            outdated_hijack = purge_redis_eph_pers_keys(
+                self.redis, redis_hijack_key, monitor_event["hij_key"]
+            )
+            # right away, not only through the (lossy) pub/sub invalidation
+            self.invalidate_cached_hijack(redis_hijack_key)
+            # mark in DB only if it is the first time this hijack was purged (pre-existsent in redis)
+            if not outdated_hijack:
+                return
+            self.mark_outdated(monitor_event["hij_key"], redis_hijack_key)
+
+            try:
+                outdated_hijack = decode_hijack(outdated_hijack)
+                outdated_hijack["end_tag"] = "outdated"
+                mail_log.info(
+                    "{}".format(
+                        json.dumps(
+                            hijack_log_field_formatter(outdated_hijack),
+                            indent=4,
+                            cls=SetEncoder,
+                        )
+                    ),
+                    extra={
+                        "community_annotation": outdated_hijack.get(
+                            "community_annotation", "NA"
+                        )
+                    },
+                )
+                hij_log.info(
+                    "{}".format(
+                        json.dumps(
+                            hijack_log_field_formatter(outdated_hijack), cls=SetEncoder
+                        )
+                    ),
+                    extra={
+                        "community_annotation": outdated_hijack.get(
+                            "community_annotation", "NA"
+                        )
+                    },
+                )
+            except Exception:
+                log.exception("exception")
+
         @staticmethod
         def __remove_prepending(seq: List[int]) -> Tuple[List[int], bool]:
             """
@@ -659,271 +986,343 @@ class Detection:
                 clean_as_path = Detection.Worker.__clean_loops(clean_as_path)
             return clean_as_path
 
-        def __hijack_dimension_checker_gen(self) -> Callable:
-            """
-            Generator that returns hijack dimension checking functions.
-            """
-            yield self.__hijack_prefix_checker_gen
-            yield self.__hijack_path_checker_gen
-            yield self.__hijack_dplane_checker_gen
-            yield self.__hijack_pol_checker_gen
-
-        def __hijack_prefix_checker_gen(self) -> Callable:
-            """
-            Generator that returns prefix dimension detection functions.
-            """
-            yield self.detect_prefix_squatting_hijack
-            yield self.detect_prefix_subprefix_hijack
-
-        def __hijack_path_checker_gen(self, path_len: int) -> Callable:
-            """
-            Generator that returns path dimension detection functions.
-            """
-            if path_len > 0:
-                yield self.detect_path_type_0_hijack
-                if path_len > 1:
-                    yield self.detect_path_type_1_hijack
-                    if path_len > 2:
-                        yield self.detect_path_type_N_hijack
-            yield self.detect_path_type_U_hijack
-
-        def __hijack_dplane_checker_gen(self) -> Callable:
+        @staticmethod
+        def __clean_as_paths(paths: List[List[int]]) -> List[List[int]]:
             """
-            Generator that returns data plane dimension detection functions.
+            Static method for batched loop and prepending removal.
+            All paths are packed into flat arrays; prepending is removed and
+            loops are detected with vectorized operations, while the (rare)
+            loopy paths are then cleaned one by one.
             """
-            yield self.detect_dplane_blackholing_hijack
-            yield self.detect_dplane_imposture_hijack
-            yield self.detect_dplane_mitm_hijack
+            if len(paths) < AS_PATH_BATCH_THRESHOLD:
+                return [Detection.Worker.__clean_as_path(path) for path in paths]
 
-        def __hijack_pol_checker_gen(self, path_len: int) -> Callable:
-            """
-            Generator that returns policy dimension detection functions.
-            """
-            if path_len > 3:
-                yield self.detect_pol_leak_hijack
-            yield self.detect_pol_other_hijack
+            lengths = np.fromiter(map(len, paths), dtype=np.int64, count=len(paths))
+            asns = np.fromiter(
+                chain.from_iterable(paths), dtype=np.int64, count=int(lengths.sum())
+            )
+            path_ids = np.repeat(np.arange(len(paths), dtype=np.int64), lengths)
+
+            # remove prepending: keep an ASN unless it repeats the previous
+            # ASN of the same path
+            keep = np.ones(len(asns), dtype=bool)
+            keep[1:] = (asns[1:] != asns[:-1]) | (path_ids[1:] != path_ids[:-1])
+            asns = asns[keep]
+            path_ids = path_ids[keep]
+            dedup_lengths = np.bincount(path_ids, minlength=len(paths))
+
+            # a path is loopy if an ASN appears twice after prepending removal;
+            # detect it on a (paths x ASNs) matrix with rows sorted, in which
+            # loops show up as equal neighbors (-1 pads the shorter paths)
+            ends = np.cumsum(dedup_lengths)
+            width = min(int(dedup_lengths.max(initial=0)), AS_PATH_MATRIX_WIDTH)
+            short = (dedup_lengths <= width)[path_ids]
+            positions = np.arange(len(asns)) - (ends - dedup_lengths)[path_ids]
+            matrix = np.full((len(paths), width), -1, dtype=np.int64)
+            matrix[path_ids[short], positions[short]] = asns[short]
+            matrix.sort(axis=1)
+            loopy = ((matrix[:, 1:] == matrix[:, :-1]) & (matrix[:, 1:] != -1)).any(
+                axis=1
+            )
+            # longer paths are checked (and cleaned) one by one
+            loopy |= dedup_lengths > width
+
+            clean_asns = asns.tolist()
+            clean_as_paths = []
+            for (path, start, end, is_prepended, is_loopy) in zip(
+                paths,
+                (ends - dedup_lengths).tolist(),
+                ends.tolist(),
+                (dedup_lengths != lengths).tolist(),
+                loopy.tolist(),
+            ):
+                if is_loopy:
+                    clean_as_paths.append(
+                        Detection.Worker.__clean_loops(clean_asns[start:end])
+                    )
+                elif is_prepended:
+                    clean_as_paths.append(clean_asns[start:end])
+                else:
+                    # already clean, no need to copy
+                    clean_as_paths.append(path)
+            return clean_as_paths
 
-        @exception_handler(log)
-        def detect_prefix_squatting_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> str:
+        @staticmethod
+        def __compile_verdict(prefix_node: Dict) -> PrefixVerdict:
             """
-            Squatting hijack detection.
+            Static method that compiles the configuration rules of a prefix
+            node into lookup tables for fast classification.
             """
-            for item in prefix_node["data"]["confs"]:
-                # check if there are origin_asns defined (even wildcards)
+            confs = prefix_node["data"]["confs"]
+            squatting = True
+            any_origin = False
+            origins = set()
+            any_origin_any_neighbor = False
+            any_origin_neighbors = set()
+            any_neighbor_origins = set()
+            origin_neighbors = set()
+            no_export = False
+            annotation_ranking = []
+            for item in confs:
+                # [] or [-1] neighbors means "allow everything"
+                any_neighbor = (not item["neighbors"]) or item["neighbors"] == [-1]
                 if item["origin_asns"]:
-                    return "-"
-            return "Q"
+                    squatting = False
+                if item["origin_asns"] == [-1]:
+                    any_origin = True
+                    if any_neighbor:
+                        any_origin_any_neighbor = True
+                    else:
+                        any_origin_neighbors.update(item["neighbors"])
+                else:
+                    origins.update(item["origin_asns"])
+                    if any_neighbor:
+                        any_neighbor_origins.update(item["origin_asns"])
+                    else:
+                        for origin_asn in item["origin_asns"]:
+                            for neighbor_asn in item["neighbors"]:
+                                origin_neighbors.add((origin_asn, neighbor_asn))
+                if "no-export" in item["policies"]:
+                    no_export = True
+                for annotation_element in item.get("community_annotations", []):
+                    for annotation in annotation_element:
+                        if annotation not in annotation_ranking:
+                            annotation_ranking.append(annotation)
+
+            return PrefixVerdict(
+                prefix_len=ipaddress.ip_network(prefix_node["prefix"]).prefixlen,
+                squatting=squatting,
+                any_origin=any_origin,
+                origins=frozenset(origins),
+                any_origin_any_neighbor=any_origin_any_neighbor,
+                any_origin_neighbors=frozenset(any_origin_neighbors),
+                any_neighbor_origins=frozenset(any_neighbor_origins),
+                origin_neighbors=frozenset(origin_neighbors),
+                no_export=no_export,
+                annotation_ranking=annotation_ranking,
+            )
 
-        @exception_handler(log)
-        def detect_prefix_subprefix_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> str:
+        @staticmethod
+        def __classify(
+            monitor_event: Dict, verdict: PrefixVerdict
+        ) -> Tuple[int, Tuple[str, str, str, str]]:
             """
-            Subprefix or exact prefix hijack detection.
+            Static method that classifies a (cleaned) announcement against
+            the compiled verdict of its best matching configured prefix.
+            Returns the hijacker and the hijack dimensions
+            (prefix, path, dplane, policy).
             """
-            mon_prefix = ipaddress.ip_network(monitor_event["prefix"])
-            if (
-                ipaddress.ip_network(prefix_node["prefix"]).prefixlen
-                < mon_prefix.prefixlen
-            ):
-                return "S"
-            return "E"
+            path = monitor_event["path"]
+            path_len = len(path)
 
-        @exception_handler(log)
-        def detect_path_type_0_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> Tuple[int, str]:
-            """
-            Origin hijack detection.
-            """
-            origin_asn = monitor_event["path"][-1]
-            for item in prefix_node["data"]["confs"]:
-                if origin_asn in item["origin_asns"] or item["origin_asns"] == [-1]:
-                    return (-1, "-")
-            return (origin_asn, "0")
+            # prefix dimension: squatting, subprefix or exact
+            if verdict.squatting:
+                prefix_dim = "Q"
+            else:
+                mon_prefix = monitor_event["prefix"]
+                if "/" in mon_prefix:
+                    mon_prefix_len = int(mon_prefix.rsplit("/", 1)[1])
+                else:
+                    mon_prefix_len = ipaddress.ip_network(mon_prefix).prefixlen
+                prefix_dim = "S" if verdict.prefix_len < mon_prefix_len else "E"
 
-        @exception_handler(log)
-        def detect_path_type_1_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> Tuple[int, str]:
-            """
-            Type-1 hijack detection.
-            """
-            origin_asn = monitor_event["path"][-1]
-            first_neighbor_asn = monitor_event["path"][-2]
-            for item in prefix_node["data"]["confs"]:
-                # [] or [-1] neighbors means "allow everything"
-                if (
-                    origin_asn in item["origin_asns"] or item["origin_asns"] == [-1]
-                ) and (
-                    (not item["neighbors"])
-                    or item["neighbors"] == [-1]
-                    or first_neighbor_asn in item["neighbors"]
-                ):
-                    return (-1, "-")
-            return (first_neighbor_asn, "1")
-
-        @exception_handler(log)
-        def detect_path_type_N_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> Tuple[int, str]:
-            # Placeholder for type-N detection (not supported)
-            return (-1, "-")
-
-        @exception_handler(log)
-        def detect_path_type_U_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> Tuple[int, str]:
-            # Placeholder for type-U detection (not supported)
-            return (-1, "-")
-
-        @exception_handler(log)
-        def detect_dplane_blackholing_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> str:
-            # Placeholder for blackholing detection  (not supported)
-            return "-"
-
-        @exception_handler(log)
-        def detect_dplane_imposture_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> str:
-            # Placeholder for imposture detection  (not supported)
-            return "-"
-
-        @exception_handler(log)
-        def detect_dplane_mitm_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> str:
-            # Placeholder for mitm detection  (not supported)
-            return "-"
-
-        @exception_handler(log)
-        def detect_pol_leak_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> Tuple[int, str]:
-            """
-            Route leak hijack detection
-            """
-            for item in prefix_node["data"]["confs"]:
-                if "no-export" in item["policies"]:
-                    return (monitor_event["path"][-2], "L")
-            return (-1, "-")
-
-        @exception_handler(log)
-        def detect_pol_other_hijack(
-            self, monitor_event: Dict, prefix_node: Dict, *args, **kwargs
-        ) -> Tuple[int, str]:
-            # Placeholder for policy violation detection (not supported)
-            return (-1, "-")
-
-        def commit_hijack(
-            self, monitor_event: Dict, hijacker: int, hij_dimensions: List[str]
+            # path dimension: type-0 (origin) or type-1 (first neighbor);
+            # type-N and type-U are not supported
+            path_hijacker = -1
+            path_dim = "-"
+            if path_len > 0:
+                origin_asn = path[-1]
+                if not (verdict.any_origin or origin_asn in verdict.origins):
+                    path_hijacker = origin_asn
+                    path_dim = "0"
+                elif path_len > 1:
+                    first_neighbor_asn = path[-2]
+                    if not (
+                        verdict.any_origin_any_neighbor
+                        or origin_asn in verdict.any_neighbor_origins
+                        or first_neighbor_asn in verdict.any_origin_neighbors
+                        or (origin_asn, first_neighbor_asn) in verdict.origin_neighbors
+                    ):
+                        path_hijacker = first_neighbor_asn
+                        path_dim = "1"
+
+            # data plane dimension: not supported
+
+            # policy dimension: route leak of no-export prefixes
+            pol_hijacker = -1
+            pol_dim = "-"
+            if path_len > 3 and verdict.no_export:
+                pol_hijacker = path[-2]
+                pol_dim = "L"
+
+            # show pol hijacker only if the path hijacker is uncertain
+            hijacker = path_hijacker
+            if path_hijacker == -1 and pol_hijacker != -1:
+                hijacker = pol_hijacker
+            return (hijacker, (prefix_dim, path_dim, "-", pol_dim))
+
+        def commit_hijacks(
+            self, hijacks: List[Tuple[Dict, int, Tuple[str, ...]]]
         ) -> NoReturn:
             """
-            Commit new or update an existing hijack to the database.
+            Commit new or update existing hijacks to the database, for a batch
+            of hijack BGP updates. Updates of the same hijack are merged in
+            memory first and then merged atomically into redis (server-side),
+            with a single pipeline per batch instead of per BGP update.
             It uses redis server to store ongoing hijacks information
             to not stress the db.
             """
-            hij_type = "|".join(hij_dimensions)
-            redis_hijack_key = redis_key(monitor_event["prefix"], hijacker, hij_type)
-
-            if "hij_key" in monitor_event:
-                monitor_event["final_redis_hijack_key"] = redis_hijack_key
-
-            hijack_value = {
-                "prefix": monitor_event["prefix"],
-                "hijack_as": hijacker,
-                "type": hij_type,
-                "time_started": monitor_event["timestamp"],
-                "time_last": monitor_event["timestamp"],
-                "peers_seen": {monitor_event["peer_asn"]},
-                "monitor_keys": {monitor_event["key"]},
-                "configured_prefix": monitor_event["matched_prefix"],
-                "timestamp_of_config": self.timestamp,
-                "end_tag": None,
-                "outdated_parent": None,
-            }
+            batch = {}
+            for (monitor_event, hijacker, hij_dimensions) in hijacks:
+                hij_type = "|".join(hij_dimensions)
+                redis_hijack_key = redis_key(
+                    monitor_event["prefix"], hijacker, hij_type
+                )
 
-            if (
-                "hij_key" in monitor_event
-                and monitor_event["initial_redis_hijack_key"]
-                != monitor_event["final_redis_hijack_key"]
-            ):
-                hijack_value["outdated_parent"] = monitor_event["hij_key"]
+                if "hij_key" in monitor_event:
+                    monitor_event["final_redis_hijack_key"] = redis_hijack_key
+
+                hijack_value = {
+                    "prefix": monitor_event["prefix"],
+                    "hijack_as": hijacker,
+                    "type": hij_type,
+                    "time_started": monitor_event["timestamp"],
+                    "time_last": monitor_event["timestamp"],
+                    "peers_seen": {monitor_event["peer_asn"]},
+                    "monitor_keys": {monitor_event["key"]},
+                    "configured_prefix": monitor_event["matched_prefix"],
+                    "timestamp_of_config": self.timestamp,
+                    "end_tag": None,
+                    "outdated_parent": None,
+                }
 
-            # identify the number of infected ases
-            hijack_value["asns_inf"] = set()
-            if hij_dimensions[1] in {"0", "1"}:
-                hijack_value["asns_inf"] = set(
-                    monitor_event["path"][: -(int(hij_dimensions[1]) + 1)]
-                )
-            elif hij_dimensions[3] == "L":
-                hijack_value["asns_inf"] = set(monitor_event["path"][:-2])
-            # assume the worst-case scenario of a type-2 hijack
-            elif len(monitor_event["path"]) > 2:
-                hijack_value["asns_inf"] = set(monitor_event["path"][:-3])
-
-            # make the following operation atomic using blpop (blocking)
-            # first, make sure that the semaphore is initialized
-            if self.redis.getset("{}token_active".format(redis_hijack_key), 1) != b"1":
-                redis_pipeline = self.redis.pipeline()
-                redis_pipeline.lpush("{}token".format(redis_hijack_key), "token")
-                # lock, by extracting the token (other processes that access
-                # it at the same time will be blocked)
-                # attention: it is important that this command is batched in the
-                # pipeline since the db may async delete
-                # the token
-                redis_pipeline.blpop("{}token".format(redis_hijack_key))
-                redis_pipeline.execute()
-            else:
-                # lock, by extracting the token (other processes that access it
-                # at the same time will be blocked)
-                token = self.redis.blpop("{}token".format(redis_hijack_key), timeout=60)
-                # if timeout after 60 seconds, return without hijack alert
-                # since this means that sth has been purged in the meanwhile (e.g., due to outdated hijack
-                # in another instance; a detector cannot be stuck for a whole minute in a single hijack BGP update)
-                if not token:
-                    log.info(
-                        "Monitor event {} encountered redis token timeout and will be cleared as benign for hijack {}".format(
-                            str(monitor_event), redis_hijack_key
-                        )
-                    )
-                    return
+                if (
+                    "hij_key" in monitor_event
+                    and monitor_event["initial_redis_hijack_key"]
+                    != monitor_event["final_redis_hijack_key"]
+                ):
+                    hijack_value["outdated_parent"] = monitor_event["hij_key"]
 
-            # proceed now that we have clearance
+                # identify the number of infected ases
+                hijack_value["asns_inf"] = set()
+                if hij_dimensions[1] in {"0", "1"}:
+                    hijack_value["asns_inf"] = set(
+                        monitor_event["path"][: -(int(hij_dimensions[1]) + 1)]
+                    )
+                elif hij_dimensions[3] == "L":
+                    hijack_value["asns_inf"] = set(monitor_event["path"][:-2])
+                # assume the worst-case scenario of a type-2 hijack
+                elif len(monitor_event["path"]) > 2:
+                    hijack_value["asns_inf"] = set(monitor_event["path"][:-3])
+
+                # merge updates of the same hijack within the batch
+                if redis_hijack_key not in batch:
+                    batch[redis_hijack_key] = {
+                        "value": hijack_value,
+                        "monitor_events": [monitor_event],
+                    }
+                    continue
+                batched_value = batch[redis_hijack_key]["value"]
+                batched_value["time_started"] = min(
+                    batched_value["time_started"], hijack_value["time_started"]
+                )
+                batched_value["time_last"] = max(
+                    batched_value["time_last"], hijack_value["time_last"]
+                )
+                batched_value["peers_seen"].update(hijack_value["peers_seen"])
+                batched_value["monitor_keys"].update(hijack_value["monitor_keys"])
+                batched_value["asns_inf"].update(hijack_value["asns_inf"])
+                batched_value["outdated_parent"] = hijack_value["outdated_parent"]
+                batch[redis_hijack_key]["monitor_events"].append(monitor_event)
+
+            # merge the batched values into redis atomically (server-side),
+            # so that concurrent detectors never block on each other; values
+            # that add nothing new to a cached hijack need no redis access
+            results = []
+            redis_hijack_keys = []
+            # covered hijacks whose times (only) are to be merged into redis
+            redis_hijack_times = []
             redis_pipeline = self.redis.pipeline()
-            try:
-                result = self.redis.get(redis_hijack_key)
-                if result:
-                    result = yaml.safe_load(result)
+            for (redis_hijack_key, batch_entry) in batch.items():
+                hijack_value = batch_entry["value"]
+                # used only if the hijack is new
+                hijack_value["time_detected"] = time.time()
+                hijack_value["key"] = hijack_key_generator(
+                    hijack_value["prefix"],
+                    hijack_value["hijack_as"],
+                    hijack_value["type"],
+                    hijack_value["time_detected"],
+                )
+                for monitor_event in batch_entry["monitor_events"]:
+                    self.comm_annotate_hijack(monitor_event, hijack_value)
+
+                cached = self.get_cached_hijack(redis_hijack_key)
+                if cached and Detection.Worker.__is_covered(
+                    cached["record"], hijack_value
+                ):
+                    # only the times may be new
+                    if (
+                        hijack_value["time_started"] < cached["record"]["time_started"]
+                        or hijack_value["time_last"] > cached["record"]["time_last"]
+                    ):
+                        redis_hijack_times.append((redis_hijack_key, hijack_value))
+                    result = dict(cached["record"])
                     result["time_started"] = min(
                         result["time_started"], hijack_value["time_started"]
                     )
                     result["time_last"] = max(
                         result["time_last"], hijack_value["time_last"]
                     )
-                    result["peers_seen"].update(hijack_value["peers_seen"])
-                    result["asns_inf"].update(hijack_value["asns_inf"])
-                    # no update since db already knows!
                     result["monitor_keys"] = hijack_value["monitor_keys"]
-                    self.comm_annotate_hijack(monitor_event, result)
-                    result["outdated_parent"] = hijack_value["outdated_parent"]
+                    self.cache_hijack(redis_hijack_key, result, validated=False)
+                    results.append((redis_hijack_key, False, result))
                 else:
-                    hijack_value["time_detected"] = time.time()
-                    hijack_value["key"] = get_hash(
-                        [
-                            monitor_event["prefix"],
-                            hijacker,
-                            hij_type,
-                            "{0:.6f}".format(hijack_value["time_detected"]),
-                        ]
+                    self.__merge_hijack(redis_pipeline, redis_hijack_key, hijack_value)
+                    redis_hijack_keys.append(redis_hijack_key)
+
+            # after the merges, whose results come first
+            for (redis_hijack_key, hijack_value) in redis_hijack_times:
+                self.merge_hijack_times_script(
+                    keys=[redis_hijack_key],
+                    args=[hijack_value["time_started"], hijack_value["time_last"]],
+                    client=redis_pipeline,
+                )
+
+            # store only the origin/neighbor and prefix/peer info not known yet
+            for (redis_hijack_key, batch_entry) in batch.items():
+                cached = self.get_cached_hijack(redis_hijack_key)
+                for monitor_event in batch_entry["monitor_events"]:
+                    self.__store_hijack_update_info(
+                        redis_pipeline,
+                        redis_hijack_key,
+                        monitor_event,
+                        cached["members"] if cached else None,
                     )
-                    redis_pipeline.sadd("persistent-keys", hijack_value["key"])
-                    result = hijack_value
-                    self.comm_annotate_hijack(monitor_event, result)
+            try:
+                merge_results = redis_pipeline.execute()[: len(redis_hijack_keys)]
+            except Exception:
+                # the cached info of this batch may not have been stored
+                for redis_hijack_key in batch:
+                    self.invalidate_cached_hijack(redis_hijack_key)
+                raise
+
+            for (redis_hijack_key, merge_result) in zip(
+                redis_hijack_keys, merge_results
+            ):
+                try:
+                    if merge_result == -1:
+                        merge_result = self.__merge_legacy_hijack(
+                            redis_hijack_key, batch[redis_hijack_key]["value"]
+                        )
+                    (is_new, result) = merge_result
+                    result = decode_hijack(result)
+                    self.cache_hijack(redis_hijack_key, result)
+                    results.append((redis_hijack_key, is_new, result))
+                except Exception:
+                    log.exception("exception")
+
+            for (redis_hijack_key, is_new, result) in results:
+                if is_new:
                     mail_log.info(
                         "{}".format(
                             json.dumps(
@@ -938,71 +1337,140 @@ class Detection:
                             )
                         },
                     )
-                redis_pipeline.set(redis_hijack_key, yaml.dump(result))
-
-                # store the origin, neighbor combination for this hijack BGP update
-                origin = None
-                neighbor = None
-                if monitor_event["path"]:
-                    origin = monitor_event["path"][-1]
-                if len(monitor_event["path"]) > 1:
-                    neighbor = monitor_event["path"][-2]
-                redis_pipeline.sadd(
-                    "hij_orig_neighb_{}".format(redis_hijack_key),
-                    "{}_{}".format(origin, neighbor),
+
+                self.producer.publish(
+                    result,
+                    exchange=self.hijack_exchange,
+                    routing_key="update",
+                    serializer="yaml",
+                    priority=0,
                 )
 
-                # store the prefix and peer ASN for this hijack BGP update
-                redis_pipeline.sadd(
-                    "prefix_{}_peer_{}_hijacks".format(
-                        monitor_event["prefix"], monitor_event["peer_asn"]
-                    ),
-                    redis_hijack_key,
+                self.producer.publish(
+                    result,
+                    exchange=self.hijack_hashing,
+                    routing_key=redis_hijack_key,
+                    serializer="yaml",
+                    priority=0,
                 )
-                redis_pipeline.sadd(
-                    "hijack_{}_prefixes_peers".format(redis_hijack_key),
-                    "{}_{}".format(monitor_event["prefix"], monitor_event["peer_asn"]),
+                hij_log.info(
+                    "{}".format(
+                        json.dumps(hijack_log_field_formatter(result), cls=SetEncoder)
+                    ),
+                    extra={
+                        "community_annotation": result.get("community_annotation", "NA")
+                    },
                 )
-            except Exception:
-                log.exception("exception")
-            finally:
-                # unlock, by pushing back the token (at most one other process
-                # waiting will be unlocked)
-                redis_pipeline.set("{}token_active".format(redis_hijack_key), 1)
-                redis_pipeline.lpush("{}token".format(redis_hijack_key), "token")
-                redis_pipeline.execute()
 
-            self.producer.publish(
-                result,
-                exchange=self.hijack_exchange,
-                routing_key="update",
-                serializer="yaml",
-                priority=0,
+        @staticmethod
+        def __is_covered(hijack: Dict, hijack_value: Dict) -> bool:
+            """
+            Static method that checks if a (batched) hijack value adds
+            nothing new to a hijack record, apart from times and monitor keys.
+            """
+            return (
+                hijack_value["peers_seen"] <= hijack["peers_seen"]
+                and hijack_value["asns_inf"] <= hijack["asns_inf"]
+                and hijack_value["outdated_parent"] == hijack.get("outdated_parent")
+                and hijack_value.get("community_annotation", "NA")
+                in {"NA", hijack.get("community_annotation")}
             )
 
-            self.producer.publish(
-                result,
-                exchange=self.hijack_hashing,
-                routing_key=redis_hijack_key,
-                serializer="yaml",
-                priority=0,
+        def __merge_hijack(
+            self, client: redis.Redis, redis_hijack_key: str, hijack_value: Dict
+        ):
+            """
+            Merges the (batched) hijack value with the hijack stored in redis,
+            if any, using the merge script (on a redis client or pipeline).
+            """
+            ip_version = get_ip_version(hijack_value["prefix"])
+            prefix_node = self.prefix_tree[ip_version].get(hijack_value["prefix"])
+            annotation_ranking = []
+            if prefix_node:
+                annotation_ranking = prefix_node["data"]["verdict"].annotation_ranking
+            return self.merge_hijack_script(
+                keys=[redis_hijack_key, "persistent-keys", HIJACK_CACHE_CHANNEL],
+                args=[encode_hijack(hijack_value), self.cache_writer_id]
+                + annotation_ranking,
+                client=client,
             )
-            hij_log.info(
-                "{}".format(
-                    json.dumps(hijack_log_field_formatter(result), cls=SetEncoder)
+
+        def __merge_legacy_hijack(self, redis_hijack_key: str, hijack_value: Dict):
+            """
+            Migrates a legacy (YAML) hijack record to the binary codec and
+            merges the (batched) hijack value into it, in a transaction
+            that is retried if the record changes in between, so that no
+            concurrent merge is lost.
+            """
+            with self.redis.pipeline() as redis_pipeline:
+                while True:
+                    try:
+                        redis_pipeline.watch(redis_hijack_key)
+                        legacy_hijack = decode_hijack(
+                            redis_pipeline.get(redis_hijack_key)
+                        )
+                        redis_pipeline.multi()
+                        if legacy_hijack:
+                            redis_pipeline.set(
+                                redis_hijack_key, encode_hijack(legacy_hijack)
+                            )
+                        self.__merge_hijack(
+                            redis_pipeline, redis_hijack_key, hijack_value
+                        )
+                        return redis_pipeline.execute()[-1]
+                    except redis.WatchError:
+                        continue
+
+        @staticmethod
+        def __store_hijack_update_info(
+            redis_pipeline: redis.client.Pipeline,
+            redis_hijack_key: str,
+            monitor_event: Dict,
+            known_members: set = None,
+        ) -> NoReturn:
+            """
+            Static method that stores the origin/neighbor and prefix/peer
+            information of a hijack BGP update in redis, unless it is
+            already known to be stored (known_members, updated in-place).
+            """
+            # store the origin, neighbor combination for this hijack BGP update
+            origin = None
+            neighbor = None
+            if monitor_event["path"]:
+                origin = monitor_event["path"][-1]
+            if len(monitor_event["path"]) > 1:
+                neighbor = monitor_event["path"][-2]
+            origin_neighbor = "{}_{}".format(origin, neighbor)
+            prefix_peer = "{}_{}".format(
+                monitor_event["prefix"], monitor_event["peer_asn"]
+            )
+            if known_members is not None:
+                if (origin_neighbor, prefix_peer) in known_members:
+                    return
+                known_members.add((origin_neighbor, prefix_peer))
+
+            redis_pipeline.sadd(
+                "hij_orig_neighb_{}".format(redis_hijack_key), origin_neighbor
+            )
+
+            # store the prefix and peer ASN for this hijack BGP update
+            redis_pipeline.sadd(
+                "prefix_{}_peer_{}_hijacks".format(
+                    monitor_event["prefix"], monitor_event["peer_asn"]
                 ),
-                extra={
-                    "community_annotation": result.get("community_annotation", "NA")
-                },
+                redis_hijack_key,
+            )
+            redis_pipeline.sadd(
+                "hijack_{}_prefixes_peers".format(redis_hijack_key), prefix_peer
             )
 
-        def mark_handled(self, monitor_event: Dict) -> NoReturn:
+        def mark_handled(self, monitor_events: List[Dict]) -> NoReturn:
             """
-            Marks a bgp update as handled on the database.
+            Marks a batch of bgp updates as handled on the database.
             """
-            # log.debug('{}'.format(monitor_event['key']))
+            # log.debug('{}'.format(monitor_events))
             self.producer.publish(
-                monitor_event["key"],
+                [monitor_event["key"] for monitor_event in monitor_events],
                 exchange=self.handled_exchange,
                 routing_key="update",
                 priority=1,
@@ -1018,28 +1486,40 @@ class Detection:
                 msg, exchange=self.hijack_exchange, routing_key="outdate", priority=1
             )
 
-        def gen_implicit_withdrawal(self, monitor_event: Dict) -> NoReturn:
+        def gen_implicit_withdrawals(self, monitor_events: List[Dict]) -> NoReturn:
             """
-            Checks if a benign BGP update should trigger an implicit withdrawal
+            Checks if benign BGP updates should trigger implicit withdrawals
             """
-            # log.debug('{}'.format(monitor_event['key']))
-            prefix = monitor_event["prefix"]
-            peer_asn = monitor_event["peer_asn"]
-            if self.redis.exists("prefix_{}_peer_{}_hijacks".format(prefix, peer_asn)):
+            # log.debug('{}'.format(monitor_events))
+            redis_pipeline = self.redis.pipeline()
+            for monitor_event in monitor_events:
+                redis_pipeline.exists(
+                    "prefix_{}_peer_{}_hijacks".format(
+                        monitor_event["prefix"], monitor_event["peer_asn"]
+                    )
+                )
+            withdraw_msgs = []
+            for (monitor_event, exists) in zip(
+                monitor_events, redis_pipeline.execute()
+            ):
+                if not exists:
+                    continue
                 # generate implicit withdrawal
                 withdraw_msg = {
                     "service": "implicit-withdrawal",
                     "type": "W",
-                    "prefix": prefix,
+                    "prefix": monitor_event["prefix"],
                     "path": [],
                     "orig_path": {"triggering_bgp_update": monitor_event},
                     "communities": [],
                     "timestamp": monitor_event["timestamp"] + 1,
-                    "peer_asn": peer_asn,
+                    "peer_asn": monitor_event["peer_asn"],
                 }
                 key_generator(withdraw_msg)
+                withdraw_msgs.append(withdraw_msg)
+            if withdraw_msgs:
                 self.producer.publish(
-                    withdraw_msg,
+                    withdraw_msgs,
                     exchange=self.update_exchange,
                     routing_key="update",
                     serializer="json",
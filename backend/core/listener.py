@@ -60,7 +60,12 @@ def run():
                     db_cursor.execute(query, (process, new_state))
                     db_conn.commit()
                 except Exception:
-                    db_conn.rollback()
+                    if db_conn.closed:
+                        # reconnect on failure
+                        db_conn = create_connect_db()
+                        db_cursor = db_conn.cursor()
+                    else:
+                        db_conn.rollback()
 
         # acknowledge the event
         write_stdout("RESULT 2\nOK")
@@ -28,8 +28,9 @@ class Scheduler:
     class Worker:
         def __init__(self, connection):
             self.connection = connection
-            # Time in secs to gather entries to perform a bulk operation
-            self.time_to_wait = float(os.getenv("BULK_TIMER", 1))
+            # Time in secs between bulk operation heartbeats; the database
+            # flushes adaptively on its own, so this is only a fallback
+            self.time_to_wait = float(os.getenv("BULK_TIMER", 5))
 
             self.db_clock_exchange = Exchange(
                 "db-clock",
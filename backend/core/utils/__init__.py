@@ -2,15 +2,20 @@ import hashlib
 import json
 import logging.config
 import logging.handlers
+import math
 import os
 import re
+import struct
+import threading
 import time
 from contextlib import contextmanager
 from ipaddress import ip_network as str2ip
 from logging.handlers import SMTPHandler
 from xmlrpc.client import ServerProxy
 
+import msgpack
 import psycopg2
+import psycopg2.pool
 import requests
 import yaml
 
@@ -19,17 +24,35 @@ BACKEND_SUPERVISOR_PORT = os.getenv("BACKEND_SUPERVISOR_PORT", 9001)
 MON_SUPERVISOR_HOST = os.getenv("MON_SUPERVISOR_HOST", "monitor")
 MON_SUPERVISOR_PORT = os.getenv("MON_SUPERVISOR_PORT", 9001)
 HISTORIC = os.getenv("HISTORIC", "false")
+# route bgp updates to detectors by configured super-prefix (consistent hashing)
+DETECTION_SHARDING = os.getenv("DETECTION_SHARDING", "false")
 DB_NAME = os.getenv("DB_NAME", "artemis_db")
 DB_USER = os.getenv("DB_USER", "artemis_user")
 DB_HOST = os.getenv("DB_HOST", "postgres")
 DB_PORT = os.getenv("DB_PORT", 5432)
 DB_PASS = os.getenv("DB_PASS", "Art3m1s")
+# optional read replica for read-only connections
+DB_RO_HOST = os.getenv("DB_RO_HOST", DB_HOST)
+DB_RO_PORT = os.getenv("DB_RO_PORT", DB_PORT)
+# connections per pool (and process), and idle time in secs after which
+# pooled connections are checked before use
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 8))
+DB_POOL_CHECK_INTERVAL = float(os.getenv("DB_POOL_CHECK_INTERVAL", 30))
 RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBITMQ_PORT = os.getenv("RABBITMQ_PORT", 5672)
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = os.getenv("REDIS_PORT", 6379)
+# dedup filter of seen bgp updates: expected updates per time bucket and
+# target false positive rate (over the whole window)
+SEEN_FILTER_CAPACITY = int(os.getenv("SEEN_FILTER_CAPACITY", 2000000))
+SEEN_FILTER_ERROR_RATE = float(os.getenv("SEEN_FILTER_ERROR_RATE", 0.001))
+# encoding of bgp update and hijack keys: "canonical" (byte-level) or
+# "legacy" (yaml-based, as generated by older versions)
+# (set once for both the monitor and the backend, e.g. in .env)
+KEY_ENCODING = os.getenv("ARTEMIS_KEY_ENCODING", "canonical")
 DEFAULT_HIJACK_LOG_FIELDS = json.dumps(
     [
         "prefix",
@@ -216,8 +239,95 @@ class ModulesState:
             return False
 
 
+class DBPool:
+    """
+    Thread-safe pool of database connections (read-only ones on the read
+    replica, if any). Checkouts block while all connections are in use;
+    connections idle for long are checked before use and broken ones are
+    replaced.
+    """
+
+    def __init__(
+        self, readonly=False, minconn=DB_POOL_MIN_SIZE, maxconn=DB_POOL_MAX_SIZE
+    ):
+        self.readonly = readonly
+        self.semaphore = threading.BoundedSemaphore(maxconn)
+        self.last_used = {}
+        self.pool = None
+        time_sleep_connection_retry = 5
+        while not self.pool:
+            try:
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    minconn,
+                    maxconn,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    host=DB_RO_HOST if readonly else DB_HOST,
+                    port=DB_RO_PORT if readonly else DB_PORT,
+                    password=DB_PASS,
+                )
+            except Exception:
+                log.exception("exception")
+                time.sleep(time_sleep_connection_retry)
+
+    def getconn(self):
+        time_sleep_connection_retry = 5
+        while True:
+            try:
+                conn = self.pool.getconn()
+            except psycopg2.OperationalError:
+                log.exception("exception")
+                time.sleep(time_sleep_connection_retry)
+                continue
+            if not conn.closed and (
+                time.time() - self.last_used.get(id(conn), 0) < DB_POOL_CHECK_INTERVAL
+                or self.ping(conn)
+            ):
+                break
+            self.pool.putconn(conn, close=True)
+        if self.readonly and not conn.autocommit:
+            conn.set_session(autocommit=True, readonly=True)
+        return conn
+
+    @staticmethod
+    def ping(conn):
+        try:
+            with conn.cursor() as curr:
+                curr.execute("SELECT 1")
+            if not conn.autocommit:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self):
+        with self.semaphore:
+            conn = self.getconn()
+            broken = False
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                self.last_used[id(conn)] = time.time()
+                self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def closeall(self):
+        self.pool.closeall()
+
+
 @contextmanager
 def get_ro_cursor(conn):
+    """
+    Cursor of a connection, or of a connection checked out of a pool.
+    """
+    if isinstance(conn, DBPool):
+        with conn.connection() as pool_conn:
+            with get_ro_cursor(pool_conn) as curr:
+                yield curr
+        return
     with conn.cursor() as curr:
         try:
             yield curr
@@ -227,6 +337,15 @@ def get_ro_cursor(conn):
 
 @contextmanager
 def get_wo_cursor(conn):
+    """
+    Cursor of a connection, or of a connection checked out of a pool, whose
+    statements are committed at once.
+    """
+    if isinstance(conn, DBPool):
+        with conn.connection() as pool_conn:
+            with get_wo_cursor(pool_conn) as curr:
+                yield curr
+        return
     with conn.cursor() as curr:
         try:
             yield curr
@@ -237,6 +356,46 @@ def get_wo_cursor(conn):
             conn.commit()
 
 
+@contextmanager
+def get_savepoint_cursor(conn, name="bulk"):
+    """
+    Cursor within the ongoing transaction of conn (committed by the caller),
+    whose statements are rolled back on error only.
+    """
+    with conn.cursor() as curr:
+        curr.execute("SAVEPOINT {}".format(name))
+        try:
+            yield curr
+        except Exception:
+            curr.execute("ROLLBACK TO SAVEPOINT {}".format(name))
+            raise
+        else:
+            curr.execute("RELEASE SAVEPOINT {}".format(name))
+
+
+@contextmanager
+def get_named_cursor(conn, name, itersize=2000):
+    """
+    Server-side cursor of conn (or of a connection checked out of a pool),
+    streaming its results in batches of itersize rows within a (read-only)
+    transaction of its own.
+    """
+    if isinstance(conn, DBPool):
+        with conn.connection() as pool_conn:
+            with get_named_cursor(pool_conn, name, itersize=itersize) as curr:
+                yield curr
+        return
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        with conn.cursor(name=name) as curr:
+            curr.itersize = itersize
+            yield curr
+    finally:
+        conn.rollback()
+        conn.autocommit = autocommit
+
+
 def get_db_conn():
     conn = None
     time_sleep_connection_retry = 5
@@ -303,46 +462,282 @@ def redis_key(prefix, hijack_as, _type):
     assert isinstance(prefix, str)
     assert isinstance(hijack_as, int)
     assert isinstance(_type, str)
+    if KEY_ENCODING == "legacy":
+        return legacy_redis_key(prefix, hijack_as, _type)
+    return get_canonical_hash([prefix, hijack_as, _type])
+
+
+def legacy_redis_key(prefix, hijack_as, _type):
     return get_hash([prefix, hijack_as, _type])
 
 
 def key_generator(msg):
-    msg["key"] = get_hash(
+    if KEY_ENCODING == "legacy":
+        msg["key"] = get_hash(
+            [
+                msg["prefix"],
+                msg["path"],
+                msg["type"],
+                "{0:.6f}".format(msg["timestamp"]),
+                msg["peer_asn"],
+            ]
+        )
+        return
+    msg["key"] = get_canonical_hash(
         [
             msg["prefix"],
             msg["path"],
             msg["type"],
-            "{0:.6f}".format(msg["timestamp"]),
+            int(round(msg["timestamp"] * 1000000)),
             msg["peer_asn"],
         ]
     )
 
 
+def hijack_key_generator(prefix, hijack_as, _type, time_detected):
+    if KEY_ENCODING == "legacy":
+        return get_hash([prefix, hijack_as, _type, "{0:.6f}".format(time_detected)])
+    return get_canonical_hash(
+        [prefix, hijack_as, _type, int(round(time_detected * 1000000))]
+    )
+
+
 def get_hash(obj):
     return hashlib.shake_128(yaml.dump(obj).encode("utf-8")).hexdigest(16)
 
 
-def purge_redis_eph_pers_keys(redis_instance, ephemeral_key, persistent_key):
-    redis_pipeline = redis_instance.pipeline()
-    # purge also tokens since they are not relevant any more
-    redis_pipeline.delete("{}token_active".format(ephemeral_key))
-    redis_pipeline.delete("{}token".format(ephemeral_key))
-    redis_pipeline.delete(ephemeral_key)
-    redis_pipeline.srem("persistent-keys", persistent_key)
-    redis_pipeline.delete("hij_orig_neighb_{}".format(ephemeral_key))
-    if redis_instance.exists("hijack_{}_prefixes_peers".format(ephemeral_key)):
-        for element in redis_instance.sscan_iter(
-            "hijack_{}_prefixes_peers".format(ephemeral_key)
-        ):
-            subelems = element.decode().split("_")
-            prefix_peer_hijack_set = "prefix_{}_peer_{}_hijacks".format(
-                subelems[0], subelems[1]
+def canonical_encode(fields):
+    """
+    Encodes a list of str, int and int-list (e.g., AS path) fields into an
+    unambiguous byte string; every field is a type tag followed by its
+    (length-prefixed, if variable) big-endian value.
+    """
+    chunks = []
+    for field in fields:
+        if isinstance(field, str):
+            data = field.encode("utf-8")
+            chunks.append(b"s" + struct.pack("!I", len(data)) + data)
+        elif isinstance(field, int):
+            chunks.append(b"i" + struct.pack("!q", field))
+        else:
+            chunks.append(
+                b"l" + struct.pack("!I{}q".format(len(field)), len(field), *field)
+            )
+    return b"".join(chunks)
+
+
+def get_canonical_hash(fields):
+    return hashlib.shake_128(canonical_encode(fields)).hexdigest(16)
+
+
+# version tag of binary hijack records in redis (legacy records are YAML)
+HIJACK_RECORD_V1 = b"\x01"
+# hijack record fields that are sets in memory and lists on the wire
+HIJACK_RECORD_SET_FIELDS = ("peers_seen", "asns_inf", "monitor_keys")
+# redis channel for invalidating cached hijack records (payload: "key [writer]")
+HIJACK_CACHE_CHANNEL = "hijack-cache-invalidation"
+# hijack record fields that may be null (dropped by server-side merges)
+HIJACK_RECORD_NULL_FIELDS = ("end_tag", "outdated_parent")
+
+
+def encode_hijack(hijack):
+    record = dict(hijack)
+    for field in HIJACK_RECORD_SET_FIELDS:
+        if field in record:
+            record[field] = list(record[field])
+    return HIJACK_RECORD_V1 + msgpack.packb(record, use_bin_type=True)
+
+
+def decode_hijack(raw):
+    if not raw:
+        return None
+    if raw[:1] != HIJACK_RECORD_V1:
+        # legacy YAML record, written before the binary codec
+        return yaml.safe_load(raw)
+    hijack = msgpack.unpackb(raw[1:], raw=False)
+    for field in HIJACK_RECORD_SET_FIELDS:
+        if field in hijack:
+            hijack[field] = set(hijack[field])
+    for field in HIJACK_RECORD_NULL_FIELDS:
+        hijack.setdefault(field, None)
+    return hijack
+
+
+# purges hijacks from redis in a single round-trip, regardless of the number
+# of (prefix, peer) pairs they have been seen from;
+# KEYS: persistent-keys, cache invalidation channel
+# ARGV: only-if-persistent flag, then (ephemeral key, persistent key) pairs
+# returns: the purged hijack records (nil if absent or skipped)
+PURGE_REDIS_EPH_PERS_KEYS_SCRIPT = """
+local purged = {}
+for i = 2, #ARGV, 2 do
+    local ephemeral_key = ARGV[i]
+    local persistent_key = ARGV[i + 1]
+    if ARGV[1] == '1' and redis.call('SISMEMBER', KEYS[1], persistent_key) == 0 then
+        table.insert(purged, false)
+    else
+        table.insert(purged, redis.call('GET', ephemeral_key))
+        redis.call('DEL', ephemeral_key)
+        redis.call('PUBLISH', KEYS[2], ephemeral_key)
+        redis.call('SREM', KEYS[1], persistent_key)
+        redis.call('DEL', 'hij_orig_neighb_' .. ephemeral_key)
+        local prefixes_peers = 'hijack_' .. ephemeral_key .. '_prefixes_peers'
+        for _, element in ipairs(redis.call('SMEMBERS', prefixes_peers)) do
+            local prefix, peer = string.match(element, '^([^_]*)_([^_]*)')
+            -- empty sets are removed by redis itself
+            redis.call(
+                'SREM', 'prefix_' .. prefix .. '_peer_' .. peer .. '_hijacks',
+                ephemeral_key
             )
-            redis_pipeline.srem(prefix_peer_hijack_set, ephemeral_key)
-            if redis_instance.scard(prefix_peer_hijack_set) <= 1:
-                redis_pipeline.delete(prefix_peer_hijack_set)
-        redis_pipeline.delete("hijack_{}_prefixes_peers".format(ephemeral_key))
-    redis_pipeline.execute()
+        end
+        redis.call('DEL', prefixes_peers)
+    end
+end
+return purged
+"""
+
+# registered once (on first use), then run against any redis client; the
+# script is loaded to a redis server on demand
+purge_redis_eph_pers_keys_script = None
+
+
+def purge_redis_eph_pers_keys_bulk(redis_instance, keys, only_persistent=False):
+    """
+    Purges many hijacks from redis at once.
+
+    :param keys: iterable of (ephemeral key, persistent key) pairs
+    :param only_persistent: purge only hijacks whose persistent key
+    is still in the persistent keys (i.e., ongoing hijacks)
+    :return: list of the purged (raw) hijack records, None if absent
+    """
+    args = ["1" if only_persistent else "0"]
+    for (ephemeral_key, persistent_key) in keys:
+        args.extend((ephemeral_key, persistent_key))
+    if len(args) == 1:
+        return []
+    global purge_redis_eph_pers_keys_script
+    if purge_redis_eph_pers_keys_script is None:
+        purge_redis_eph_pers_keys_script = redis_instance.register_script(
+            PURGE_REDIS_EPH_PERS_KEYS_SCRIPT
+        )
+    return purge_redis_eph_pers_keys_script(
+        keys=["persistent-keys", HIJACK_CACHE_CHANNEL], args=args, client=redis_instance
+    )
+
+
+def purge_redis_eph_pers_keys(
+    redis_instance, ephemeral_key, persistent_key, only_persistent=False
+):
+    """
+    Purges a hijack from redis, returning its (raw) record, if any.
+    """
+    return purge_redis_eph_pers_keys_bulk(
+        redis_instance, [(ephemeral_key, persistent_key)], only_persistent
+    )[0]
+
+
+# checks and adds bloom filter members (bit positions) to time-bucketed
+# redis bitmaps; KEYS: current bucket, then older buckets
+# ARGV: bucket expiration (sec), number of bits per member, bit positions
+# returns: per member, 1 if it was (probably) already seen, 0 otherwise
+SEEN_FILTER_SCRIPT = """
+local num_bits = tonumber(ARGV[2])
+local seen = {}
+for i = 3, #ARGV, num_bits do
+    local member_seen = true
+    for j = i, i + num_bits - 1 do
+        if redis.call('SETBIT', KEYS[1], ARGV[j], 1) == 0 then
+            member_seen = false
+        end
+    end
+    local k = 2
+    while not member_seen and k <= #KEYS do
+        member_seen = true
+        for j = i, i + num_bits - 1 do
+            if redis.call('GETBIT', KEYS[k], ARGV[j]) == 0 then
+                member_seen = false
+                break
+            end
+        end
+        k = k + 1
+    end
+    table.insert(seen, member_seen and 1 or 0)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return seen
+"""
+
+
+class SeenFilter:
+    """
+    Time-bucketed bloom filter (in redis) of the keys seen in a sliding
+    window; keys are (re)added to the bucket of the current time, so each
+    hit extends their lifetime, like a TTL reset.
+    """
+
+    def __init__(
+        self,
+        redis_instance,
+        name,
+        window=2 * 60 * 60,
+        buckets=4,
+        capacity=SEEN_FILTER_CAPACITY,
+        error_rate=SEEN_FILTER_ERROR_RATE,
+    ):
+        self.redis = redis_instance
+        self.name = name
+        self.bucket_size = window // buckets
+        # the bucket of the current time is partially filled
+        self.buckets = buckets + 1
+        bucket_error_rate = error_rate / self.buckets
+        self.num_bits = int(
+            math.ceil(-capacity * math.log(bucket_error_rate) / (math.log(2) ** 2))
+        )
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.script = self.redis.register_script(SEEN_FILTER_SCRIPT)
+
+    def bit_positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        (hash_1, hash_2) = struct.unpack("!QQ", digest)
+        return [(hash_1 + i * hash_2) % self.num_bits for i in range(self.num_hashes)]
+
+    def bucket_keys(self, timestamp):
+        bucket = int(timestamp) // self.bucket_size
+        return ["{}-{}".format(self.name, bucket - i) for i in range(self.buckets)]
+
+    def check_and_add(self, keys, timestamp=None):
+        """
+        Adds keys to the filter.
+
+        :param keys: list of keys
+        :param timestamp: time of the bucket to add the keys to (default: now)
+        :return: list of bools, True if the key was (probably) already seen
+        """
+        if not keys:
+            return []
+        if timestamp is None:
+            timestamp = time.time()
+        args = [self.bucket_size * self.buckets, self.num_hashes]
+        for key in keys:
+            args.extend(self.bit_positions(key))
+        seen = self.script(keys=self.bucket_keys(timestamp), args=args)
+        return [bool(member_seen) for member_seen in seen]
+
+    def add(self, entries, chunk_size=10000):
+        """
+        Adds keys to the buckets of their timestamps (e.g., on bootstrap).
+
+        :param entries: iterable of (key, timestamp)
+        """
+        bucket_keys = {}
+        for (key, timestamp) in entries:
+            bucket = int(timestamp) // self.bucket_size
+            bucket_keys.setdefault(bucket, []).append(key)
+        for (bucket, keys) in bucket_keys.items():
+            for i in range(0, len(keys), chunk_size):
+                self.check_and_add(
+                    keys[i : i + chunk_size], timestamp=bucket * self.bucket_size
+                )
 
 
 def valid_prefix(input_prefix):
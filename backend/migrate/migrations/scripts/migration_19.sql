@@ -0,0 +1,52 @@
+CREATE TABLE IF NOT EXISTS hijack_bgp_updates (
+    hijack_key VARCHAR ( 32 ) NOT NULL,
+    update_key VARCHAR ( 32 ) NOT NULL,
+    update_timestamp TIMESTAMP NOT NULL,
+    PRIMARY KEY(hijack_key, update_key, update_timestamp)
+);
+
+CREATE INDEX hijack_bgp_updates_update_idx
+ON hijack_bgp_updates(update_key, update_timestamp);
+
+INSERT INTO hijack_bgp_updates (hijack_key, update_key, update_timestamp)
+SELECT DISTINCT hijack_keys.hijack_key, bgp_updates.key, bgp_updates.timestamp
+FROM bgp_updates, unnest(bgp_updates.hijack_key) AS hijack_keys (hijack_key)
+WHERE hijack_keys.hijack_key IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+CREATE FUNCTION bgp_update_hijack_keys(update_key text, update_timestamp TIMESTAMP)
+RETURNS text[] AS $$
+    SELECT COALESCE(array_agg(hijack_bgp_updates.hijack_key::text), ARRAY[]::text[])
+    FROM hijack_bgp_updates
+    WHERE
+        hijack_bgp_updates.update_key = $1 AND hijack_bgp_updates.update_timestamp = $2
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE VIEW view_bgpupdates AS SELECT prefix, origin_as, peer_asn, as_path, service, type, communities, timestamp, bgp_update_hijack_keys(key, timestamp) AS hijack_key, handled, matched_prefix, orig_path FROM bgp_updates;
+
+CREATE OR REPLACE FUNCTION search_bgpupdates_by_hijack_key(key text)
+RETURNS SETOF view_bgpupdates AS $$
+    SELECT b.prefix, b.origin_as, b.peer_asn, b.as_path, b.service, b.type, b.communities, b.timestamp,
+        bgp_update_hijack_keys(b.key, b.timestamp), b.handled, b.matched_prefix, b.orig_path
+    FROM hijack_bgp_updates AS hb
+    JOIN bgp_updates AS b ON (b.key = hb.update_key AND b.timestamp = hb.update_timestamp)
+    WHERE
+        hb.hijack_key = $1
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION search_bgpupdates_by_as_path_and_hijack_key(key text, as_paths BIGINT[])
+RETURNS SETOF view_bgpupdates AS $$
+    SELECT b.prefix, b.origin_as, b.peer_asn, b.as_path, b.service, b.type, b.communities, b.timestamp,
+        bgp_update_hijack_keys(b.key, b.timestamp), b.handled, b.matched_prefix, b.orig_path
+    FROM hijack_bgp_updates AS hb
+    JOIN bgp_updates AS b ON (b.key = hb.update_key AND b.timestamp = hb.update_timestamp)
+    WHERE
+        hb.hijack_key = $1 and $2 <@ b.as_path
+$$ LANGUAGE sql STABLE;
+
+DROP INDEX IF EXISTS withdrawal_idx;
+
+ALTER TABLE bgp_updates DROP COLUMN hijack_key;
+
+CREATE INDEX withdrawal_idx
+ON bgp_updates(prefix, peer_asn, type);
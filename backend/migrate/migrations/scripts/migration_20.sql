@@ -0,0 +1,174 @@
+CREATE TABLE IF NOT EXISTS stats_counters (
+    name VARCHAR ( 32 ) PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO stats_counters (name) VALUES ('total_hijacks'), ('ignored_hijacks'), ('resolved_hijacks'), ('withdrawn_hijacks'), ('mitigation_hijacks'), ('ongoing_hijacks'), ('dormant_hijacks'), ('acknowledged_hijacks'), ('outdated_hijacks'), ('total_bgp_updates'), ('total_unhandled_updates');
+
+-- the row triggers accumulate the deltas of a statement in transaction-local
+-- settings, which are added to the counters once at the end of the statement
+CREATE FUNCTION stats_counters_add(counter text, delta BIGINT)
+RETURNS void
+LANGUAGE plpgsql AS $f$
+BEGIN
+    PERFORM set_config(
+        'stats_counters.' || counter,
+        (COALESCE(NULLIF(current_setting('stats_counters.' || counter, true), '')::BIGINT, 0) + delta)::text,
+        true
+    );
+END; $f$;
+
+CREATE FUNCTION stats_counters_add_hijack(hijack hijacks, delta BIGINT)
+RETURNS void
+LANGUAGE plpgsql AS $f$
+BEGIN
+    PERFORM stats_counters_add('total_hijacks', delta);
+    IF hijack.ignored THEN
+        PERFORM stats_counters_add('ignored_hijacks', delta);
+    END IF;
+    IF hijack.resolved THEN
+        PERFORM stats_counters_add('resolved_hijacks', delta);
+    END IF;
+    IF hijack.withdrawn THEN
+        PERFORM stats_counters_add('withdrawn_hijacks', delta);
+    END IF;
+    IF hijack.under_mitigation THEN
+        PERFORM stats_counters_add('mitigation_hijacks', delta);
+    END IF;
+    IF hijack.active THEN
+        PERFORM stats_counters_add('ongoing_hijacks', delta);
+    END IF;
+    IF hijack.dormant THEN
+        PERFORM stats_counters_add('dormant_hijacks', delta);
+    END IF;
+    IF hijack.seen THEN
+        PERFORM stats_counters_add('acknowledged_hijacks', delta);
+    END IF;
+    IF hijack.outdated THEN
+        PERFORM stats_counters_add('outdated_hijacks', delta);
+    END IF;
+END; $f$;
+
+CREATE FUNCTION stats_counters_hijacks_row()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM stats_counters_add_hijack(OLD, -1);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM stats_counters_add_hijack(NEW, 1);
+    END IF;
+    RETURN NULL;
+END; $f$;
+
+CREATE FUNCTION stats_counters_bgp_updates_row()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM stats_counters_add('total_bgp_updates', -1);
+        IF OLD.handled = false THEN
+            PERFORM stats_counters_add('total_unhandled_updates', -1);
+        END IF;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM stats_counters_add('total_bgp_updates', 1);
+        IF NEW.handled = false THEN
+            PERFORM stats_counters_add('total_unhandled_updates', 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END; $f$;
+
+-- all writers lock the counters before any rows, so that holding them until
+-- the end of a transaction cannot deadlock
+CREATE FUNCTION stats_counters_lock()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    PERFORM 1 FROM stats_counters ORDER BY name FOR UPDATE;
+    RETURN NULL;
+END; $f$;
+
+CREATE FUNCTION stats_counters_flush()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    UPDATE stats_counters SET value = stats_counters.value + deltas.delta
+    FROM (
+        SELECT name, COALESCE(NULLIF(current_setting('stats_counters.' || name, true), '')::BIGINT, 0) AS delta
+        FROM stats_counters
+    ) AS deltas
+    WHERE stats_counters.name = deltas.name AND deltas.delta <> 0;
+    PERFORM set_config('stats_counters.' || name, '0', true) FROM stats_counters;
+    RETURN NULL;
+END; $f$;
+
+-- recomputes the counters from scratch, e.g. after restoring data without triggers
+CREATE FUNCTION stats_counters_refresh()
+RETURNS void
+LANGUAGE sql AS $$
+    UPDATE stats_counters SET value = counts.value
+    FROM (VALUES
+        ('total_hijacks', (SELECT count(*) FROM hijacks WHERE key is not NULL)),
+        ('ignored_hijacks', (SELECT count(*) FROM hijacks WHERE ignored = true)),
+        ('resolved_hijacks', (SELECT count(*) FROM hijacks WHERE resolved = true)),
+        ('withdrawn_hijacks', (SELECT count(*) FROM hijacks WHERE withdrawn = true)),
+        ('mitigation_hijacks', (SELECT count(*) FROM hijacks WHERE under_mitigation = true)),
+        ('ongoing_hijacks', (SELECT count(*) FROM hijacks WHERE active = true)),
+        ('dormant_hijacks', (SELECT count(*) FROM hijacks WHERE dormant = true)),
+        ('acknowledged_hijacks', (SELECT count(*) FROM hijacks WHERE seen = true)),
+        ('outdated_hijacks', (SELECT count(*) FROM hijacks WHERE outdated = true)),
+        ('total_bgp_updates', (SELECT count(*) FROM bgp_updates WHERE key is not NULL)),
+        ('total_unhandled_updates', (SELECT count(*) FROM bgp_updates WHERE handled = false))
+    ) AS counts (name, value)
+    WHERE stats_counters.name = counts.name;
+$$;
+
+CREATE TRIGGER stats_counters_hijacks_lock
+BEFORE INSERT OR UPDATE OR DELETE ON hijacks
+FOR EACH STATEMENT EXECUTE PROCEDURE stats_counters_lock();
+
+CREATE TRIGGER stats_counters_hijacks_row
+AFTER INSERT OR UPDATE OR DELETE ON hijacks
+FOR EACH ROW EXECUTE PROCEDURE stats_counters_hijacks_row();
+
+CREATE TRIGGER stats_counters_hijacks_flush
+AFTER INSERT OR UPDATE OR DELETE ON hijacks
+FOR EACH STATEMENT EXECUTE PROCEDURE stats_counters_flush();
+
+CREATE TRIGGER stats_counters_bgp_updates_lock
+BEFORE INSERT OR UPDATE OR DELETE ON bgp_updates
+FOR EACH STATEMENT EXECUTE PROCEDURE stats_counters_lock();
+
+CREATE TRIGGER stats_counters_bgp_updates_insert_delete
+AFTER INSERT OR DELETE ON bgp_updates
+FOR EACH ROW EXECUTE PROCEDURE stats_counters_bgp_updates_row();
+
+CREATE TRIGGER stats_counters_bgp_updates_handled
+AFTER UPDATE ON bgp_updates
+FOR EACH ROW WHEN (OLD.handled IS DISTINCT FROM NEW.handled)
+EXECUTE PROCEDURE stats_counters_bgp_updates_row();
+
+CREATE TRIGGER stats_counters_bgp_updates_flush
+AFTER INSERT OR UPDATE OR DELETE ON bgp_updates
+FOR EACH STATEMENT EXECUTE PROCEDURE stats_counters_flush();
+
+SELECT stats_counters_refresh();
+
+CREATE OR REPLACE VIEW view_index_all_stats
+AS
+SELECT stats.monitored_prefixes, stats.configured_prefixes, stats.monitor_peers,
+    (SELECT value total_hijacks FROM stats_counters WHERE name = 'total_hijacks'),
+    (SELECT value ignored_hijacks FROM stats_counters WHERE name = 'ignored_hijacks'),
+    (SELECT value resolved_hijacks FROM stats_counters WHERE name = 'resolved_hijacks'),
+    (SELECT value withdrawn_hijacks FROM stats_counters WHERE name = 'withdrawn_hijacks'),
+    (SELECT value mitigation_hijacks FROM stats_counters WHERE name = 'mitigation_hijacks'),
+    (SELECT value ongoing_hijacks FROM stats_counters WHERE name = 'ongoing_hijacks'),
+    (SELECT value dormant_hijacks FROM stats_counters WHERE name = 'dormant_hijacks'),
+    (SELECT value acknowledged_hijacks FROM stats_counters WHERE name = 'acknowledged_hijacks'),
+    (SELECT value outdated_hijacks FROM stats_counters WHERE name = 'outdated_hijacks'),
+    (SELECT value total_bgp_updates FROM stats_counters WHERE name = 'total_bgp_updates'),
+    (SELECT value total_unhandled_updates FROM stats_counters WHERE name = 'total_unhandled_updates')
+FROM stats;
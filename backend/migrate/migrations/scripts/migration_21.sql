@@ -0,0 +1,21 @@
+-- prefix << $1 (inet_search)
+CREATE INDEX IF NOT EXISTS bgp_updates_prefix_gist_idx
+ON bgp_updates USING gist (prefix inet_ops);
+
+-- as_paths <@ as_path (search_bgpupdates_as_path*)
+CREATE INDEX IF NOT EXISTS bgp_updates_as_path_gin_idx
+ON bgp_updates USING gin (as_path);
+
+-- handled updates and rekeying look up bgp updates by key only
+CREATE INDEX IF NOT EXISTS bgp_updates_key_idx
+ON bgp_updates(key);
+
+-- only the (few) unhandled updates are ever searched for
+DROP INDEX IF EXISTS handled_idx;
+
+CREATE INDEX IF NOT EXISTS bgp_updates_unhandled_idx
+ON bgp_updates(key) WHERE handled = false;
+
+-- hijack actions look up hijacks by key only
+CREATE INDEX IF NOT EXISTS hijacks_key_idx
+ON hijacks(key);
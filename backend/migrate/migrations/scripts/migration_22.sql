@@ -0,0 +1,119 @@
+-- statements append their (per statement aggregated) counter deltas instead
+-- of adding them to the counters, so that writers no longer lock (and wait
+-- for) the counters; stats_counters_compact folds the deltas into the
+-- counters in a short transaction of its own
+CREATE TABLE IF NOT EXISTS stats_counters_deltas (
+    name VARCHAR ( 32 ) NOT NULL,
+    delta BIGINT NOT NULL
+);
+
+DROP TRIGGER IF EXISTS stats_counters_hijacks_lock ON hijacks;
+
+DROP TRIGGER IF EXISTS stats_counters_bgp_updates_lock ON bgp_updates;
+
+DROP FUNCTION IF EXISTS stats_counters_lock();
+
+CREATE OR REPLACE FUNCTION stats_counters_flush()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    INSERT INTO stats_counters_deltas (name, delta)
+    SELECT name, delta FROM (
+        SELECT name, COALESCE(NULLIF(current_setting('stats_counters.' || name, true), '')::BIGINT, 0) AS delta
+        FROM stats_counters
+    ) AS deltas
+    WHERE delta <> 0;
+    PERFORM set_config('stats_counters.' || name, '0', true) FROM stats_counters;
+    RETURN NULL;
+END; $f$;
+
+-- the counters are locked in the same order by all compactions
+CREATE FUNCTION stats_counters_compact()
+RETURNS void
+LANGUAGE plpgsql AS $f$
+BEGIN
+    PERFORM 1 FROM stats_counters ORDER BY name FOR UPDATE;
+    WITH deltas AS (DELETE FROM stats_counters_deltas RETURNING name, delta)
+    UPDATE stats_counters SET value = stats_counters.value + summed.delta
+    FROM (SELECT name, sum(delta) AS delta FROM deltas GROUP BY name) AS summed
+    WHERE stats_counters.name = summed.name;
+END; $f$;
+
+CREATE OR REPLACE FUNCTION stats_counters_refresh()
+RETURNS void
+LANGUAGE sql AS $$
+    DELETE FROM stats_counters_deltas;
+    UPDATE stats_counters SET value = counts.value
+    FROM (VALUES
+        ('total_hijacks', (SELECT count(*) FROM hijacks WHERE key is not NULL)),
+        ('ignored_hijacks', (SELECT count(*) FROM hijacks WHERE ignored = true)),
+        ('resolved_hijacks', (SELECT count(*) FROM hijacks WHERE resolved = true)),
+        ('withdrawn_hijacks', (SELECT count(*) FROM hijacks WHERE withdrawn = true)),
+        ('mitigation_hijacks', (SELECT count(*) FROM hijacks WHERE under_mitigation = true)),
+        ('ongoing_hijacks', (SELECT count(*) FROM hijacks WHERE active = true)),
+        ('dormant_hijacks', (SELECT count(*) FROM hijacks WHERE dormant = true)),
+        ('acknowledged_hijacks', (SELECT count(*) FROM hijacks WHERE seen = true)),
+        ('outdated_hijacks', (SELECT count(*) FROM hijacks WHERE outdated = true)),
+        ('total_bgp_updates', (SELECT count(*) FROM bgp_updates WHERE key is not NULL)),
+        ('total_unhandled_updates', (SELECT count(*) FROM bgp_updates WHERE handled = false))
+    ) AS counts (name, value)
+    WHERE stats_counters.name = counts.name;
+$$;
+
+-- a single setting per flip of handled
+CREATE FUNCTION stats_counters_bgp_updates_handled()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    IF OLD.handled = false THEN
+        PERFORM stats_counters_add('total_unhandled_updates', -1);
+    END IF;
+    IF NEW.handled = false THEN
+        PERFORM stats_counters_add('total_unhandled_updates', 1);
+    END IF;
+    RETURN NULL;
+END; $f$;
+
+-- bulk writers (e.g. COPY) may switch the bgp updates row triggers off for
+-- a statement with stats_counters.bgp_updates = 'off', appending its deltas
+-- themselves
+DROP TRIGGER IF EXISTS stats_counters_bgp_updates_insert_delete ON bgp_updates;
+
+CREATE TRIGGER stats_counters_bgp_updates_insert_delete
+AFTER INSERT OR DELETE ON bgp_updates
+FOR EACH ROW WHEN (current_setting('stats_counters.bgp_updates', true) IS DISTINCT FROM 'off')
+EXECUTE PROCEDURE stats_counters_bgp_updates_row();
+
+DROP TRIGGER IF EXISTS stats_counters_bgp_updates_handled ON bgp_updates;
+
+CREATE TRIGGER stats_counters_bgp_updates_handled
+AFTER UPDATE ON bgp_updates
+FOR EACH ROW WHEN (OLD.handled IS DISTINCT FROM NEW.handled AND current_setting('stats_counters.bgp_updates', true) IS DISTINCT FROM 'off')
+EXECUTE PROCEDURE stats_counters_bgp_updates_handled();
+
+CREATE OR REPLACE VIEW view_index_all_stats
+AS
+SELECT stats.monitored_prefixes, stats.configured_prefixes, stats.monitor_peers,
+    counters.total_hijacks, counters.ignored_hijacks, counters.resolved_hijacks,
+    counters.withdrawn_hijacks, counters.mitigation_hijacks, counters.ongoing_hijacks,
+    counters.dormant_hijacks, counters.acknowledged_hijacks, counters.outdated_hijacks,
+    counters.total_bgp_updates, counters.total_unhandled_updates
+FROM stats, (
+    SELECT
+        sum(value) FILTER (WHERE name = 'total_hijacks')::BIGINT AS total_hijacks,
+        sum(value) FILTER (WHERE name = 'ignored_hijacks')::BIGINT AS ignored_hijacks,
+        sum(value) FILTER (WHERE name = 'resolved_hijacks')::BIGINT AS resolved_hijacks,
+        sum(value) FILTER (WHERE name = 'withdrawn_hijacks')::BIGINT AS withdrawn_hijacks,
+        sum(value) FILTER (WHERE name = 'mitigation_hijacks')::BIGINT AS mitigation_hijacks,
+        sum(value) FILTER (WHERE name = 'ongoing_hijacks')::BIGINT AS ongoing_hijacks,
+        sum(value) FILTER (WHERE name = 'dormant_hijacks')::BIGINT AS dormant_hijacks,
+        sum(value) FILTER (WHERE name = 'acknowledged_hijacks')::BIGINT AS acknowledged_hijacks,
+        sum(value) FILTER (WHERE name = 'outdated_hijacks')::BIGINT AS outdated_hijacks,
+        sum(value) FILTER (WHERE name = 'total_bgp_updates')::BIGINT AS total_bgp_updates,
+        sum(value) FILTER (WHERE name = 'total_unhandled_updates')::BIGINT AS total_unhandled_updates
+    FROM (
+        SELECT name, value FROM stats_counters
+        UNION ALL
+        SELECT name, delta FROM stats_counters_deltas
+    ) AS counter_values
+) AS counters;
@@ -1,14 +1,27 @@
-COPY bgp_updates (key, prefix, origin_as, peer_asn, as_path, service, type, communities, "timestamp", hijack_key, handled, matched_prefix, orig_path) FROM stdin;
-61abd848862ccf957d11fc9726ee1602	139.5.46.0/24	133720	8283	{8283,6453,4755,45194,133720,133720,133720}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.62	{a}	t	139.0.0.0/8	null
-c641d5cc2529b9fc3df8316b2b1b8d87	10.91.236.0/24	136334	8283	{8283,6453,4755,45194,136334}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.75	{b}	t	10.0.0.0/8	null
-4e7eed3e86a4cdaf2165b2e56ad016b4	139.5.237.0/24	136334	8283	{8283,6453,4755,45194,136334}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.75	{c}	t	139.0.0.0/8	null
-79fccbbcfcb6b8aadf9a91b5560b5abe	139.5.238.0/24	136334	8283	{8283,6453,4755,45194,136334}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.75	{d}	t	139.0.0.0/8	null
-3e79b39bfd7862a0c757b31501d16bbf	139.5.239.0/24	136334	8283	{8283,6453,4755,45194,136334}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.75	{e}	t	139.0.0.0/8	null
-ca7a6987045334df736c0569e3aa17fc	139.5.29.0/24	133720	8283	{8283,6453,4755,45194,133720}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.76	{f}	t	139.0.0.0/8	null
-d6581b8e5efc20c67404683ea16d9f04	139.5.45.0/24	133720	8283	{8283,6453,4755,45194,133720}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.76	{g}	t	139.0.0.0/8	null
-4a647d51626bad5763a659215cf93b24	139.5.24.0/24	133720	8283	{8283,6453,4755,45194,133720}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.76	{h}	t	139.0.0.0/8	null
-b4b5125fe7f7530a2aad50a5b6dbbde4	139.5.16.0/22	133676	8283	{8283,6453,4755,133676}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.76	{i}	t	139.0.0.0/8	null
-c4b5125fe7f7530a2aad50a5b6dbbde5	2001:db8:abcd:12::/80	133677	8283	{8283,6453,4755,133677}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:06.76	{k}	t	2001:db8:abcd:12::/64	null
+COPY bgp_updates (key, prefix, origin_as, peer_asn, as_path, service, type, communities, "timestamp", handled, matched_prefix, orig_path) FROM stdin;
+61abd848862ccf957d11fc9726ee1602	139.5.46.0/24	133720	8283	{8283,6453,4755,45194,133720,133720,133720}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.62	t	139.0.0.0/8	null
+c641d5cc2529b9fc3df8316b2b1b8d87	10.91.236.0/24	136334	8283	{8283,6453,4755,45194,136334}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.75	t	10.0.0.0/8	null
+4e7eed3e86a4cdaf2165b2e56ad016b4	139.5.237.0/24	136334	8283	{8283,6453,4755,45194,136334}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.75	t	139.0.0.0/8	null
+79fccbbcfcb6b8aadf9a91b5560b5abe	139.5.238.0/24	136334	8283	{8283,6453,4755,45194,136334}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.75	t	139.0.0.0/8	null
+3e79b39bfd7862a0c757b31501d16bbf	139.5.239.0/24	136334	8283	{8283,6453,4755,45194,136334}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.75	t	139.0.0.0/8	null
+ca7a6987045334df736c0569e3aa17fc	139.5.29.0/24	133720	8283	{8283,6453,4755,45194,133720}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.76	t	139.0.0.0/8	null
+d6581b8e5efc20c67404683ea16d9f04	139.5.45.0/24	133720	8283	{8283,6453,4755,45194,133720}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.76	t	139.0.0.0/8	null
+4a647d51626bad5763a659215cf93b24	139.5.24.0/24	133720	8283	{8283,6453,4755,45194,133720}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.76	t	139.0.0.0/8	null
+b4b5125fe7f7530a2aad50a5b6dbbde4	139.5.16.0/22	133676	8283	{8283,6453,4755,133676}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:05.76	t	139.0.0.0/8	null
+c4b5125fe7f7530a2aad50a5b6dbbde5	2001:db8:abcd:12::/80	133677	8283	{8283,6453,4755,133677}	ripe-ris|rrc03	A	[[6453, 2000], [6453, 2100], [6453, 2104], [6453, 10002], [8283, 1], [8283, 101]]	2019-02-23 16:59:06.76	t	2001:db8:abcd:12::/64	null
+\.
+
+COPY hijack_bgp_updates (hijack_key, update_key, update_timestamp) FROM stdin;
+a	61abd848862ccf957d11fc9726ee1602	2019-02-23 16:59:05.62
+b	c641d5cc2529b9fc3df8316b2b1b8d87	2019-02-23 16:59:05.75
+c	4e7eed3e86a4cdaf2165b2e56ad016b4	2019-02-23 16:59:05.75
+d	79fccbbcfcb6b8aadf9a91b5560b5abe	2019-02-23 16:59:05.75
+e	3e79b39bfd7862a0c757b31501d16bbf	2019-02-23 16:59:05.75
+f	ca7a6987045334df736c0569e3aa17fc	2019-02-23 16:59:05.76
+g	d6581b8e5efc20c67404683ea16d9f04	2019-02-23 16:59:05.76
+h	4a647d51626bad5763a659215cf93b24	2019-02-23 16:59:05.76
+i	b4b5125fe7f7530a2aad50a5b6dbbde4	2019-02-23 16:59:05.76
+k	c4b5125fe7f7530a2aad50a5b6dbbde5	2019-02-23 16:59:06.76
 \.
 
 COPY hijacks (key, type, prefix, hijack_as, peers_seen, community_annotation, peers_withdrawn, num_peers_seen, asns_inf, num_asns_inf, time_started, time_last, time_ended, mitigation_started, time_detected, under_mitigation, resolved, active, ignored, withdrawn, outdated, dormant, configured_prefix, timestamp_of_config, comment, seen) FROM stdin;
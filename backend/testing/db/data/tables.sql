@@ -22,7 +22,7 @@ CREATE TRIGGER db_details_no_delete
 BEFORE DELETE ON db_details
 FOR EACH ROW EXECUTE PROCEDURE db_version_no_delete();
 
-INSERT INTO db_details (version, upgraded_on) VALUES (18, now());
+INSERT INTO db_details (version, upgraded_on) VALUES (22, now());
 
 CREATE TABLE IF NOT EXISTS bgp_updates (
     key VARCHAR ( 32 ) NOT NULL,
@@ -34,7 +34,6 @@ CREATE TABLE IF NOT EXISTS bgp_updates (
     type  VARCHAR ( 1 ),
     communities  json,
     timestamp TIMESTAMP  NOT NULL,
-    hijack_key text[],
     handled   BOOLEAN,
     matched_prefix inet,
     orig_path json,
@@ -43,10 +42,19 @@ CREATE TABLE IF NOT EXISTS bgp_updates (
 );
 
 CREATE INDEX withdrawal_idx
-ON bgp_updates(prefix, peer_asn, type, hijack_key);
+ON bgp_updates(prefix, peer_asn, type);
 
-CREATE INDEX handled_idx
-ON bgp_updates(handled);
+CREATE INDEX bgp_updates_prefix_gist_idx
+ON bgp_updates USING gist (prefix inet_ops);
+
+CREATE INDEX bgp_updates_as_path_gin_idx
+ON bgp_updates USING gin (as_path);
+
+CREATE INDEX bgp_updates_key_idx
+ON bgp_updates(key);
+
+CREATE INDEX bgp_updates_unhandled_idx
+ON bgp_updates(key) WHERE handled = false;
 
 SELECT create_hypertable('bgp_updates', 'timestamp', if_not_exists => TRUE);
 
@@ -133,8 +141,29 @@ ON hijacks(active);
 CREATE INDEX hijack_table_idx
 ON hijacks(time_last, hijack_as, prefix, type);
 
+CREATE INDEX hijacks_key_idx
+ON hijacks(key);
+
 SELECT create_hypertable('hijacks', 'time_detected', if_not_exists => TRUE);
 
+CREATE TABLE IF NOT EXISTS hijack_bgp_updates (
+    hijack_key VARCHAR ( 32 ) NOT NULL,
+    update_key VARCHAR ( 32 ) NOT NULL,
+    update_timestamp TIMESTAMP NOT NULL,
+    PRIMARY KEY(hijack_key, update_key, update_timestamp)
+);
+
+CREATE INDEX hijack_bgp_updates_update_idx
+ON hijack_bgp_updates(update_key, update_timestamp);
+
+CREATE FUNCTION bgp_update_hijack_keys(update_key text, update_timestamp TIMESTAMP)
+RETURNS text[] AS $$
+    SELECT COALESCE(array_agg(hijack_bgp_updates.hijack_key::text), ARRAY[]::text[])
+    FROM hijack_bgp_updates
+    WHERE
+        hijack_bgp_updates.update_key = $1 AND hijack_bgp_updates.update_timestamp = $2
+$$ LANGUAGE sql STABLE;
+
 create trigger send_hijack_event
 after insert or update on hijacks
 for each row execute procedure rabbitmq.on_row_change("hijack-update");
@@ -168,27 +197,215 @@ FOR EACH ROW EXECUTE PROCEDURE stats_no_delete();
 
 INSERT INTO stats (monitored_prefixes, configured_prefixes, monitor_peers) VALUES (0, 0, 0);
 
+CREATE TABLE IF NOT EXISTS stats_counters (
+    name VARCHAR ( 32 ) PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO stats_counters (name) VALUES ('total_hijacks'), ('ignored_hijacks'), ('resolved_hijacks'), ('withdrawn_hijacks'), ('mitigation_hijacks'), ('ongoing_hijacks'), ('dormant_hijacks'), ('acknowledged_hijacks'), ('outdated_hijacks'), ('total_bgp_updates'), ('total_unhandled_updates');
+
+-- statements append their deltas here instead of locking the counters;
+-- stats_counters_compact folds them into the counters
+CREATE TABLE IF NOT EXISTS stats_counters_deltas (
+    name VARCHAR ( 32 ) NOT NULL,
+    delta BIGINT NOT NULL
+);
+
+-- the row triggers accumulate the deltas of a statement in transaction-local
+-- settings, which are appended to the deltas once at the end of the statement
+CREATE FUNCTION stats_counters_add(counter text, delta BIGINT)
+RETURNS void
+LANGUAGE plpgsql AS $f$
+BEGIN
+    PERFORM set_config(
+        'stats_counters.' || counter,
+        (COALESCE(NULLIF(current_setting('stats_counters.' || counter, true), '')::BIGINT, 0) + delta)::text,
+        true
+    );
+END; $f$;
+
+CREATE FUNCTION stats_counters_add_hijack(hijack hijacks, delta BIGINT)
+RETURNS void
+LANGUAGE plpgsql AS $f$
+BEGIN
+    PERFORM stats_counters_add('total_hijacks', delta);
+    IF hijack.ignored THEN
+        PERFORM stats_counters_add('ignored_hijacks', delta);
+    END IF;
+    IF hijack.resolved THEN
+        PERFORM stats_counters_add('resolved_hijacks', delta);
+    END IF;
+    IF hijack.withdrawn THEN
+        PERFORM stats_counters_add('withdrawn_hijacks', delta);
+    END IF;
+    IF hijack.under_mitigation THEN
+        PERFORM stats_counters_add('mitigation_hijacks', delta);
+    END IF;
+    IF hijack.active THEN
+        PERFORM stats_counters_add('ongoing_hijacks', delta);
+    END IF;
+    IF hijack.dormant THEN
+        PERFORM stats_counters_add('dormant_hijacks', delta);
+    END IF;
+    IF hijack.seen THEN
+        PERFORM stats_counters_add('acknowledged_hijacks', delta);
+    END IF;
+    IF hijack.outdated THEN
+        PERFORM stats_counters_add('outdated_hijacks', delta);
+    END IF;
+END; $f$;
+
+CREATE FUNCTION stats_counters_hijacks_row()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM stats_counters_add_hijack(OLD, -1);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM stats_counters_add_hijack(NEW, 1);
+    END IF;
+    RETURN NULL;
+END; $f$;
+
+CREATE FUNCTION stats_counters_bgp_updates_row()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM stats_counters_add('total_bgp_updates', -1);
+        IF OLD.handled = false THEN
+            PERFORM stats_counters_add('total_unhandled_updates', -1);
+        END IF;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM stats_counters_add('total_bgp_updates', 1);
+        IF NEW.handled = false THEN
+            PERFORM stats_counters_add('total_unhandled_updates', 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END; $f$;
+
+CREATE FUNCTION stats_counters_flush()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    INSERT INTO stats_counters_deltas (name, delta)
+    SELECT name, delta FROM (
+        SELECT name, COALESCE(NULLIF(current_setting('stats_counters.' || name, true), '')::BIGINT, 0) AS delta
+        FROM stats_counters
+    ) AS deltas
+    WHERE delta <> 0;
+    PERFORM set_config('stats_counters.' || name, '0', true) FROM stats_counters;
+    RETURN NULL;
+END; $f$;
+
+-- the counters are locked in the same order by all compactions
+CREATE FUNCTION stats_counters_compact()
+RETURNS void
+LANGUAGE plpgsql AS $f$
+BEGIN
+    PERFORM 1 FROM stats_counters ORDER BY name FOR UPDATE;
+    WITH deltas AS (DELETE FROM stats_counters_deltas RETURNING name, delta)
+    UPDATE stats_counters SET value = stats_counters.value + summed.delta
+    FROM (SELECT name, sum(delta) AS delta FROM deltas GROUP BY name) AS summed
+    WHERE stats_counters.name = summed.name;
+END; $f$;
+
+-- recomputes the counters from scratch, e.g. after restoring data without triggers
+CREATE FUNCTION stats_counters_refresh()
+RETURNS void
+LANGUAGE sql AS $$
+    DELETE FROM stats_counters_deltas;
+    UPDATE stats_counters SET value = counts.value
+    FROM (VALUES
+        ('total_hijacks', (SELECT count(*) FROM hijacks WHERE key is not NULL)),
+        ('ignored_hijacks', (SELECT count(*) FROM hijacks WHERE ignored = true)),
+        ('resolved_hijacks', (SELECT count(*) FROM hijacks WHERE resolved = true)),
+        ('withdrawn_hijacks', (SELECT count(*) FROM hijacks WHERE withdrawn = true)),
+        ('mitigation_hijacks', (SELECT count(*) FROM hijacks WHERE under_mitigation = true)),
+        ('ongoing_hijacks', (SELECT count(*) FROM hijacks WHERE active = true)),
+        ('dormant_hijacks', (SELECT count(*) FROM hijacks WHERE dormant = true)),
+        ('acknowledged_hijacks', (SELECT count(*) FROM hijacks WHERE seen = true)),
+        ('outdated_hijacks', (SELECT count(*) FROM hijacks WHERE outdated = true)),
+        ('total_bgp_updates', (SELECT count(*) FROM bgp_updates WHERE key is not NULL)),
+        ('total_unhandled_updates', (SELECT count(*) FROM bgp_updates WHERE handled = false))
+    ) AS counts (name, value)
+    WHERE stats_counters.name = counts.name;
+$$;
+
+-- a single setting per flip of handled
+CREATE FUNCTION stats_counters_bgp_updates_handled()
+RETURNS trigger
+LANGUAGE plpgsql AS $f$
+BEGIN
+    IF OLD.handled = false THEN
+        PERFORM stats_counters_add('total_unhandled_updates', -1);
+    END IF;
+    IF NEW.handled = false THEN
+        PERFORM stats_counters_add('total_unhandled_updates', 1);
+    END IF;
+    RETURN NULL;
+END; $f$;
+
+CREATE TRIGGER stats_counters_hijacks_row
+AFTER INSERT OR UPDATE OR DELETE ON hijacks
+FOR EACH ROW EXECUTE PROCEDURE stats_counters_hijacks_row();
+
+CREATE TRIGGER stats_counters_hijacks_flush
+AFTER INSERT OR UPDATE OR DELETE ON hijacks
+FOR EACH STATEMENT EXECUTE PROCEDURE stats_counters_flush();
+
+-- bulk writers (e.g. COPY) may switch the bgp updates row triggers off for
+-- a statement with stats_counters.bgp_updates = 'off', appending its deltas
+-- themselves
+CREATE TRIGGER stats_counters_bgp_updates_insert_delete
+AFTER INSERT OR DELETE ON bgp_updates
+FOR EACH ROW WHEN (current_setting('stats_counters.bgp_updates', true) IS DISTINCT FROM 'off')
+EXECUTE PROCEDURE stats_counters_bgp_updates_row();
+
+CREATE TRIGGER stats_counters_bgp_updates_handled
+AFTER UPDATE ON bgp_updates
+FOR EACH ROW WHEN (OLD.handled IS DISTINCT FROM NEW.handled AND current_setting('stats_counters.bgp_updates', true) IS DISTINCT FROM 'off')
+EXECUTE PROCEDURE stats_counters_bgp_updates_handled();
+
+CREATE TRIGGER stats_counters_bgp_updates_flush
+AFTER INSERT OR UPDATE OR DELETE ON bgp_updates
+FOR EACH STATEMENT EXECUTE PROCEDURE stats_counters_flush();
+
 CREATE OR REPLACE VIEW view_configs AS SELECT raw_config, comment, time_modified FROM configs;
 
 CREATE OR REPLACE VIEW view_hijacks AS SELECT key, type, prefix, hijack_as, num_peers_seen, num_asns_inf, time_started, time_ended, time_last, mitigation_started, time_detected, timestamp_of_config, under_mitigation, resolved, active, dormant, ignored, configured_prefix, comment, seen, withdrawn, peers_withdrawn, peers_seen, outdated, community_annotation FROM hijacks;
 
-CREATE OR REPLACE VIEW view_bgpupdates AS SELECT prefix, origin_as, peer_asn, as_path, service, type, communities, timestamp, hijack_key, handled, matched_prefix, orig_path FROM bgp_updates;
+CREATE OR REPLACE VIEW view_bgpupdates AS SELECT prefix, origin_as, peer_asn, as_path, service, type, communities, timestamp, bgp_update_hijack_keys(key, timestamp) AS hijack_key, handled, matched_prefix, orig_path FROM bgp_updates;
 
 CREATE OR REPLACE VIEW view_index_all_stats
 AS
 SELECT stats.monitored_prefixes, stats.configured_prefixes, stats.monitor_peers,
-    (SELECT count(*) total_hijacks FROM hijacks WHERE key is not NULL),
-    (SELECT count(*) ignored_hijacks FROM hijacks WHERE ignored = true),
-    (SELECT count(*) resolved_hijacks FROM hijacks WHERE resolved = true),
-    (SELECT count(*) withdrawn_hijacks FROM hijacks WHERE withdrawn = true),
-    (SELECT count(*) mitigation_hijacks FROM hijacks WHERE under_mitigation = true),
-    (SELECT count(*) ongoing_hijacks FROM hijacks WHERE active = true),
-    (SELECT count(*) dormant_hijacks FROM hijacks WHERE dormant = true),
-    (SELECT count(*) acknowledged_hijacks FROM hijacks WHERE seen = true),
-    (SELECT count(*) outdated_hijacks FROM hijacks WHERE outdated = true),
-    (SELECT count(*) total_bgp_updates FROM bgp_updates WHERE key is not NULL),
-    (SELECT count(*) total_unhandled_updates FROM bgp_updates WHERE handled = false)
-FROM stats;
+    counters.total_hijacks, counters.ignored_hijacks, counters.resolved_hijacks,
+    counters.withdrawn_hijacks, counters.mitigation_hijacks, counters.ongoing_hijacks,
+    counters.dormant_hijacks, counters.acknowledged_hijacks, counters.outdated_hijacks,
+    counters.total_bgp_updates, counters.total_unhandled_updates
+FROM stats, (
+    SELECT
+        sum(value) FILTER (WHERE name = 'total_hijacks')::BIGINT AS total_hijacks,
+        sum(value) FILTER (WHERE name = 'ignored_hijacks')::BIGINT AS ignored_hijacks,
+        sum(value) FILTER (WHERE name = 'resolved_hijacks')::BIGINT AS resolved_hijacks,
+        sum(value) FILTER (WHERE name = 'withdrawn_hijacks')::BIGINT AS withdrawn_hijacks,
+        sum(value) FILTER (WHERE name = 'mitigation_hijacks')::BIGINT AS mitigation_hijacks,
+        sum(value) FILTER (WHERE name = 'ongoing_hijacks')::BIGINT AS ongoing_hijacks,
+        sum(value) FILTER (WHERE name = 'dormant_hijacks')::BIGINT AS dormant_hijacks,
+        sum(value) FILTER (WHERE name = 'acknowledged_hijacks')::BIGINT AS acknowledged_hijacks,
+        sum(value) FILTER (WHERE name = 'outdated_hijacks')::BIGINT AS outdated_hijacks,
+        sum(value) FILTER (WHERE name = 'total_bgp_updates')::BIGINT AS total_bgp_updates,
+        sum(value) FILTER (WHERE name = 'total_unhandled_updates')::BIGINT AS total_unhandled_updates
+    FROM (
+        SELECT name, value FROM stats_counters
+        UNION ALL
+        SELECT name, delta FROM stats_counters_deltas
+    ) AS counter_values
+) AS counters;
 
 CREATE OR REPLACE FUNCTION inet_search (inet)
 RETURNS SETOF bgp_updates AS $$
@@ -234,16 +451,20 @@ $$ LANGUAGE sql STABLE;
 
 CREATE FUNCTION search_bgpupdates_by_hijack_key(key text)
 RETURNS SETOF view_bgpupdates AS $$
-    SELECT *
-    FROM view_bgpupdates
+    SELECT b.prefix, b.origin_as, b.peer_asn, b.as_path, b.service, b.type, b.communities, b.timestamp,
+        bgp_update_hijack_keys(b.key, b.timestamp), b.handled, b.matched_prefix, b.orig_path
+    FROM hijack_bgp_updates AS hb
+    JOIN bgp_updates AS b ON (b.key = hb.update_key AND b.timestamp = hb.update_timestamp)
     WHERE
-        key = ANY(view_bgpupdates.hijack_key)
+        hb.hijack_key = $1
 $$ LANGUAGE sql STABLE;
 
 CREATE FUNCTION search_bgpupdates_by_as_path_and_hijack_key(key text, as_paths BIGINT[])
-    RETURNS SETOF view_bgpupdates AS $$
-    SELECT *
-    FROM view_bgpupdates
+RETURNS SETOF view_bgpupdates AS $$
+    SELECT b.prefix, b.origin_as, b.peer_asn, b.as_path, b.service, b.type, b.communities, b.timestamp,
+        bgp_update_hijack_keys(b.key, b.timestamp), b.handled, b.matched_prefix, b.orig_path
+    FROM hijack_bgp_updates AS hb
+    JOIN bgp_updates AS b ON (b.key = hb.update_key AND b.timestamp = hb.update_timestamp)
     WHERE
-        key = ANY(view_bgpupdates.hijack_key) and as_paths <@ view_bgpupdates.as_path
+        hb.hijack_key = $1 and $2 <@ b.as_path
 $$ LANGUAGE sql STABLE;
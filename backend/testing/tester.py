@@ -2,9 +2,11 @@ import datetime
 import difflib
 import hashlib
 import json
+import math
 import os
 import re
 import socket
+import struct
 import time
 from xmlrpc.client import ServerProxy
 
@@ -73,7 +75,7 @@ class Tester:
     def clear(self):
         db_con = self.getDbConnection()
         db_cur = db_con.cursor()
-        query = "delete from bgp_updates; delete from hijacks;"
+        query = "delete from bgp_updates; delete from hijacks; delete from hijack_bgp_updates;"
         db_cur.execute(query)
         db_con.commit()
         db_cur.close()
@@ -85,17 +87,64 @@ class Tester:
         self.send_cnt = 0
         self.expected_messages = 0
 
+    def get_hijack_keys(self, update_key):
+        db_con = self.getDbConnection()
+        db_cur = db_con.cursor()
+        query = "select hijack_key from hijack_bgp_updates where update_key = %s;"
+        db_cur.execute(query, (update_key,))
+        hijack_keys = [entry[0] for entry in db_cur.fetchall()]
+        db_cur.close()
+        db_con.close()
+        return hijack_keys
+
+    def is_seen_update(self, update_key, window=2 * 60 * 60, buckets=4):
+        # same parameters and hashing as the database seen updates filter
+        capacity = int(os.getenv("SEEN_FILTER_CAPACITY", 2000000))
+        error_rate = float(os.getenv("SEEN_FILTER_ERROR_RATE", 0.001)) / (buckets + 1)
+        num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        digest = hashlib.blake2b(update_key.encode("utf-8"), digest_size=16).digest()
+        (hash_1, hash_2) = struct.unpack("!QQ", digest)
+        bucket = int(time.time()) // (window // buckets)
+        for i in range(buckets + 1):
+            if all(
+                self.redis.getbit(
+                    "seen-updates-{}".format(bucket - i),
+                    (hash_1 + j * hash_2) % num_bits,
+                )
+                for j in range(num_hashes)
+            ):
+                return True
+        return False
+
     @staticmethod
     def redis_key(prefix, hijack_as, _type):
         assert isinstance(prefix, str)
         assert isinstance(hijack_as, int)
         assert isinstance(_type, str)
-        return Tester.get_hash([prefix, hijack_as, _type])
+        if os.getenv("ARTEMIS_KEY_ENCODING", "canonical") == "legacy":
+            return Tester.get_hash([prefix, hijack_as, _type])
+        return Tester.get_canonical_hash([prefix, hijack_as, _type])
 
     @staticmethod
     def get_hash(obj):
         return hashlib.shake_128(yaml.dump(obj).encode("utf-8")).hexdigest(16)
 
+    @staticmethod
+    def get_canonical_hash(fields):
+        chunks = []
+        for field in fields:
+            if isinstance(field, str):
+                data = field.encode("utf-8")
+                chunks.append(b"s" + struct.pack("!I", len(data)) + data)
+            elif isinstance(field, int):
+                chunks.append(b"i" + struct.pack("!q", field))
+            else:
+                chunks.append(
+                    b"l" + struct.pack("!I{}q".format(len(field)), len(field), *field)
+                )
+        return hashlib.shake_128(b"".join(chunks)).hexdigest(16)
+
     @staticmethod
     def waitExchange(exchange, channel):
         """
@@ -134,11 +183,16 @@ class Tester:
         # distinguish between type of messages
         if message.delivery_info["routing_key"] == "update-update":
             expected = self.messages[self.curr_idx]["detection_update_response"]
-            assert self.redis.exists(event["key"]), "Monitor key not found in Redis"
+            assert self.is_seen_update(
+                event["key"]
+            ), "Monitor key not found in Redis seen updates filter"
             if "peer_asn" in event:
                 assert self.redis.sismember(
                     "peer-asns", event["peer_asn"]
                 ), "Monitor/Peer ASN not found in Redis"
+            # hijacks are linked to bgp updates in the same transaction
+            if "hijack_key" not in event:
+                event["hijack_key"] = self.get_hijack_keys(event["key"])
         elif message.delivery_info["routing_key"] == "update":
             expected = self.messages[self.curr_idx]["detection_hijack_response"]
             redis_hijack_key = Tester.redis_key(
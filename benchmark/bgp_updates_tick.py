@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Times the statement updating the bgp updates of the database service per
+bulk (tick) against the tick (batch) size, on synthetic hijacks whose peers
+re-announce after withdrawing; everything is rolled back at the end.
+Runs next to the database service, importing its modules from
+backend/core (or BACKEND_CORE_DIR, e.g. /root/core within the backend
+container):
+
+    python bgp_updates_tick.py [batch size ...]
+"""
+import datetime
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.getenv(
+        "BACKEND_CORE_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "../backend/core"),
+    ),
+)
+
+from database import UPDATE_BGP_UPDATES_QUERY  # noqa: E402
+from utils import get_db_conn  # noqa: E402
+
+# the bgp updates of each synthetic hijack come from this many peers
+PEERS_PER_HIJACK = 10
+REPEAT = int(os.getenv("BENCHMARK_REPEAT", 5))
+
+INSERT_HIJACKS_QUERY = (
+    "INSERT INTO hijacks (key, type, prefix, hijack_as, peers_seen, peers_withdrawn, num_peers_seen, "
+    "asns_inf, num_asns_inf, time_started, time_last, time_detected, under_mitigation, resolved, "
+    "active, ignored, withdrawn, configured_prefix, timestamp_of_config, comment) "
+    "SELECT 'bench-hijack-' || h, 'S|0|-|-', '10.0.0.0/8', 666, peers, peers, %(peers)s, "
+    "ARRAY[]::bigint[], 0, now(), now(), now(), false, false, true, false, false, '10.0.0.0/8', now(), '' "
+    "FROM generate_series(1, %(hijacks)s) AS h, "
+    "(SELECT array_agg(p::bigint) AS peers FROM generate_series(1, %(peers)s) AS p) AS peers"
+)
+# withdrawals (linked to the hijacks) followed by announcements of each peer
+INSERT_BGP_UPDATES_QUERY = (
+    "INSERT INTO bgp_updates (key, prefix, origin_as, peer_asn, as_path, service, type, "
+    "communities, timestamp, handled, matched_prefix, orig_path) "
+    "SELECT 'bench-' || t || '-' || h || '-' || p, '10.0.0.0/8', 666, p, ARRAY[p, 666]::bigint[], "
+    "'bench', t, '[]', now() - (CASE WHEN t = 'W' THEN interval '2 minutes' ELSE interval '1 minute' END), "
+    "t = 'W', '10.0.0.0/8', '[]' "
+    "FROM generate_series(1, %(hijacks)s) AS h, generate_series(1, %(peers)s) AS p, "
+    "unnest(ARRAY['A', 'W']) AS t"
+)
+INSERT_HIJACK_BGP_UPDATES_QUERY = (
+    "INSERT INTO hijack_bgp_updates (hijack_key, update_key, update_timestamp) "
+    "SELECT 'bench-hijack-' || split_part(key, '-', 3), key, timestamp "
+    "FROM bgp_updates WHERE key LIKE 'bench-W-%'"
+)
+# unrelated bgp updates, handled in the same tick
+INSERT_HANDLED_BGP_UPDATES_QUERY = (
+    "INSERT INTO bgp_updates (key, prefix, origin_as, peer_asn, as_path, service, type, "
+    "communities, timestamp, handled, matched_prefix, orig_path) "
+    "SELECT 'bench-U-' || u, '10.0.0.0/8', 666, 1, ARRAY[1, 666]::bigint[], 'bench', 'A', "
+    "'[]', now(), false, '10.0.0.0/8', '[]' "
+    "FROM generate_series(1, %(handled)s) AS u"
+)
+
+
+def run_tick(db_cur, batch_size):
+    """
+    Creates the synthetic hijacks and bgp updates of a tick of batch_size
+    hijack bgp updates (rounded to whole hijacks, and as many handled ones)
+    and times the statement.
+
+    :param db_cur: <psycopg2 cursor> within a transaction to roll back
+    :param batch_size: <int> number of hijack bgp updates of the tick
+    :return: <list> durations of the statement in secs
+    """
+    hijacks = max(1, batch_size // PEERS_PER_HIJACK)
+    params = {"hijacks": hijacks, "peers": PEERS_PER_HIJACK, "handled": batch_size}
+    db_cur.execute(INSERT_HIJACKS_QUERY, params)
+    db_cur.execute(INSERT_BGP_UPDATES_QUERY, params)
+    db_cur.execute(INSERT_HIJACK_BGP_UPDATES_QUERY)
+    db_cur.execute(INSERT_HANDLED_BGP_UPDATES_QUERY, params)
+
+    hijack_keys = []
+    update_keys = []
+    for h in range(1, hijacks + 1):
+        for p in range(1, PEERS_PER_HIJACK + 1):
+            hijack_keys.append("bench-hijack-{}".format(h))
+            update_keys.append("bench-A-{}-{}".format(h, p))
+    handled_keys = update_keys + [
+        "bench-U-{}".format(u) for u in range(1, batch_size + 1)
+    ]
+
+    durations = []
+    for _ in range(REPEAT):
+        db_cur.execute("SAVEPOINT tick")
+        start = time.time()
+        db_cur.execute(
+            UPDATE_BGP_UPDATES_QUERY,
+            {
+                "hijack_keys": hijack_keys,
+                "update_keys": update_keys,
+                "timestamp_thres": datetime.datetime.fromtimestamp(0),
+                "handled_keys": handled_keys,
+            },
+        )
+        durations.append(time.time() - start)
+        db_cur.execute("ROLLBACK TO SAVEPOINT tick")
+    return durations
+
+
+def main():
+    batch_sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000]
+    db_conn = get_db_conn()
+    try:
+        for batch_size in batch_sizes:
+            with db_conn.cursor() as db_cur:
+                durations = run_tick(db_cur, batch_size)
+            db_conn.rollback()
+            print(
+                "[!] Tick of {} hijack (+ {} handled) updates: median {:.1f} ms, "
+                "min {:.1f} ms, {} updates/s".format(
+                    batch_size,
+                    batch_size,
+                    statistics.median(durations) * 1000,
+                    min(durations) * 1000,
+                    int(2 * batch_size / statistics.median(durations)),
+                )
+            )
+    finally:
+        db_conn.rollback()
+        db_conn.close()
+
+
+if __name__ == "__main__":
+    main()
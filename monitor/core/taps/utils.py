@@ -3,6 +3,7 @@ import hashlib
 import json
 import logging.config
 import os
+import struct
 import time
 from datetime import datetime
 from datetime import timedelta
@@ -20,6 +21,10 @@ RABBITMQ_URI = "amqp://{}:{}@{}:{}//".format(
 )
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = os.getenv("REDIS_PORT", 6379)
+# encoding of bgp update keys: "canonical" (byte-level) or
+# "legacy" (yaml-based, as generated by older versions)
+# (set once for both the monitor and the backend, e.g. in .env)
+KEY_ENCODING = os.getenv("ARTEMIS_KEY_ENCODING", "canonical")
 
 
 def get_logger(path="/etc/artemis/logging.yaml"):
@@ -57,12 +62,23 @@ def get_ip_version(prefix):
 
 
 def key_generator(msg):
-    msg["key"] = get_hash(
+    if KEY_ENCODING == "legacy":
+        msg["key"] = get_hash(
+            [
+                msg["prefix"],
+                msg["path"],
+                msg["type"],
+                "{0:.6f}".format(msg["timestamp"]),
+                msg["peer_asn"],
+            ]
+        )
+        return
+    msg["key"] = get_canonical_hash(
         [
             msg["prefix"],
             msg["path"],
             msg["type"],
-            "{0:.6f}".format(msg["timestamp"]),
+            int(round(msg["timestamp"] * 1000000)),
             msg["peer_asn"],
         ]
     )
@@ -72,6 +88,31 @@ def get_hash(obj):
     return hashlib.shake_128(yaml.dump(obj).encode("utf-8")).hexdigest(16)
 
 
+def canonical_encode(fields):
+    """
+    Encodes a list of str, int and int-list (e.g., AS path) fields into an
+    unambiguous byte string; every field is a type tag followed by its
+    (length-prefixed, if variable) big-endian value.
+    Must be kept in sync with the backend utils.
+    """
+    chunks = []
+    for field in fields:
+        if isinstance(field, str):
+            data = field.encode("utf-8")
+            chunks.append(b"s" + struct.pack("!I", len(data)) + data)
+        elif isinstance(field, int):
+            chunks.append(b"i" + struct.pack("!q", field))
+        else:
+            chunks.append(
+                b"l" + struct.pack("!I{}q".format(len(field)), len(field), *field)
+            )
+    return b"".join(chunks)
+
+
+def get_canonical_hash(fields):
+    return hashlib.shake_128(canonical_encode(fields)).hexdigest(16)
+
+
 def ping_redis(redis_instance, timeout=5):
     while True:
         try:
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+import argparse
+import os
+import sys
+
+import psycopg2
+
+# statistics of (hypertable) indexes and tables, summed over their chunks
+INDEX_USAGE_QUERY = (
+    "SELECT COALESCE(h.table_name, s.relname), "
+    "COALESCE(ci.hypertable_index_name, s.indexrelname), "
+    "sum(s.idx_scan)::bigint, sum(pg_relation_size(s.indexrelid))::bigint, "
+    "bool_or(i.indisunique) "
+    "FROM pg_stat_user_indexes AS s "
+    "JOIN pg_index AS i ON i.indexrelid = s.indexrelid "
+    "LEFT JOIN _timescaledb_catalog.chunk AS c "
+    "ON (c.schema_name = s.schemaname AND c.table_name = s.relname) "
+    "LEFT JOIN _timescaledb_catalog.chunk_index AS ci "
+    "ON (ci.chunk_id = c.id AND ci.index_name = s.indexrelname) "
+    "LEFT JOIN _timescaledb_catalog.hypertable AS h ON h.id = ci.hypertable_id "
+    "GROUP BY 1, 2 ORDER BY 1, 2"
+)
+TABLE_USAGE_QUERY = (
+    "SELECT COALESCE(h.table_name, s.relname), sum(s.seq_scan)::bigint, "
+    "sum(s.seq_tup_read)::bigint, sum(COALESCE(s.idx_scan, 0))::bigint "
+    "FROM pg_stat_user_tables AS s "
+    "LEFT JOIN _timescaledb_catalog.chunk AS c "
+    "ON (c.schema_name = s.schemaname AND c.table_name = s.relname) "
+    "LEFT JOIN _timescaledb_catalog.hypertable AS h ON h.id = c.hypertable_id "
+    "WHERE s.schemaname NOT IN ('_timescaledb_catalog', '_timescaledb_config') "
+    "GROUP BY 1 ORDER BY 1"
+)
+TOP_QUERIES_QUERY = (
+    "SELECT calls, total_time, rows, shared_blks_read, query "
+    "FROM pg_stat_statements "
+    "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+    "ORDER BY total_time DESC LIMIT %s"
+)
+
+
+def report_unused_indexes(cur, max_scans):
+    """
+    Report the indexes scanned at most max_scans times since the statistics
+    were last reset; unique indexes (and primary keys) are never reported,
+    as they enforce constraints.
+
+    :param cur: <psycopg2 cursor>
+    :param max_scans: <int> scans up to which an index is unused
+    :return: -
+    """
+    cur.execute(INDEX_USAGE_QUERY)
+    unused = [
+        (table, index, scans, size)
+        for (table, index, scans, size, unique) in cur.fetchall()
+        if not unique and scans <= max_scans
+    ]
+    print("Unused indexes (at most {} scans):".format(max_scans))
+    for (table, index, scans, size) in sorted(unused, key=lambda x: -x[3]):
+        print(
+            "  {}.{}: {} scans, {:.1f} MB".format(
+                table, index, scans, size / (1024.0 * 1024.0)
+            )
+        )
+    if not unused:
+        print("  none")
+
+
+def report_missing_indexes(cur, min_rows):
+    """
+    Report the tables scanned sequentially more often than through their
+    indexes, reading on average at least min_rows rows per sequential scan;
+    these are likely searched on columns that are not indexed.
+
+    :param cur: <psycopg2 cursor>
+    :param min_rows: <int> rows per sequential scan from which to report
+    :return: -
+    """
+    cur.execute(TABLE_USAGE_QUERY)
+    missing = [
+        (table, seq_scans, seq_rows, idx_scans)
+        for (table, seq_scans, seq_rows, idx_scans) in cur.fetchall()
+        if seq_scans > idx_scans and seq_rows >= min_rows * seq_scans > 0
+    ]
+    print(
+        "Tables likely missing indexes (at least {} rows per sequential scan):".format(
+            min_rows
+        )
+    )
+    for (table, seq_scans, seq_rows, idx_scans) in sorted(missing, key=lambda x: -x[2]):
+        print(
+            "  {}: {} sequential scans ({} rows/scan), {} index scans".format(
+                table, seq_scans, seq_rows // seq_scans, idx_scans
+            )
+        )
+    if not missing:
+        print("  none")
+
+
+def report_top_queries(cur, top):
+    """
+    Report the queries recorded by pg_stat_statements with the highest total
+    time, i.e. the ones to EXPLAIN against the missing indexes.
+
+    :param cur: <psycopg2 cursor>
+    :param top: <int> number of queries to report
+    :return: -
+    """
+    print("Top {} queries by total time:".format(top))
+    try:
+        cur.execute(TOP_QUERIES_QUERY, (top,))
+    except psycopg2.Error:
+        cur.connection.rollback()
+        print("  pg_stat_statements is not available")
+        return
+    for (calls, total_time, rows, blks_read, query) in cur.fetchall():
+        print(
+            "  {:.0f} ms, {} calls, {} rows, {} blocks read: {}".format(
+                total_time, calls, rows, blks_read, " ".join(query.split())
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="report unused and missing indexes of the artemis database"
+    )
+    parser.add_argument(
+        "--host", dest="host", type=str, default=os.getenv("DB_HOST", "localhost")
+    )
+    parser.add_argument(
+        "--port", dest="port", type=int, default=int(os.getenv("DB_PORT", 5432))
+    )
+    parser.add_argument(
+        "--dbname", dest="dbname", type=str, default=os.getenv("DB_NAME", "artemis_db")
+    )
+    parser.add_argument(
+        "--user", dest="user", type=str, default=os.getenv("DB_USER", "artemis_user")
+    )
+    parser.add_argument(
+        "--password", dest="password", type=str, default=os.getenv("DB_PASS", "Art3m1s")
+    )
+    parser.add_argument(
+        "--max-scans",
+        dest="max_scans",
+        type=int,
+        default=0,
+        help="scans up to which an index is considered unused",
+    )
+    parser.add_argument(
+        "--min-rows",
+        dest="min_rows",
+        type=int,
+        default=10000,
+        help="rows per sequential scan from which a table is considered missing indexes",
+    )
+    parser.add_argument(
+        "--top",
+        dest="top",
+        type=int,
+        default=10,
+        help="number of recorded queries to report",
+    )
+    args = parser.parse_args()
+
+    try:
+        conn = psycopg2.connect(
+            host=args.host,
+            port=args.port,
+            dbname=args.dbname,
+            user=args.user,
+            password=args.password,
+        )
+    except psycopg2.Error as e:
+        print("Could not connect to the database: {}".format(e))
+        sys.exit(1)
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()"
+            )
+            print(
+                "Statistics since: {}".format(cur.fetchone()[0] or "database creation")
+            )
+            report_unused_indexes(cur, args.max_scans)
+            report_missing_indexes(cur, args.min_rows)
+            report_top_queries(cur, args.top)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,7 @@ re='^[0-9]+$'
 if [[ $DB_AUTOCLEAN =~ $re ]]; then
     cat > /etc/periodic/hourly/cleanup <<EOF
 #!/bin/sh
-psql -d $POSTGRES_DB -U $POSTGRES_USER -c "DELETE FROM bgp_updates WHERE timestamp < NOW() - interval '${DB_AUTOCLEAN} hours' AND hijack_key=ARRAY[]::text[];"
+psql -d $POSTGRES_DB -U $POSTGRES_USER -c "DELETE FROM bgp_updates WHERE timestamp < NOW() - interval '${DB_AUTOCLEAN} hours' AND NOT EXISTS (SELECT 1 FROM hijack_bgp_updates WHERE hijack_bgp_updates.update_key=bgp_updates.key AND hijack_bgp_updates.update_timestamp=bgp_updates.timestamp);"
 EOF
     chmod +x /etc/periodic/hourly/cleanup
 else